@@ -1,7 +1,10 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
+import asyncio
+import logging
 import sys
+import time
 import traceback
 from datetime import datetime
 
@@ -17,9 +20,18 @@ from botbuilder.schema import Activity, ActivityTypes
 
 from bot import MyBot
 from config import DefaultConfig
+from db import DB_EXECUTOR, POOL, evict_idle_connections, run_in_db_executor
+from dimensions import DIMENSIONS
+from llm import LLM
+from metrics import REGISTRY, log_event
+from rollups import ROLLUPS
+from schema import SCHEMA
 
 CONFIG = DefaultConfig()
 
+# Structured per-turn lines from metrics.log_event are already JSON
+logging.basicConfig(level=CONFIG.LOG_LEVEL, format="%(message)s")
+
 # Create adapter.
 # See https://aka.ms/about-bot-adapter to learn more about how bots work.
 SETTINGS = BotFrameworkAdapterSettings(CONFIG.APP_ID, CONFIG.APP_PASSWORD)
@@ -58,31 +70,152 @@ ADAPTER.on_turn_error = on_error
 BOT = MyBot()
 
 
+# Turns being processed by this worker, awaited before it shuts down
+IN_FLIGHT_TURNS = set()
+DRAINING = asyncio.Event()
+# Periodic jobs started with the app and cancelled when it stops
+BACKGROUND_TASKS = []
+# Set once the SQL pool and schema cache are warm; WARM_UP holds how each step went
+READY = asyncio.Event()
+WARM_UP = {}
+
+
 # Listen for incoming requests on /api/messages
 async def messages(req: Request) -> Response:
+    # A draining worker sends new turns back so the channel retries them elsewhere
+    if DRAINING.is_set():
+        return Response(status=503, headers={"Retry-After": "1"})
+
     # Main bot message handler.
     if "application/json" in req.headers["Content-Type"]:
         body = await req.json()
     else:
         return Response(status=415)
 
+    task = asyncio.current_task()
+    IN_FLIGHT_TURNS.add(task)
+    try:
+        return await process_message(req, body)
+    finally:
+        IN_FLIGHT_TURNS.discard(task)
+
+
+async def process_message(req: Request, body) -> Response:
     activity = Activity().deserialize(body)
-    print(activity.text)
     auth_header = req.headers["Authorization"] if "Authorization" in req.headers else ""
-    print(auth_header)
 
     response = await ADAPTER.process_activity(activity, auth_header, BOT.on_turn)
-    print(response)
     if response:
         return json_response(data=response.body, status=response.status)
     return Response(status=201)
 
 
+# Prometheus-style latency histograms and LLM token counters
+async def metrics(req: Request) -> Response:
+    return Response(
+        body=REGISTRY.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+# Readiness probe: 503 until the SQL pool and schemas are warm, so new (or
+# broken) instances only get traffic once they can answer
+async def ready(req: Request) -> Response:
+    if not READY.is_set():
+        return json_response({"status": "warming_up", "warm_up": WARM_UP}, status=503)
+    return json_response({"status": "ready", "warm_up": WARM_UP})
+
+
+async def warm_pool():
+    await run_in_db_executor(POOL.warm)
+    return f"{POOL.size} open"
+
+
+async def warm_schemas():
+    return ", ".join(await SCHEMA.refresh())
+
+
+async def warm_llm():
+    connected = await LLM.warm([CONFIG.GPT4V_NLP_TO_SQL_ENDPOINT, CONFIG.GPT4V_SQL_TO_NLP_ENDPOINT])
+    return f"{connected} endpoint(s)"
+
+
+# Open the SQL connection pool, load table schemas and connect to the LLM
+# endpoints before the first turn needs them, all at once. Failed steps are
+# retried until the pool and schemas are warm; the LLM session is optional.
+async def warm_resources():
+    started = time.perf_counter()
+    steps = {"sql_pool": warm_pool, "schema_cache": warm_schemas, "llm_session": warm_llm}
+    while steps:
+        outcomes = await asyncio.gather(*(step() for step in steps.values()), return_exceptions=True)
+        for name, outcome in zip(list(steps), outcomes):
+            if isinstance(outcome, Exception):
+                WARM_UP[name] = f"failed: {outcome}"
+                print(f"Warm-up of {name} failed: {outcome}", file=sys.stderr)
+            else:
+                WARM_UP[name] = f"ok ({outcome})"
+                del steps[name]
+        if not READY.is_set() and "sql_pool" not in steps and "schema_cache" not in steps:
+            WARM_UP["seconds"] = round(time.perf_counter() - started, 2)
+            READY.set()
+            log_event("warmed_up", **WARM_UP)
+        if READY.is_set():
+            # Connecting to the LLM is only an optimization; not worth retrying
+            return
+        await asyncio.sleep(CONFIG.WARM_UP_RETRY_INTERVAL)
+
+
+# Warm up in the background so the worker starts listening straight away.
+async def warm_up(app: web.Application):
+    BACKGROUND_TASKS.append(asyncio.create_task(warm_resources()))
+    BACKGROUND_TASKS.append(
+        asyncio.create_task(evict_idle_connections(POOL, CONFIG.SQL_POOL_IDLE_TIMEOUT / 2))
+    )
+
+    if CONFIG.FAST_PATH_ENABLED or CONFIG.VALUE_GROUNDING_ENABLED:
+        BACKGROUND_TASKS.append(
+            asyncio.create_task(DIMENSIONS.run_scheduled(CONFIG.DIMENSION_REFRESH_INTERVAL))
+        )
+    if CONFIG.ROLLUPS_ENABLED:
+        BACKGROUND_TASKS.append(
+            asyncio.create_task(ROLLUPS.run_scheduled(CONFIG.ROLLUP_REFRESH_INTERVAL))
+        )
+
+
+# Stop taking turns and let the ones in progress finish before resources close.
+async def drain(app: web.Application):
+    DRAINING.set()
+    pending = list(IN_FLIGHT_TURNS)
+    if pending:
+        print(f"Draining {len(pending)} in-flight turn(s)...")
+        done, still_running = await asyncio.wait(pending, timeout=CONFIG.SHUTDOWN_DRAIN_TIMEOUT)
+        if still_running:
+            print(f"{len(still_running)} turn(s) still running after {CONFIG.SHUTDOWN_DRAIN_TIMEOUT}s", file=sys.stderr)
+
+
+async def close_resources(app: web.Application):
+    for task in BACKGROUND_TASKS:
+        task.cancel()
+    await LLM.close()
+    POOL.close()
+    DB_EXECUTOR.shutdown(wait=False)
+
+
 APP = web.Application(middlewares=[aiohttp_error_middleware])
 APP.router.add_post("/api/messages", messages)
+APP.router.add_get("/metrics", metrics)
+APP.router.add_get("/ready", ready)
+APP.on_startup.append(warm_up)
+APP.on_shutdown.append(drain)
+APP.on_cleanup.append(close_resources)
 
 if __name__ == "__main__":
     try:
-        web.run_app(APP, host="localhost", port=CONFIG.PORT)
+        web.run_app(
+            APP,
+            host=CONFIG.HOST,
+            port=CONFIG.PORT,
+            shutdown_timeout=CONFIG.SHUTDOWN_DRAIN_TIMEOUT,
+        )
     except Exception as error:
         raise error
@@ -0,0 +1,296 @@
+"""Answer a file of questions offline, e.g. for a scheduled morning report.
+
+    python batch.py questions.txt --output answers.jsonl
+    python batch.py questions.csv --output answers.csv --concurrency 8
+
+Questions are read one per line (``#`` starts a comment), or from the
+``question`` field of a ``.jsonl`` / ``.csv`` file. Repeated questions are
+answered once. All SQL is generated first, then identical queries are run
+once and each table's queries share one connection. Questions whose query
+failed or came back empty go through the bot's usual repair path. Small
+talk ("hi", "thanks") gets the bot's usual reply and no SQL.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import sys
+import time
+
+from bot import (
+    Answer,
+    RESULT_CACHE,
+    answer_question,
+    execute_sql_query,
+    generate_sql,
+    prepare_sql,
+    results_answer,
+    template_answer,
+)
+from cache import normalize_query
+from config import DefaultConfig
+from db import DB_EXECUTOR, POOL, run_with_connection
+from dimensions import DIMENSIONS
+from llm import LLM, TokenBucket
+from metrics import log_event
+from preflight import PreflightError, QueryTimeoutError, SqlExecutionError
+from results import QueryResult
+from router import match_table_name
+from smalltalk import REPLIES, classify
+from summaries import NO_RESULTS_TEXT
+from templates import match_template
+
+CONFIG = DefaultConfig()
+
+CSV_FIELDS = ("question", "table", "sql", "answer", "row_count", "error")
+
+
+class BatchItem:
+    """One distinct question and what the batch made of it."""
+
+    __slots__ = (
+        "question",
+        "intent",
+        "match",
+        "table_name",
+        "sql_query",
+        "prepared",
+        "results",
+        "answer",
+        "text",
+        "error",
+    )
+
+    def __init__(self, question):
+        self.question = question
+        self.intent = None
+        self.match = None
+        self.table_name = None
+        self.sql_query = None
+        self.prepared = None
+        self.results = None
+        self.answer = None
+        self.text = None
+        self.error = None
+
+    def record(self, question, max_rows):
+        answer = self.answer or Answer()
+        # Single-value answers are phrased as text; the rows are kept anyway
+        results = answer.results if answer.results is not None else self.results
+        return {
+            "question": question,
+            "table": answer.table_name,
+            "sql": answer.sql_query,
+            "answer": self.text,
+            "row_count": len(results) if results is not None else None,
+            "truncated": results.truncated if results is not None else None,
+            "columns": list(results.columns) if results is not None else None,
+            "rows": [list(row) for row in results.rows[:max_rows]] if results is not None else None,
+            "error": self.error,
+        }
+
+
+def read_questions(path):
+    with open(path, newline="", encoding="utf-8") as source:
+        if path.endswith(".jsonl"):
+            questions = [json.loads(line)["question"] for line in source if line.strip()]
+        elif path.endswith(".csv"):
+            questions = [row["question"] for row in csv.DictReader(source)]
+        else:
+            questions = [line for line in source if not line.lstrip().startswith("#")]
+    return [question.strip() for question in questions if question and question.strip()]
+
+
+async def plan(item):
+    """Find the SQL for a question: a template if one fits, else the model."""
+    item.intent = classify(item.question)
+    if item.intent is not None:
+        # "hi", "thanks": answered like the bot does, without SQL
+        item.text = REPLIES[item.intent]
+        return
+    if CONFIG.FAST_PATH_ENABLED:
+        item.match = match_template(item.question)
+    if item.match is not None:
+        item.table_name, item.sql_query = item.match.table_name, item.match.sql_query
+    else:
+        try:
+            item.table_name, item.sql_query = await generate_sql(item.question)
+        except Exception as error:
+            # Retried, with the interactive error handling, when answering
+            log_event("batch_plan_failed", question=item.question, error=str(error))
+            return
+    if not item.sql_query:
+        return
+    item.table_name = item.table_name or match_table_name(item.sql_query)
+    try:
+        item.prepared = await prepare_sql(item.sql_query)
+    except PreflightError:
+        pass
+
+
+def execute_group(sql_queries, conn):
+    """Run each query on the same connection; failures are returned, not raised."""
+    outcomes = {}
+    for sql_query in sql_queries:
+        try:
+            outcomes[sql_query] = execute_sql_query(sql_query, conn)
+        except (PreflightError, SqlExecutionError, QueryTimeoutError) as error:
+            outcomes[sql_query] = error
+    return outcomes
+
+
+async def run_queries(items, connections):
+    """Run each distinct prepared query once, one connection per table.
+
+    Returns ``{sql: QueryResult or error}``; queries whose connection
+    failed are left out.
+    """
+    outcomes, by_table = {}, {}
+    for item in items:
+        if item.prepared is None or item.prepared in outcomes:
+            continue
+        cached = RESULT_CACHE.get(item.prepared)
+        if cached is not None:
+            outcomes[item.prepared] = cached
+        else:
+            by_table.setdefault(item.table_name, set()).add(item.prepared)
+
+    slots = asyncio.Semaphore(connections)
+
+    async def run_table(table_name, sql_queries):
+        async with slots:
+            try:
+                group = await run_with_connection(lambda conn: execute_group(sql_queries, conn))
+            except Exception as error:
+                log_event("batch_table_failed", table=table_name, queries=len(sql_queries), error=str(error))
+                return
+        for sql_query, results in group.items():
+            if isinstance(results, QueryResult) and results:
+                RESULT_CACHE.set(sql_query, results)
+        outcomes.update(group)
+
+    await asyncio.gather(
+        *(run_table(table_name, sorted(sql_queries)) for table_name, sql_queries in by_table.items())
+    )
+    return outcomes
+
+
+async def finish(item, outcomes):
+    """Build the answer from the batch's result, or through the interactive path."""
+    if item.intent is not None:
+        return
+    results = outcomes.get(item.prepared)
+    try:
+        if isinstance(results, QueryResult) and (results or not CONFIG.SQL_REPAIR_EMPTY_RESULTS):
+            item.results = results
+            if item.match is not None:
+                item.answer = template_answer(item.match, results)
+            elif results:
+                item.answer = results_answer(item.question, results, item.table_name, item.sql_query)
+            else:
+                item.answer = Answer(text=NO_RESULTS_TEXT, table_name=item.table_name, sql_query=item.sql_query)
+        else:
+            # Failed, empty or never run: the repair loop may still save it
+            item.answer = await answer_question(item.question)
+        item.text = item.answer.text if item.answer.text is not None else await item.answer.summary
+    except Exception as error:
+        item.error = f"{type(error).__name__}: {error}"
+
+
+async def run_batch(questions, concurrency=None, connections=None, max_rows=None):
+    """Answer ``questions``; returns one record per question, in order.
+
+    At most ``concurrency`` questions are being planned or answered at a
+    time and at most ``connections`` tables queried at once, so a batch can
+    run next to the bot without starving it.
+    """
+    concurrency = concurrency or CONFIG.BATCH_CONCURRENCY
+    connections = connections or CONFIG.BATCH_DB_CONNECTIONS
+    max_rows = CONFIG.BATCH_OUTPUT_ROWS if max_rows is None else max_rows
+    started = time.perf_counter()
+
+    items = {}
+    for question in questions:
+        items.setdefault(normalize_query(question), BatchItem(question))
+    distinct = list(items.values())
+    slots = asyncio.Semaphore(concurrency)
+
+    async def bounded(work, item, *args):
+        async with slots:
+            await work(item, *args)
+
+    await asyncio.gather(*(bounded(plan, item) for item in distinct))
+    outcomes = await run_queries(distinct, connections)
+    await asyncio.gather(*(bounded(finish, item, outcomes) for item in distinct))
+
+    log_event(
+        "batch_finished",
+        questions=len(questions),
+        distinct_questions=len(distinct),
+        distinct_queries=len(outcomes),
+        errors=sum(1 for item in distinct if item.error),
+        seconds=round(time.perf_counter() - started, 1),
+    )
+    return [items[normalize_query(question)].record(question, max_rows) for question in questions]
+
+
+def write_jsonl(records, output):
+    for record in records:
+        output.write(json.dumps(record, default=str) + "\n")
+
+
+def write_csv(records, output):
+    writer = csv.DictWriter(output, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(records)
+
+
+async def main(args):
+    if args.tokens_per_minute:
+        # The batch's own share of the deployment quota
+        LLM.bucket = TokenBucket(args.tokens_per_minute)
+    if CONFIG.FAST_PATH_ENABLED or CONFIG.VALUE_GROUNDING_ENABLED:
+        try:
+            await DIMENSIONS.refresh()
+        except Exception as error:
+            print(f"Dimension index load failed: {error}", file=sys.stderr)
+
+    questions = read_questions(args.questions)
+    try:
+        records = await run_batch(questions, args.concurrency, args.connections)
+    finally:
+        await LLM.close()
+        POOL.close()
+        DB_EXECUTOR.shutdown(wait=False)
+
+    write = write_csv if args.format == "csv" else write_jsonl
+    if args.output == "-":
+        write(records, sys.stdout)
+    else:
+        with open(args.output, "w", newline="", encoding="utf-8") as output:
+            write(records, output)
+    failed = sum(1 for record in records if record["error"])
+    print(f"Answered {len(records) - failed} of {len(records)} questions.", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("questions", help="text file with one question per line, or .jsonl / .csv")
+    parser.add_argument("--output", default="-", help="answers file (.jsonl or .csv); - for stdout")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="defaults to the output file's extension")
+    parser.add_argument("--concurrency", type=int, default=CONFIG.BATCH_CONCURRENCY)
+    parser.add_argument("--connections", type=int, default=CONFIG.BATCH_DB_CONNECTIONS)
+    parser.add_argument("--tokens-per-minute", type=int, default=CONFIG.BATCH_TOKENS_PER_MINUTE)
+    args = parser.parse_args(argv)
+    if args.format is None:
+        args.format = "csv" if os.path.splitext(args.output)[1].lower() == ".csv" else "jsonl"
+    return args
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=CONFIG.LOG_LEVEL, format="%(message)s")
+    sys.exit(asyncio.run(main(parse_args())))
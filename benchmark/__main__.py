@@ -0,0 +1,185 @@
+"""Offline load test: mock LLM + SQLite stand-in + the real app.py process.
+
+    python -m benchmark --turns 200 --concurrency 20 --rows 20000 --llm-latency 0.3
+
+Prints p50/p95/p99 turn latency, throughput, peak memory and mean stage
+latencies. ``--output`` saves the report; ``--baseline`` compares against a
+saved report and exits non-zero when p95 latency regresses too far.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from benchmark import local_db, mock_llm
+from benchmark.driver import create_connector_app, failed_turns, run_load, stage_means, summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def peak_memory_mb(pid):
+    # VmHWM is the resident set high-water mark of the process (Linux only)
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+async def start_site(app, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "localhost", port).start()
+    return runner
+
+
+async def wait_until_ready(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"app.py exited with code {process.returncode}")
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"app.py did not come up within {timeout}s")
+
+
+async def fetch_text(url):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            return await response.text()
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="bot-benchmark-")
+    database_path = os.path.join(workdir, "sales.sqlite")
+    print(f"Seeding {args.rows} rows per table into {database_path}...")
+    local_db.seed(database_path, rows=args.rows)
+
+    replies = []
+    llm_runner = await start_site(
+        mock_llm.create_app(args.llm_latency, args.llm_jitter, args.llm_error_rate),
+        args.llm_port,
+    )
+    connector_runner = await start_site(create_connector_app(replies), args.connector_port)
+
+    llm_url = f"http://localhost:{args.llm_port}/openai/deployments/mock/chat/completions"
+    env = dict(
+        os.environ,
+        PORT=str(args.port),
+        GPT4V_NLP_TO_SQL_ENDPOINT=llm_url,
+        GPT4V_SQL_TO_NLP_ENDPOINT=llm_url,
+        SQL_CONNECTION_FACTORY="benchmark.local_db:connect",
+        BENCHMARK_SQLITE_PATH=database_path,
+        PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])),
+        LOG_LEVEL="WARNING",
+    )
+    launched = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "app.py")],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL if not args.verbose else None,
+        stderr=None,
+    )
+
+    bot_url = f"http://localhost:{args.port}"
+    service_url = f"http://localhost:{args.connector_port}"
+    try:
+        # Listening comes first; ready once the background warm-up is done
+        await wait_until_ready(f"{bot_url}/metrics", process)
+        listening_seconds = time.perf_counter() - launched
+        await wait_until_ready(f"{bot_url}/ready", process)
+        ready_seconds = time.perf_counter() - launched
+        if args.warmup:
+            await run_load(f"{bot_url}/api/messages", service_url, args.warmup, args.warmup)
+        failed_before = failed_turns(await fetch_text(f"{bot_url}/metrics"))
+
+        print(f"Running {args.turns} turns at concurrency {args.concurrency}...")
+        latencies, errors, elapsed = await run_load(
+            f"{bot_url}/api/messages",
+            service_url,
+            args.turns,
+            args.concurrency,
+            distinct=args.distinct,
+        )
+        metrics_text = await fetch_text(f"{bot_url}/metrics")
+        report = summarize(
+            latencies,
+            errors,
+            elapsed,
+            peak_memory_mb(process.pid),
+            stage_means(metrics_text),
+            failed=failed_turns(metrics_text) - failed_before,
+        )
+        report["replies"] = len(replies)
+        report["startup"] = {
+            "listening_seconds": round(listening_seconds, 2),
+            "ready_seconds": round(ready_seconds, 2),
+        }
+        report["config"] = {
+            key: getattr(args, key)
+            for key in ("turns", "concurrency", "rows", "llm_latency", "distinct")
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        await llm_runner.cleanup()
+        await connector_runner.cleanup()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        limit = baseline["p95_ms"] * (1 + args.max_regression / 100)
+        if report["p95_ms"] is None or report["p95_ms"] > limit:
+            print(
+                f"p95 regressed: {report['p95_ms']} ms vs baseline {baseline['p95_ms']} ms "
+                f"(allowed {args.max_regression}%)"
+            )
+            return 1
+    return 1 if report["errors"] else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the bot.")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=5, help="untimed turns sent first")
+    parser.add_argument("--rows", type=int, default=20000, help="synthetic rows per table")
+    parser.add_argument("--distinct", action="store_true", help="make every question unique to bypass caches")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--llm-jitter", type=float, default=0.05)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=3979, help="port for app.py")
+    parser.add_argument("--llm-port", type=int, default=8081)
+    parser.add_argument("--connector-port", type=int, default=8082)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare p95 latency against")
+    parser.add_argument("--max-regression", type=float, default=10.0, help="allowed p95 increase in percent")
+    parser.add_argument("--verbose", action="store_true", help="show app.py output")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,147 @@
+"""Fires concurrent Bot Framework activities at /api/messages and reports latency."""
+
+import asyncio
+import math
+import re
+import time
+import uuid
+
+import aiohttp
+from aiohttp import web
+
+QUESTIONS = [
+    "top 10 customers by primary sales",
+    "total primary sales by division",
+    "primary sales by zone and state",
+    "units sold by product category",
+    "top 10 dealers by secondary sales",
+    "which dealer cluster has the highest secondary sales",
+    "show primary sales by division for Nov-24",
+    "top customers in Maharashtra by sales value",
+]
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+def create_connector_app(replies):
+    """Stands in for the channel's connector service that receives the bot's replies."""
+
+    async def receive(request):
+        activity = await request.json()
+        replies.append(activity.get("type"))
+        return web.json_response({"id": uuid.uuid4().hex})
+
+    app = web.Application()
+    app.router.add_post("/v3/conversations/{conversation_id}/activities", receive)
+    app.router.add_post(
+        "/v3/conversations/{conversation_id}/activities/{activity_id}", receive
+    )
+    return app
+
+
+def make_activity(text, service_url, user_index):
+    return {
+        "type": "message",
+        "id": uuid.uuid4().hex,
+        "channelId": "benchmark",
+        "serviceUrl": service_url,
+        "text": text,
+        "from": {"id": f"user-{user_index}", "name": f"User {user_index}"},
+        "recipient": {"id": "bot", "name": "bot"},
+        "conversation": {"id": f"conversation-{user_index}"},
+    }
+
+
+async def run_load(bot_url, service_url, total, concurrency, distinct=False, questions=QUESTIONS):
+    """Send ``total`` turns with at most ``concurrency`` in flight.
+
+    Returns ``(latencies, errors, elapsed_seconds)``. With ``distinct`` every
+    question is made unique so the question and result caches are bypassed.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = []
+
+    async def one_turn(session, index):
+        text = questions[index % len(questions)]
+        if distinct:
+            text = f"{text} variant {index}"
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with session.post(
+                    bot_url, json=make_activity(text, service_url, index % concurrency)
+                ) as response:
+                    await response.read()
+                    if response.status >= 400:
+                        errors.append(response.status)
+                        return
+            except aiohttp.ClientError as error:
+                errors.append(type(error).__name__)
+                return
+            latencies.append(time.perf_counter() - started)
+
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(one_turn(session, index) for index in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return latencies, errors, elapsed
+
+
+_STAGE_LINE = re.compile(r'^bot_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+_FAILED_TURNS_LINE = re.compile(r'^bot_turn_seconds_count\{outcome="error"\} (\S+)$', re.MULTILINE)
+
+
+def failed_turns(metrics_text):
+    """Turns that raised inside the bot, from its /metrics output.
+
+    These still answer 201 (the adapter's error handler replies to the
+    user), so they are invisible to the HTTP status codes.
+    """
+    match = _FAILED_TURNS_LINE.search(metrics_text)
+    return int(float(match.group(1))) if match else 0
+
+
+def stage_means(metrics_text):
+    """Mean seconds per stage from the bot's /metrics output."""
+    totals = {}
+    for line in metrics_text.splitlines():
+        match = _STAGE_LINE.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            totals.setdefault(stage, {})[kind] = float(value)
+    return {
+        stage: values["sum"] / values["count"]
+        for stage, values in totals.items()
+        if values.get("count")
+    }
+
+
+def summarize(latencies, errors, elapsed, peak_memory_mb=None, stages=None, failed=0):
+    """Report for a run; ``failed`` turns got an HTTP response but raised inside the bot."""
+    completed = len(latencies)
+    return {
+        "turns": completed + len(errors),
+        "errors": len(errors) + failed,
+        "http_errors": len(errors),
+        "failed_turns": failed,
+        "throughput_per_s": round(completed / elapsed, 2) if elapsed else None,
+        "p50_ms": _ms(percentile(latencies, 0.50)),
+        "p95_ms": _ms(percentile(latencies, 0.95)),
+        "p99_ms": _ms(percentile(latencies, 0.99)),
+        "max_ms": _ms(max(latencies) if latencies else None),
+        "peak_memory_mb": peak_memory_mb,
+        "stage_mean_ms": {stage: _ms(seconds) for stage, seconds in (stages or {}).items()},
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
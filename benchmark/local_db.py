@@ -0,0 +1,213 @@
+"""SQLite stand-in for the Azure SQL database, seeded with synthetic sales.
+
+The bot connects through ``SQL_CONNECTION_FACTORY=benchmark.local_db:connect``
+with ``BENCHMARK_SQLITE_PATH`` pointing at a database made by ``seed``.
+"""
+
+import os
+import random
+import re
+import sqlite3
+
+from tables import TABLE_DESCRIPTIONS, parse_column_descriptions
+
+DIVISIONS = ["Adhesives", "Construction Chemicals", "Art Materials", "Industrial", "Waterproofing"]
+ZONES = ["North", "South", "East", "West", "Central"]
+STATES = ["Maharashtra", "Gujarat", "Karnataka", "Tamil Nadu", "Uttar Pradesh", "Delhi", "West Bengal"]
+CATEGORIES = ["Household", "Electrical", "Industrial", "Stationery"]
+SUBCATEGORIES = ["Glue", "Insulation Tape", "Sealant", "Epoxy", "Primer"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
+YEARS = [2023, 2024]
+
+
+def _sql_type(column_name):
+    if re.search(r"(Value|Unit|UVG|Count)$", column_name):
+        return "decimal"
+    if column_name in ("FiscalYear",):
+        return "int"
+    return "nvarchar"
+
+
+def _value(column_name, rng, month_index, year):
+    if column_name.endswith("Value"):
+        return round(rng.uniform(100, 100000), 2)
+    if column_name.endswith("Unit") or column_name.endswith("Count"):
+        return rng.randint(1, 500)
+    if column_name.endswith("UVG"):
+        return round(rng.uniform(-20, 40), 2)
+    if column_name in ("PostingMonth", "InvoiceMonth"):
+        return MONTHS[month_index]
+    if column_name == "CalendarMonthYear":
+        return f"{MONTHS[month_index][:3]}-{str(year)[2:]}"
+    if column_name == "CalendarDate":
+        return f"{rng.randint(1, 28):02d}-{month_index + 1:02d}-{year}"
+    if column_name == "FiscalYear":
+        return year
+    if column_name == "FiscalYearQuarter":
+        return f"Q{(month_index + 9) % 12 // 3 + 1}"
+    if column_name == "DivisionName":
+        return rng.choice(DIVISIONS)
+    if column_name == "CustomerZoneName":
+        return rng.choice(ZONES)
+    if column_name == "CustomerState":
+        return rng.choice(STATES)
+    if column_name == "CustomerCountry":
+        return "India"
+    if column_name == "ProductCategory":
+        return rng.choice(CATEGORIES)
+    if column_name == "ProductSubcategory":
+        return rng.choice(SUBCATEGORIES)
+    if column_name == "DealerCluster":
+        return f"Cluster {rng.randint(1, 6)}"
+    if column_name.endswith("Flag"):
+        return rng.choice(["Yes", "No"])
+    if column_name == "DealerActiveStatus":
+        return rng.choice(["Active", "Inactive"])
+    prefix = re.sub(r"(Name|Code|Key|Description)$", "", column_name) or column_name
+    return f"{prefix} {rng.randint(1, 200)}"
+
+
+def seed(path, rows=20000, random_seed=7):
+    """Create ``primary_sales`` and ``secondary_sales`` with ``rows`` rows each."""
+    rng = random.Random(random_seed)
+    for stale in (path, information_schema_path(path)):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    conn = sqlite3.connect(path)
+    conn.execute("ATTACH DATABASE ? AS INFORMATION_SCHEMA", (information_schema_path(path),))
+    conn.execute(
+        "CREATE TABLE INFORMATION_SCHEMA.COLUMNS "
+        "(TABLE_NAME TEXT, COLUMN_NAME TEXT, DATA_TYPE TEXT, ORDINAL_POSITION INTEGER)"
+    )
+
+    for table_name, description in TABLE_DESCRIPTIONS.items():
+        columns = list(parse_column_descriptions(description))
+        conn.executemany(
+            "INSERT INTO INFORMATION_SCHEMA.COLUMNS VALUES (?, ?, ?, ?)",
+            [
+                (table_name, column_name, _sql_type(column_name), position)
+                for position, column_name in enumerate(columns, start=1)
+            ],
+        )
+        column_defs = ", ".join(
+            f'"{column_name}" {"REAL" if _sql_type(column_name) != "nvarchar" else "TEXT"}'
+            for column_name in columns
+        )
+        conn.execute(f"CREATE TABLE {table_name} ({column_defs})")
+
+        placeholders = ", ".join("?" for _ in columns)
+        batch = []
+        for _ in range(rows):
+            month_index, year = rng.randrange(12), rng.choice(YEARS)
+            batch.append(tuple(_value(column, rng, month_index, year) for column in columns))
+            if len(batch) >= 5000:
+                conn.executemany(f"INSERT INTO {table_name} VALUES ({placeholders})", batch)
+                batch = []
+        if batch:
+            conn.executemany(f"INSERT INTO {table_name} VALUES ({placeholders})", batch)
+
+    conn.commit()
+    conn.close()
+
+
+def information_schema_path(path):
+    return f"{path}.information_schema"
+
+
+# T-SQL constructs the generated queries use that SQLite spells differently
+_TOP = re.compile(r"^(\s*SELECT\s+(?:DISTINCT\s+)?)TOP\s*\(?\s*(\d+)\s*\)?\s+", re.IGNORECASE)
+_NATIONAL_STRING = re.compile(r"\bN'")
+_GETDATE = re.compile(r"CAST\(\s*GETDATE\(\)\s+AS\s+DATE\s*\)|GETDATE\(\)", re.IGNORECASE)
+
+
+def translate(sql):
+    sql = _NATIONAL_STRING.sub("'", sql)
+    sql = _GETDATE.sub("DATE('now')", sql)
+    match = _TOP.match(sql)
+    if match:
+        sql = match.group(1) + sql[match.end():]
+        sql = sql.rstrip().rstrip(";") + f" LIMIT {match.group(2)}"
+    return sql
+
+
+# DB-API (PEP 249) error classes shaped like pyodbc's, ``args == (sqlstate, message)``,
+# which ``db.error_types()`` picks up when this module is the connection factory
+class Error(Exception):
+    pass
+
+
+class OperationalError(Error):
+    pass
+
+
+class ProgrammingError(Error):
+    pass
+
+
+class DataError(Error):
+    pass
+
+
+_SQLSTATES = (
+    ("no such column", ProgrammingError, "42S22"),
+    ("no such table", ProgrammingError, "42S02"),
+    ("syntax error", ProgrammingError, "42000"),
+    ("no such function", ProgrammingError, "42000"),
+    ("interrupted", OperationalError, "HYT00"),
+)
+
+
+def driver_error(error):
+    """The pyodbc-style error for a ``sqlite3`` exception."""
+    message = str(error)
+    for fragment, error_class, sqlstate in _SQLSTATES:
+        if fragment in message:
+            return error_class(sqlstate, message)
+    if isinstance(error, (sqlite3.IntegrityError, sqlite3.DataError)):
+        return DataError("22000", message)
+    if isinstance(error, sqlite3.ProgrammingError):
+        return ProgrammingError("HY000", message)
+    if isinstance(error, sqlite3.OperationalError):
+        return OperationalError("HY000", message)
+    return Error("HY000", message)
+
+
+class TSqlCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        try:
+            self._cursor.execute(translate(sql), params)
+        except sqlite3.Error as error:
+            raise driver_error(error) from error
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TSqlConnection:
+    """Just enough of a pyodbc connection on top of sqlite3."""
+
+    timeout = 0
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return TSqlCursor(self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def connect():
+    path = os.environ["BENCHMARK_SQLITE_PATH"]
+    # Pooled connections are handed between executor threads, one at a time
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("ATTACH DATABASE ? AS INFORMATION_SCHEMA", (information_schema_path(path),))
+    return TSqlConnection(conn)
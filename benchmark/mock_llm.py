@@ -0,0 +1,116 @@
+"""Mock Azure OpenAI chat-completions server with configurable latency.
+
+Replies are canned per pipeline stage, recognised from the prompt:
+table selection gets a table name, SQL generation gets a JSON reply with
+T-SQL that runs on ``benchmark.local_db`` and everything else gets a
+short summary.
+
+    python -m benchmark.mock_llm --port 8081 --latency 0.4
+"""
+
+import argparse
+import asyncio
+import json
+import random
+
+from aiohttp import web
+
+CANNED_SQL = [
+    (
+        ("dealer", "cluster", "secondary"),
+        "secondary_sales",
+        "SELECT TOP 10 DealerName, SUM(SecondarySalesReportingValue) AS TotalValue "
+        "FROM secondary_sales GROUP BY DealerName ORDER BY TotalValue DESC",
+    ),
+    (
+        ("division",),
+        "primary_sales",
+        "SELECT DivisionName, SUM(PrimarySalesReportingValue) AS TotalValue "
+        "FROM primary_sales GROUP BY DivisionName ORDER BY TotalValue DESC",
+    ),
+    (
+        ("zone", "state"),
+        "primary_sales",
+        "SELECT CustomerZoneName, CustomerState, SUM(PrimarySalesReportingValue) AS TotalValue "
+        "FROM primary_sales GROUP BY CustomerZoneName, CustomerState",
+    ),
+    (
+        ("product", "category"),
+        "primary_sales",
+        "SELECT ProductCategory, ProductSubcategory, SUM(PrimarySalesReportingUnit) AS Units "
+        "FROM primary_sales GROUP BY ProductCategory, ProductSubcategory",
+    ),
+    (
+        (),
+        "primary_sales",
+        "SELECT TOP 10 CustomerName, SUM(PrimarySalesReportingValue) AS TotalValue "
+        "FROM primary_sales GROUP BY CustomerName ORDER BY TotalValue DESC",
+    ),
+]
+
+
+def canned_sql(question):
+    lowered = question.lower()
+    for keywords, table_name, sql in CANNED_SQL:
+        if not keywords or any(keyword in lowered for keyword in keywords):
+            return table_name, sql
+    return CANNED_SQL[-1][1:]
+
+
+def reply_for(messages):
+    system = messages[0]["content"] if messages else ""
+    question = messages[-1]["content"] if messages else ""
+
+    if "select the most appropriate table" in system.lower():
+        return canned_sql(question)[0]
+    if '{"table"' in system:
+        table_name, sql = canned_sql(question)
+        return json.dumps({"table": table_name, "sql": sql})
+    if '{"sql"' in system:
+        return json.dumps({"sql": canned_sql(question)[1]})
+    return "The results show the requested sales figures across the selected groups."
+
+
+def create_app(latency=0.3, jitter=0.1, error_rate=0.0):
+    async def chat_completions(request):
+        body = await request.json()
+        await asyncio.sleep(max(0.0, random.gauss(latency, jitter)))
+        if error_rate and random.random() < error_rate:
+            return web.json_response(
+                {"error": {"code": "429", "message": "Rate limit"}},
+                status=429,
+                headers={"Retry-After": "1"},
+            )
+
+        messages = body.get("messages", [])
+        content = reply_for(messages)
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        completion_tokens = len(content) // 4
+        return web.json_response(
+            {
+                "choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+        )
+
+    app = web.Application()
+    app.router.add_post("/{tail:.*}", chat_completions)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.3, help="mean seconds per reply")
+    parser.add_argument("--jitter", type=float, default=0.1, help="std dev of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 429 replies")
+    args = parser.parse_args()
+    web.run_app(
+        create_app(args.latency, args.jitter, args.error_rate),
+        host="localhost",
+        port=args.port,
+    )
@@ -1,13 +1,45 @@
-import os
-import requests
+import asyncio
 import base64
-import pyodbc
+import aiohttp
 import json
+import time
 from decimal import Decimal
 from botbuilder.core import ActivityHandler, TurnContext
-from botbuilder.schema import ChannelAccount, Activity, ActivityTypes
+from botbuilder.schema import ChannelAccount, Activity, ActivityTypes, Attachment
 import re
+from cache import SingleFlight, make_cache, normalize_query
 from config import DefaultConfig
+from conversation import CONVERSATIONS, ConversationState, is_follow_up, refine_locally
+from db import error_types, run_with_connection
+from dimensions import DIMENSIONS
+from llm import LLM, LLMUnavailableError
+from metrics import RESULT_ROWS, annotate, log_event, record_event, stage, turn
+from preflight import (
+    PreflightError,
+    QueryTimeoutError,
+    SqlExecutionError,
+    check_cost,
+    database_error_text,
+    preflight,
+    query_timeout,
+)
+from prompts import PROMPTS, STAGE_MAX_TOKENS, count_message_tokens
+from rendering import render_results
+from results import fetch_result, summarize_for_prompt
+from rollups import ROLLUPS
+from router import ROUTER, match_table_name
+from schema import SCHEMA
+from smalltalk import REPLIES, classify
+from summaries import (
+    LLM_UNAVAILABLE_TEXT,
+    NO_RESULTS_TEXT,
+    NOT_UNDERSTOOD_TEXT,
+    is_scalar,
+    phrase_results,
+    summary_mode,
+)
+from tables import TABLE_DESCRIPTIONS
+from templates import match_template
 
 CONFIG = DefaultConfig()
 
@@ -18,189 +50,506 @@ GPT4V_NLP_TO_SQL_ENDPOINT = CONFIG.GPT4V_NLP_TO_SQL_ENDPOINT
 GPT4V_SQL_TO_NLP_KEY = CONFIG.GPT4V_SQL_TO_NLP_KEY
 GPT4V_SQL_TO_NLP_ENDPOINT = CONFIG.GPT4V_SQL_TO_NLP_ENDPOINT
 
-# Define your variables
-SQL_SERVER = CONFIG.SQL_SERVER
-SQL_DB = CONFIG.SQL_DB
-SQL_USERNAME = CONFIG.SQL_USERNAME
-SQL_PWD = CONFIG.SQL_PWD
+# Normalized question -> (table name, generated SQL)
+SQL_CACHE = make_cache("sql", CONFIG.SQL_CACHE_SIZE, CONFIG.SQL_CACHE_TTL)
+# SQL text -> rows, kept only briefly since the data keeps changing
+RESULT_CACHE = make_cache("result", CONFIG.RESULT_CACHE_SIZE, CONFIG.RESULT_CACHE_TTL)
+# Normalized question and tables -> values grounded in the data, so a
+# repair reuses the lookup its question already made
+GROUNDING_CACHE = make_cache("grounding", CONFIG.SQL_CACHE_SIZE, CONFIG.DIMENSION_REFRESH_INTERVAL)
+# Normalized question -> pipeline run in progress (per worker process)
+IN_FLIGHT = SingleFlight()
 
+# Model calls that failed for good: refused by the breaker, throttled past the
+# retry budget, out of retries, unreachable or over the stage timeout
+LLM_FAILURES = (LLMUnavailableError, aiohttp.ClientError, asyncio.TimeoutError)
 
-def establish_connection():
+_CODE_FENCE = re.compile(r"```(?:sql|json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+
+
+def parse_sql_reply(content):
+    """Read ``{"table": ..., "sql": ...}`` from a model reply.
+
+    Falls back to a fenced or bare SELECT statement for models that ignore
+    the JSON instruction. Returns ``(table_name or None, sql_query or "")``.
+    """
+    text = content.strip()
+    fenced = _CODE_FENCE.search(text)
     try:
-        print("Establishing connection...")
-        connection_string = f"Driver={{ODBC Driver 18 for SQL Server}};Server=tcp:{SQL_SERVER},1433;Database={SQL_DB};Uid={SQL_USERNAME};Pwd={SQL_PWD};Encrypt=yes;TrustServerCertificate=no;Connection Timeout=180;"
-
-        conn = pyodbc.connect(connection_string)
-        print("Connection established.")
-        return conn
-
-    except pyodbc.InterfaceError as e:
-        print(f"Connection failed due to interface error: {e}")
-    except pyodbc.DatabaseError as e:
-        print(f"Database error occurred: {e}")
-    except pyodbc.Error as e:
-        print(f"An error occurred: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-    finally:
-        print("Connection attempt finished.")
-
-
-def fetch_column_info(conn, table_name="primary_sales"):
-    cursor = conn.cursor()
-    cursor.execute(
-        f"SELECT COLUMN_NAME, DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = N'{table_name}'"
+        reply = json.loads(fenced.group(1) if fenced and text.startswith("```") else text)
+    except ValueError:
+        reply = None
+
+    if isinstance(reply, dict):
+        # Models sometimes answer with a list or an object; only text is trusted
+        table_name, sql_query = reply.get("table"), reply.get("sql")
+        table_name = match_table_name(table_name) if isinstance(table_name, str) else None
+        return table_name, sql_query.strip() if isinstance(sql_query, str) else ""
+
+    if fenced:
+        return None, fenced.group(1).strip()
+    if re.match(r"^(SELECT|WITH)\b", text, re.IGNORECASE):
+        return None, text
+    return None, ""  # Fallback if parsing fails
+
+
+async def known_schemas():
+    return [await SCHEMA.get(table_name) for table_name in TABLE_DESCRIPTIONS]
+
+
+async def select_table_for_nlp_query(nlp_query):
+    prompt_messages = PROMPTS.table_selection_messages(nlp_query, await known_schemas())
+
+    content = await LLM.chat(
+        GPT4V_NLP_TO_SQL_ENDPOINT,
+        GPT4V_NLP_TO_SQL_KEY,
+        prompt_messages,
+        max_tokens=STAGE_MAX_TOKENS["table_selection"],
+        stage="table_selection",
     )
-    return cursor.fetchall()
-
-
-def select_table_for_nlp_query(nlp_query):
-    tables = {
-        "primary_sales": "The 'PrimarySales' table records sales data for various divisions, customers, and products. It includes:\nDivisionCode: Code representing the division.\nSalesGroupCode: Code for the sales group.\nCustomerCode: Unique code for the customer.\nPostingMonth: Month of the sales posting (e.g., 'January', 'Feb').\nMaterialCode: Code for the material or product.\nPrimarySalesReportingUnit: Unit in which primary sales are reported (numeric).\nPrimarySalesReportingValue: Value of the primary sales (numeric).\nPrimarySalesReportingUVG: Unit value growth of the primary sales (numeric, percentage).\nDivisionName: Name of the division.\nCustomerName: Name of the customer.\nCustomerGroup: Primary group classification of the customer.\nCustomerGroup1: Secondary group classification of the customer.\nCustomerGroup2: Tertiary group classification of the customer.\nCustomerGroup3: Quaternary group classification of the customer.\nCustomerTown: Town where the customer is located.\nCustomerZoneName: Zone name of the customer.\nCustomerNSMName: Name of the national sales manager for the customer.\nCustomerState: State where the customer is located.\nCustomerCountry: Country where the customer is located.\nSalesGroupName: Name of the sales group.\nMaterialDescription: Description of the material.\nMaterialFSNDescription: Description of the material's FSN (Fast, Slow, Non-moving) status.\nProductName: Name of the product.\nProductSubcategory: Subcategory of the product (Glue, Insulation Tape, Sealant etc).\nProductCategory: Category of the product (Household, Electrical etc.)\nCalendarDate: Date of the sales record (DD-MM-YYYY).\nCalendarMonthYear: Month and year of the calendar period (Month(In words)-YY, (e.g., 'Nov-24', 'Aug-21') ).\nFiscalYearQuarter: Fiscal year quarter in which the sales occurred (e.g., 'Q1', 'Q2').\nFiscalYear: Fiscal year of the sales record (YYYY).",
-        "secondary_sales": "The 'SecondarySales' table records sales data from dealers to customers for various products. It includes:\nDealerKey: Unique identifier for the dealer.\nSalesGroupCode: Code for the sales group.\nDealerCode: Unique code for the dealer.\nCustomerCode: Unique code for the customer.\nMaterialCode: Code for the material or product.\nInvoiceMonth: Month of the invoice (e.g., 'January', 'Feb').\nSecondarySalesReportingUnit: Unit in which secondary sales are reported (numeric).\nSecondarySalesReportingValue: Value of the secondary sales (numeric).\nSecondarySalesReportingUVG: Unit value growth of the secondary sales (numeric, percentage).\nDealerName: Name of the dealer.\nDealerCustomerCode: Customer code associated with the dealer.\nDealerTSITerritoryCode: Territory code for the dealer's TSI (Territory Sales Incharge).\nDealerSalesmanType: Type of salesman assigned to the dealer (e.g., 'Field Sales', 'Online Sales').\nDealerSalesmanCode: Code identifying the salesman.\nDealerTSIKey: Key identifying the TSI for the dealer.\nDealerClass: Classification of the dealer (e.g., 'Group 1').\nDealerClassGroup: Group classification of the dealer.\nDealerType1: Primary type classification of the dealer.\nDealerType2: Secondary type classification of the dealer.\nDealerType3: Tertiary type classification of the dealer.\nDealerType4: Quaternary type classification of the dealer.\nDealerType5: Quinary type classification of the dealer.\nDealerAdoptedFlag: Flag indicating whether the dealer is adopted (Yes/No).\nDealerDisconnectedFlag: Flag indicating whether the dealer is disconnected (Yes/No).\nDealerActiveStatus: Active status of the dealer (e.g., 'Active', 'Inactive').\nDealerCluster: Cluster classification of the dealer (e.g., 'Cluster 1', 'Cluster 2').\nDealerActiveStatusTSICount: Count of active status TSIs associated with the dealer (numeric).",
-    }
-
-    prompt_messages = [
-        {
-            "role": "system",
-            "content": "Given the following table descriptions, select the most appropriate table for the given natural language query. Provide me the table name only in the response.",
-        },
-        {
-            "role": "user",
-            "content": f"Table descriptions: {json.dumps(tables)}\nNLP Query: {nlp_query}",
-        },
-    ]
-
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": GPT4V_NLP_TO_SQL_KEY,
-    }
-
-    payload = {
-        "messages": prompt_messages,
-        "temperature": 0.7,
-        "top_p": 0.95,
-        "max_tokens": 4096,
-    }
-
-    response = requests.post(GPT4V_NLP_TO_SQL_ENDPOINT, headers=headers, json=payload)
-    response.raise_for_status()  # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
-
-    content = response.json()["choices"][0]["message"]["content"].strip()
-    table_name = content.split(":")[1].strip() if ":" in content else content
+    table_name = match_table_name(content)
+    if table_name is None:
+        table_name = content.split(":")[1].strip() if ":" in content else content
     return table_name
 
 
-def nlp_to_sql(nlp_query, conn, table_name):
-    # Fetch columns info
-    columns = fetch_column_info(conn, table_name)
-    columns_str = ", ".join(
-        [f'"{column[0]}" ({column[1]})' for column in columns]
-    )  # Adding data types to column names
+async def ground_values(nlp_query, table_names):
+    """Exact data values the question names, for ``=``/``IN`` filters instead of ``LIKE``."""
+    if not CONFIG.VALUE_GROUNDING_ENABLED or not DIMENSIONS.ready:
+        return None
+    key = f"{normalize_query(nlp_query)}|{','.join(sorted(table_names))}"
+    values = GROUNDING_CACHE.get(key)
+    if values is None:
+        with stage("value_grounding"):
+            # The trigram lookups take tens of milliseconds on large name columns
+            values = await asyncio.get_running_loop().run_in_executor(
+                None,
+                lambda: DIMENSIONS.resolve(
+                    nlp_query, table_names, threshold=CONFIG.DIMENSION_FUZZY_THRESHOLD
+                ),
+            )
+        GROUNDING_CACHE.set(key, values)
+    annotate(grounded_values=sum(len(column_values) for column_values in values.values()))
+    return values
+
+
+async def nlp_to_sql(nlp_query, table_name):
+    # Columns info is served from the schema cache
+    prompt_messages = PROMPTS.sql_messages(
+        nlp_query, await SCHEMA.get(table_name), await ground_values(nlp_query, [table_name])
+    )
+    annotate(sql_prompt_tokens=count_message_tokens(prompt_messages))
+
+    content = await LLM.chat(
+        GPT4V_NLP_TO_SQL_ENDPOINT,
+        GPT4V_NLP_TO_SQL_KEY,
+        prompt_messages,
+        max_tokens=STAGE_MAX_TOKENS["sql_generation"],
+        json_mode=True,
+        stage="sql_generation",
+    )
+    return parse_sql_reply(content)[1]
 
-    # Fetch the table description
-    tables = {
-        "primary_sales": "The 'PrimarySales' table records sales data for various divisions, customers, and products. It includes:\nDivisionCode: Code representing the division.\nSalesGroupCode: Code for the sales group.\nCustomerCode: Unique code for the customer.\nPostingMonth: Month of the sales posting (e.g., 'January', 'Feb').\nMaterialCode: Code for the material or product.\nPrimarySalesReportingUnit: Unit in which primary sales are reported (numeric).\nPrimarySalesReportingValue: Value of the primary sales (numeric).\nPrimarySalesReportingUVG: Unit value growth of the primary sales (numeric, percentage).\nDivisionName: Name of the division.\nCustomerName: Name of the customer.\nCustomerGroup: Primary group classification of the customer.\nCustomerGroup1: Secondary group classification of the customer.\nCustomerGroup2: Tertiary group classification of the customer.\nCustomerGroup3: Quaternary group classification of the customer.\nCustomerTown: Town where the customer is located.\nCustomerZoneName: Zone name of the customer.\nCustomerNSMName: Name of the national sales manager for the customer.\nCustomerState: State where the customer is located.\nCustomerCountry: Country where the customer is located.\nSalesGroupName: Name of the sales group.\nMaterialDescription: Description of the material.\nMaterialFSNDescription: Description of the material's FSN (Fast, Slow, Non-moving) status.\nProductName: Name of the product.\nProductSubcategory: Subcategory of theproduct (Glue, Insulation Tape, Sealant etc).\nProductCategory: Category of the product (Household, Electrical etc.).\nCalendarDate: Date of the sales record (DD-MM-YYYY).\nCalendarMonthYear: Month and year of the calendar period (Month(In words)-YY, (e.g., 'Nov-24', 'Aug-21') ).\nFiscalYearQuarter: Fiscal year quarter in which the sales occurred (e.g., 'Q1', 'Q2').\nFiscalYear: Fiscal year of the sales record (YYYY).",
-        "secondary_sales": "The 'SecondarySales' table records sales data from dealers to customers for various products. It includes:\nDealerKey: Unique identifier for the dealer.\nSalesGroupCode: Code for the sales group.\nDealerCode: Unique code for the dealer.\nCustomerCode: Unique code for the customer.\nMaterialCode: Code for the material or product.\nInvoiceMonth: Month of the invoice (e.g., 'January', 'Feb').\nSecondarySalesReportingUnit: Unit in which secondary sales are reported (numeric).\nSecondarySalesReportingValue: Value of the secondary sales (numeric).\nSecondarySalesReportingUVG: Unit value growth of the secondary sales (numeric, percentage).\nDealerName: Name of the dealer.\nDealerCustomerCode: Customer code associated with the dealer.\nDealerTSITerritoryCode: Territory code for the dealer's TSI (Territory Sales Incharge).\nDealerSalesmanType: Type of salesman assigned to the dealer (e.g., 'Field Sales', 'Online Sales').\nDealerSalesmanCode: Code identifying the salesman.\nDealerTSIKey: Key identifying the TSI for the dealer.\nDealerClass: Classification of the dealer (e.g., 'Group 1').\nDealerClassGroup: Group classification of the dealer.\nDealerType1: Primary type classification of the dealer.\nDealerType2: Secondary type classification of the dealer.\nDealerType3: Tertiary type classification of the dealer.\nDealerType4: Quaternary type classification of the dealer.\nDealerType5: Quinary type classification of the dealer.\nDealerAdoptedFlag: Flag indicating whether the dealer is adopted (Yes/No).\nDealerDisconnectedFlag: Flag indicating whether the dealer is disconnected (Yes/No).\nDealerActiveStatus: Active status of the dealer (e.g., 'Active', 'Inactive').\nDealerCluster: Cluster classification of the dealer (e.g., 'Cluster 1', 'Cluster 2').\nDealerActiveStatusTSICount: Count of active status TSIs associated with the dealer (numeric).",
-    }
 
-    table_description = tables.get(
-        table_name, "No description available for this table."
+async def repair_sql(nlp_query, table_name, sql_query, error):
+    """Ask the model to correct ``sql_query`` given why it failed."""
+    prompt_messages = PROMPTS.repair_messages(
+        nlp_query,
+        await SCHEMA.get(table_name),
+        sql_query,
+        error,
+        await ground_values(nlp_query, [table_name]),
     )
 
-    # Construct the prompt message
-    prompt_messages = [
-        {
-            "role": "system",
-            "content": (
-                f"Given the table '{table_name}' with columns {columns_str}, and the following description:\n"
-                f"{table_description}\n"
-                "Convert the following natural language query into an SQL query considering partial matches and relevant columns. "
-                "Make sure the query should be compatible with Azure SQL Database. Ensure correct data type usage when comparing columns to values. "
-                "Make sure the query should be very precise and accurate, it should not throw any error while executing to the database. "
-                "It should only return the information asked in the NLP query. Do not return any additional information. "
-                "Consider datatypes and column names accurately. Use CalendarDate (available in primary sales) in DD-MM-YYYY format while formatting SQL query. "
-                "Consider CalendarMonthYear is in Month(In words)-YY (e.g., 'Nov-24', 'Aug-21')."
-                "If the NLP query includes 'Jan, Feb, Mar' the SQL query should consider the full month name as 'January, February, and March'."
-                "Use LIKE for partial matches and use TOP is based on the NLP query. "
-                "Focus on columns that are likely targets based on the query's context."
-            ),
-        },
-        {"role": "user", "content": nlp_query},
-    ]
-
-    print(prompt_messages)
-
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": GPT4V_NLP_TO_SQL_KEY,
-    }
-
-    payload = {
-        "messages": prompt_messages,
-        "temperature": 0.7,
-        "top_p": 0.95,
-        "max_tokens": 4096,
-    }
-
-    response = requests.post(GPT4V_NLP_TO_SQL_ENDPOINT, headers=headers, json=payload)
-    response.raise_for_status()  # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
-
-    content = response.json()["choices"][0]["message"]["content"].strip()
-    if "```sql" in content and "```" in content.split("```sql")[1]:
-        sql_query = content.split("```sql")[1].split("```")[0].strip()
-    else:
-        sql_query = ""  # Fallback if parsing fails
-    return sql_query
+    content = await LLM.chat(
+        GPT4V_NLP_TO_SQL_ENDPOINT,
+        GPT4V_NLP_TO_SQL_KEY,
+        prompt_messages,
+        max_tokens=STAGE_MAX_TOKENS["sql_generation"],
+        json_mode=True,
+        stage="sql_repair",
+    )
+    return parse_sql_reply(content)[1]
+
+
+async def refine_sql(nlp_query, state):
+    """Rewrite the previous turn's SQL for a follow-up question."""
+    prompt_messages = PROMPTS.follow_up_messages(
+        state.nlp_query,
+        state.sql_query,
+        nlp_query,
+        await SCHEMA.get(state.table_name),
+        state.refinements,
+    )
+    annotate(sql_prompt_tokens=count_message_tokens(prompt_messages))
+
+    content = await LLM.chat(
+        GPT4V_NLP_TO_SQL_ENDPOINT,
+        GPT4V_NLP_TO_SQL_KEY,
+        prompt_messages,
+        max_tokens=STAGE_MAX_TOKENS["sql_generation"],
+        json_mode=True,
+        stage="follow_up",
+    )
+    return parse_sql_reply(content)[1]
+
+
+async def nlp_to_table_and_sql(nlp_query):
+    """Pick the table and write the SQL in a single LLM round-trip."""
+    prompt_messages = PROMPTS.combined_messages(
+        nlp_query, await known_schemas(), await ground_values(nlp_query, TABLE_DESCRIPTIONS)
+    )
+    annotate(sql_prompt_tokens=count_message_tokens(prompt_messages))
+
+    content = await LLM.chat(
+        GPT4V_NLP_TO_SQL_ENDPOINT,
+        GPT4V_NLP_TO_SQL_KEY,
+        prompt_messages,
+        max_tokens=STAGE_MAX_TOKENS["sql_generation"],
+        json_mode=True,
+        stage="sql_generation",
+    )
+    table_name, sql_query = parse_sql_reply(content)
+    if table_name is None and sql_query:
+        table_name = match_table_name(sql_query)
+    return table_name, sql_query
 
 
 def execute_sql_query(sql_query, conn):
-    cursor = conn.cursor()
-    adjusted_sql_query = sql_query.replace("CURRENT_DATE", "CAST(GETDATE() AS DATE)")
+    errors = error_types()
+    try:
+        with query_timeout(conn, CONFIG.SQL_QUERY_TIMEOUT):
+            if CONFIG.SQL_MAX_PLAN_COST:
+                # Compiling the plan also finds invalid SQL, which goes to repair
+                with stage("plan_check"):
+                    annotate(plan_cost=check_cost(conn, sql_query, CONFIG.SQL_MAX_PLAN_COST))
+            cursor = conn.cursor()
+            with stage("sql_execution"):
+                cursor.execute(sql_query)
+                results = fetch_result(
+                    cursor,
+                    max_rows=CONFIG.SQL_MAX_ROWS,
+                    batch_size=CONFIG.SQL_FETCH_BATCH_SIZE,
+                )
+        RESULT_ROWS.observe(len(results))
+        annotate(rows=len(results))
+        return results
+    except errors.OperationalError as e:
+        if e.args and e.args[0] in ("HYT00", "HYT01"):
+            raise QueryTimeoutError(str(e)) from e
+        raise
+    except (errors.ProgrammingError, errors.DataError) as e:
+        # Kept for the repair prompt instead of turning into an empty answer
+        raise SqlExecutionError(database_error_text(e)) from e
+
+
+async def sql_to_nlp(sql_results, short=False):
+    """Summary text for the results, or None if the model failed or was too slow.
+
+    ``short`` uses the brief prompt and lower output cap meant for medium results.
+    """
+    prompt_messages = PROMPTS.summary_messages(
+        json.dumps(sql_results, cls=DecimalEncoder), short=short
+    )
 
     try:
-        cursor.execute(adjusted_sql_query)
-        columns = [column[0] for column in cursor.description]
-        results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        with stage("summarization"):
+            content = await asyncio.wait_for(
+                LLM.chat(
+                    GPT4V_SQL_TO_NLP_ENDPOINT,
+                    GPT4V_SQL_TO_NLP_KEY,
+                    prompt_messages,
+                    max_tokens=STAGE_MAX_TOKENS["summary_short" if short else "summary"],
+                    stage="summarization",
+                ),
+                CONFIG.SUMMARY_TIMEOUT or None,
+            )
+    except asyncio.TimeoutError:
+        # The table goes out on its own rather than holding the turn
+        record_event("summary", "timeout")
+        return None
+    except (aiohttp.ClientError, LLMUnavailableError) as e:
+        record_event("summary", "failed", error=str(e))
+        return None
+
+    return content
+
+
+async def generate_sql(nlp_query):
+    cache_key = normalize_query(nlp_query)
+    cached = SQL_CACHE.get(cache_key)
+    record_event("sql_cache", "miss" if cached is None else "hit")
+    if cached is not None:
+        return cached
+
+    with stage("table_selection"):
+        decision = ROUTER.route(nlp_query)
+        if decision.path == "llm" and CONFIG.SQL_GENERATION_MODE != "combined":
+            # Low confidence locally, let the model decide
+            decision.table_name = await select_table_for_nlp_query(nlp_query)
+
+    with stage("sql_generation"):
+        if decision.path == "llm" and CONFIG.SQL_GENERATION_MODE == "combined":
+            decision.path = "combined"
+            decision.table_name, sql_query = await nlp_to_table_and_sql(nlp_query)
+        else:
+            sql_query = await nlp_to_sql(nlp_query, decision.table_name)
+    record_event("route", decision.path, table=decision.table_name)
+
+    table_name = decision.table_name
+    if sql_query:
+        SQL_CACHE.set(cache_key, (table_name, sql_query))
+    return table_name, sql_query
+
+
+async def prepare_sql(sql_query):
+    """The text that will actually run: pre-flight checked, then rewritten onto a rollup."""
+    with stage("preflight"):
+        sql_query = await preflight(sql_query)
+
+    if CONFIG.ROLLUPS_ENABLED:
+        sql_query, rollup_name = ROLLUPS.rewrite(sql_query)
+        record_event("rollup", rollup_name or "none")
+    return sql_query
+
+
+async def run_sql_query(sql_query):
+    sql_query = await prepare_sql(sql_query)
+
+    results = RESULT_CACHE.get(sql_query)
+    record_event("result_cache", "miss" if results is None else "hit")
+    if results is not None:
         return results
-    except pyodbc.ProgrammingError as e:
-        return []
-    except pyodbc.DataError as e:
-        return []
-
-
-def sql_to_nlp(sql_results):
-    prompt_messages = [
-        {
-            "role": "system",
-            "content": "Given the following SQL query results, generate a natural language response summarizing the data in a human-readable format. Consider the context of the original user's query. Do not include any currency signs in the response.",
-        },
-        {"role": "user", "content": json.dumps(sql_results, cls=DecimalEncoder)},
-    ]
-
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": GPT4V_SQL_TO_NLP_KEY,
-    }
-
-    payload = {
-        "messages": prompt_messages,
-        "temperature": 0.7,
-        "top_p": 0.95,
-        "max_tokens": 4096,
-    }
 
+    # Blocking pyodbc work runs on the bounded DB executor
+    results = await run_with_connection(
+        lambda conn: execute_sql_query(sql_query, conn)
+    )
+    if results:
+        RESULT_CACHE.set(sql_query, results)
+    return results
+
+
+async def run_sql_query_with_repair(
+    nlp_query, table_name, sql_query, deadline, cache_repairs=True
+):
+    """Run the SQL, feeding failures (and empty results) back to the model.
+
+    At most ``SQL_REPAIR_ATTEMPTS`` corrections are requested and none once
+    ``deadline`` (a ``time.monotonic()`` value) has passed. A repaired query
+    replaces the cached SQL for the question unless ``cache_repairs`` is
+    false. Returns ``(sql_query, results)`` for the last query run, or raises
+    the last error when no attempt produced a runnable query.
+    """
+    table_name = table_name or match_table_name(sql_query)
+    attempt = 0
+    while True:
+        try:
+            results = await run_sql_query(sql_query)
+            error = None
+        except (PreflightError, SqlExecutionError) as e:
+            results, error = None, e
+
+        if results or (error is None and not CONFIG.SQL_REPAIR_EMPTY_RESULTS):
+            break
+        remaining = deadline - time.monotonic()
+        if attempt >= CONFIG.SQL_REPAIR_ATTEMPTS or remaining <= 0 or table_name is None:
+            break
+
+        attempt += 1
+        reason = str(error) if error else "It ran but returned no rows; the filters may be too strict."
+        log_event("sql_repair", attempt=attempt, sql=sql_query, error=reason)
+        try:
+            with stage("sql_repair"):
+                repaired = await asyncio.wait_for(
+                    repair_sql(nlp_query, table_name, sql_query, reason), remaining
+                )
+        except LLM_FAILURES:
+            # No correction this turn; the original error is reported
+            break
+        if not repaired or repaired == sql_query:
+            break
+        sql_query = repaired
+
+    annotate(repair_attempts=attempt)
+    if error is not None:
+        if attempt:
+            record_event("sql_repair", "failed")
+        raise error
+    if attempt:
+        record_event("sql_repair", "ok" if results else "empty")
+    if attempt and results and cache_repairs:
+        SQL_CACHE.set(normalize_query(nlp_query), (table_name, sql_query))
+    return sql_query, results
+
+
+class Answer:
+    """Outcome of one pipeline run, shared by every turn that asked the question.
+
+    Either ``results`` with a ``summary`` task still being generated, or a
+    plain ``text`` reply when there was nothing to show. ``table_name`` and
+    ``sql_query`` record what was run, for follow-up questions.
+    """
+
+    __slots__ = ("results", "summary", "text", "table_name", "sql_query")
+
+    def __init__(self, results=None, summary=None, text=None, table_name=None, sql_query=None):
+        self.results = results
+        self.summary = summary
+        self.text = text
+        self.table_name = table_name
+        self.sql_query = sql_query
+
+
+def local_summary(text):
+    """A summary that is already known, in the shape of a summary task."""
+    summary = asyncio.get_running_loop().create_future()
+    summary.set_result(text)
+    return summary
+
+
+def results_answer(nlp_query, results, table_name, sql_query):
+    """Answer for a non-empty result, summarized only as much as it needs.
+
+    Scalars and tiny results are phrased locally (a scalar needs no table);
+    otherwise the summary is started so it is generated while the table is
+    rendered and sent.
+    """
+    mode = summary_mode(results)
+    record_event("summary", mode)
+    if mode == "local":
+        text = phrase_results(results)
+        if is_scalar(results):
+            return Answer(text=text, table_name=table_name, sql_query=sql_query)
+        summary = local_summary(text)
+    else:
+        summary = asyncio.create_task(
+            sql_to_nlp(
+                {
+                    "question": nlp_query,
+                    "answer": summarize_for_prompt(results, CONFIG.SUMMARY_SAMPLE_ROWS),
+                },
+                short=mode == "short",
+            )
+        )
+    return Answer(results=results, summary=summary, table_name=table_name, sql_query=sql_query)
+
+
+async def answer_from_template(match):
+    """Run a filled-in template and phrase the answer locally; no LLM calls.
+
+    Returns None when the query fails or times out, so the question goes to the LLM pipeline.
+    """
     try:
-        response = requests.post(
-            GPT4V_SQL_TO_NLP_ENDPOINT, headers=headers, json=payload
+        results = await run_sql_query(match.sql_query)
+    except (PreflightError, SqlExecutionError, QueryTimeoutError) as e:
+        log_event("fast_path_failed", template=match.template, error=str(e))
+        return None
+    return template_answer(match, results)
+
+
+def template_answer(match, results):
+    text = match.phrase(results)
+    if match.template == "total" or not results:
+        return Answer(text=text, table_name=match.table_name, sql_query=match.sql_query)
+    return Answer(
+        results=results,
+        summary=local_summary(text),
+        table_name=match.table_name,
+        sql_query=match.sql_query,
+    )
+
+
+def rejected_answer(error):
+    """Local reply for a query that could not be run; no LLM call."""
+    record_event("sql_rejected", type(error).__name__, reason=str(error))
+    if isinstance(error, QueryTimeoutError):
+        return Answer(
+            text="That question took too long to answer. Could you narrow it down, for example to one month or division?"
         )
-        response.raise_for_status()  # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
-    except requests.RequestException as e:
-        raise SystemExit(f"Failed to make the request. Error: {e}")
+    return Answer(
+        text="I couldn't build a working query for that question. Could you rephrase it or name the columns you need?"
+    )
 
-    content = response.json()["choices"][0]["message"]["content"].strip()
 
-    return content
+async def answer_question(nlp_query):
+    deadline = time.monotonic() + CONFIG.TURN_DEADLINE
+    if CONFIG.FAST_PATH_ENABLED:
+        with stage("fast_path"):
+            match = match_template(nlp_query)
+        record_event("fast_path", match.template if match else "miss")
+        if match is not None:
+            log_event("sql_generated", table=match.table_name, sql=match.sql_query, template=match.template)
+            answer = await answer_from_template(match)
+            if answer is not None:
+                return answer
+
+    try:
+        table_name, sql_query = await generate_sql(nlp_query)
+    except LLM_FAILURES as e:
+        record_event("llm", "unavailable", error=type(e).__name__)
+        return Answer(text=LLM_UNAVAILABLE_TEXT)
+    if sql_query:
+        log_event("sql_generated", table=table_name, sql=sql_query)
+        try:
+            sql_query, results = await run_sql_query_with_repair(
+                nlp_query, table_name, sql_query, deadline
+            )
+        except (PreflightError, SqlExecutionError, QueryTimeoutError) as e:
+            # Answered locally; the SQL is dropped so the next ask regenerates it
+            SQL_CACHE.delete(normalize_query(nlp_query))
+            return rejected_answer(e)
+        table_name = table_name or match_table_name(sql_query)
+        if results:
+            return results_answer(nlp_query, results, table_name, sql_query)
+        record_event("summary", "no_results")
+        return Answer(text=NO_RESULTS_TEXT, table_name=table_name, sql_query=sql_query)
+
+    record_event("summary", "not_understood")
+    return Answer(text=NOT_UNDERSTOOD_TEXT)
+
+
+async def answer_follow_up(nlp_query, state):
+    """Answer a refinement of the previous question; ``(answer, next state)``.
+
+    The previous rows are filtered, regrouped or cut down locally when that
+    is enough; otherwise the previous SQL is rewritten with a short prompt
+    that carries no table-selection work. ``(None, None)`` means the
+    question should be answered afresh.
+    """
+    question = state.question_with(nlp_query)
+    with stage("follow_up_local"):
+        results = refine_locally(state.results, nlp_query)
+    if results:
+        record_event("follow_up", "local")
+        return (
+            results_answer(question, results, state.table_name, state.sql_query),
+            state.refined(nlp_query),
+        )
+
+    deadline = time.monotonic() + CONFIG.TURN_DEADLINE
+    try:
+        with stage("sql_generation"):
+            sql_query = await refine_sql(nlp_query, state)
+    except LLM_FAILURES as e:
+        # Starting afresh would only wait on the same model again
+        record_event("llm", "unavailable", error=type(e).__name__)
+        return Answer(text=LLM_UNAVAILABLE_TEXT), None
+    if not sql_query:
+        return None, None
+    record_event("follow_up", "sql")
+    log_event("sql_generated", table=state.table_name, sql=sql_query, follow_up=True)
+    try:
+        sql_query, results = await run_sql_query_with_repair(
+            question, state.table_name, sql_query, deadline, cache_repairs=False
+        )
+    except (PreflightError, SqlExecutionError, QueryTimeoutError) as e:
+        return rejected_answer(e), None
+    next_state = ConversationState(question, state.table_name, sql_query, results)
+    if not results:
+        record_event("summary", "no_results")
+        return Answer(text=NO_RESULTS_TEXT, table_name=state.table_name, sql_query=sql_query), next_state
+    return results_answer(question, results, state.table_name, sql_query), next_state
 
 
 class DecimalEncoder(json.JSONEncoder):
@@ -210,79 +559,98 @@ class DecimalEncoder(json.JSONEncoder):
         return super(DecimalEncoder, self).default(obj)
 
 
-def format_results_as_markdown(results):
-    if not results:
-        return "No results found."
-
-    # Generate Markdown table header
-    headers = results[0].keys()
-    header_row = "| " + " | ".join(headers) + " |"
-    separator_row = "| " + " | ".join(["---"] * len(headers)) + " |"
-
-    # Generate Markdown table rows
-    rows = []
-    for result in results:
-        row = (
-            "| " + " | ".join(str(result.get(header, "")) for header in headers) + " |"
-        )
-        rows.append(row)
-
-    # Combine header, separator, and rows
-    markdown_table = "\n".join([header_row, separator_row] + rows)
-
-    return f"{markdown_table}"
+def note_activity(rendered, text=None):
+    """``text`` (by default the rows-left-out note) with the full result's CSV attached, if any."""
+    activity = Activity(type=ActivityTypes.message, text=text or rendered.note)
+    if rendered.csv is not None:
+        activity.attachments = [
+            Attachment(
+                name="results.csv",
+                content_type="text/csv",
+                content_url="data:text/csv;base64," + base64.b64encode(rendered.csv).decode("ascii"),
+            )
+        ]
+    return activity
 
 
 class MyBot(ActivityHandler):
     async def on_message_activity(self, turn_context: TurnContext):
-        conn = establish_connection()
+        with turn(turn_context.activity):
+            await self._answer(turn_context)
 
+    async def _answer(self, turn_context: TurnContext):
         nlp_query = turn_context.activity.text
 
+        # Small talk is answered before any DB or LLM work, and without a typing indicator
+        with stage("small_talk"):
+            intent = classify(nlp_query)
+        if intent is not None:
+            record_event("intent", intent)
+            await turn_context.send_activity(REPLIES[intent])
+            return
+
         # Send typing activity to show that the bot is processing the request
         typing_activity = Activity(type=ActivityTypes.typing)
         await turn_context.send_activity(typing_activity)
 
-        # Check for greetings and respond
-        greetings_pattern = re.compile(
-            r"^(hi|hii|hello|hey|hee|hola|howdy|greetings|hi there|good morning|good afternoon|good evening|sup|yo|what\'s up|morning|afternoon|evening|salutations|bonjour|namaste|what\'s good|how\'s it going|hiya|ahoy|aloha|shalom|ciao|hey there|hello there|peace|wassup|how are you|how are you doing|how do you do|hey ya|hey you|hi everyone|hi all)$",
-            re.IGNORECASE,
-        )
-
-        if greetings_pattern.match(nlp_query.strip()):
-            await turn_context.send_activity("Hello, how can I assist you!")
-            return
-
-        table_name = select_table_for_nlp_query(nlp_query)
-
-        sql_query = nlp_to_sql(nlp_query, conn, table_name)
-        if sql_query:
-            print("------------------sql_query---------------------" + sql_query)
-            results = execute_sql_query(sql_query, conn)
-            if results:
-                markdown_response = format_results_as_markdown(results)
-                nlp_response = sql_to_nlp(
-                    f"Question: {nlp_query}\nAnswer:\n{json.dumps(results, cls=DecimalEncoder)}"
+        conversation = turn_context.activity.conversation
+        conversation_id = conversation.id if conversation else None
+        state = None
+        if CONFIG.FOLLOW_UPS_ENABLED and conversation_id:
+            state = CONVERSATIONS.get(conversation_id)
+
+        answer, next_state = None, None
+        if state is not None and is_follow_up(nlp_query, state.table_name):
+            # Depends on this conversation's history, so never coalesced or cached
+            answer, next_state = await answer_follow_up(nlp_query, state)
+        if answer is None:
+            if CONFIG.COALESCE_QUESTIONS:
+                answer, shared = await IN_FLIGHT.do(
+                    normalize_query(nlp_query), lambda: answer_question(nlp_query)
                 )
+                record_event("single_flight", "follower" if shared else "leader")
+            else:
+                answer = await answer_question(nlp_query)
 
-                combined_response = (
-                    f"{markdown_response}\n\n\n\n**Summary**:\n{nlp_response}"
-                )
+        if next_state is None and answer.sql_query:
+            next_state = ConversationState(nlp_query, answer.table_name, answer.sql_query, answer.results)
+        if conversation_id and next_state is not None:
+            CONVERSATIONS.set(conversation_id, next_state)
 
-                await turn_context.send_activity(combined_response)
-            else:
-                no_result_found = sql_to_nlp(
-                    f"Question: {nlp_query}\nAnswer:\nNo answer found."
-                )
-                await turn_context.send_activity(no_result_found)
+        if answer.results is None:
+            await turn_context.send_activity(answer.text)
+        elif CONFIG.STREAM_RESPONSES:
+            await self._send_streamed(turn_context, answer.results, answer.summary)
         else:
-            no_result_found = sql_to_nlp(
-                f"Question: {nlp_query}\nAnswer:\nI'm not sure I understand. Can you give more details or rephrase?"
-            )
-            await turn_context.send_activity(no_result_found)
-
-        conn.close()
-        print("Connection closed.")
+            nlp_response = await asyncio.shield(answer.summary)
+            summary_text = f"\n\n\n\n**Summary**:\n{nlp_response}" if nlp_response else ""
+            with stage("markdown_formatting"):
+                rendered = render_results(answer.results, trailing_text=summary_text)
+
+            # The last page carries the note, attachment and summary
+            for page in rendered.pages[:-1]:
+                await turn_context.send_activity(page)
+            combined_response = rendered.pages[-1]
+            if rendered.note:
+                combined_response += f"\n\n{rendered.note}"
+            combined_response += summary_text
+
+            await turn_context.send_activity(note_activity(rendered, combined_response))
+
+    async def _send_streamed(self, turn_context, results, summary_task):
+        with stage("markdown_formatting"):
+            rendered = render_results(results)
+        for page in rendered.pages:
+            await turn_context.send_activity(page)
+        if rendered.note:
+            await turn_context.send_activity(note_activity(rendered))
+
+        if not summary_task.done():
+            await turn_context.send_activity(Activity(type=ActivityTypes.typing))
+        # Shielded: the summary task may be shared with other waiting turns
+        nlp_response = await asyncio.shield(summary_task)
+        if nlp_response:
+            await turn_context.send_activity(f"**Summary**:\n{nlp_response}")
 
     async def on_members_added_activity(
         self, members_added: ChannelAccount, turn_context: TurnContext
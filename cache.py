@@ -0,0 +1,245 @@
+import asyncio
+import hashlib
+import pickle
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from config import DefaultConfig
+
+CONFIG = DefaultConfig()
+
+MONTHS = {
+    "jan": "january",
+    "feb": "february",
+    "mar": "march",
+    "apr": "april",
+    "jun": "june",
+    "jul": "july",
+    "aug": "august",
+    "sep": "september",
+    "sept": "september",
+    "oct": "october",
+    "nov": "november",
+    "dec": "december",
+}
+
+# Filler words that never change the meaning of an analytics question.
+# Words such as "not", "by", "in", "to" and "top" are deliberately kept.
+STOPWORDS = {
+    "a",
+    "an",
+    "the",
+    "please",
+    "pls",
+    "kindly",
+    "can",
+    "could",
+    "would",
+    "you",
+    "me",
+    "i",
+    "we",
+    "us",
+    "want",
+    "need",
+    "show",
+    "give",
+    "tell",
+    "get",
+    "fetch",
+    "display",
+    "find",
+    "what",
+    "whats",
+    "which",
+    "is",
+    "are",
+    "was",
+    "were",
+    "do",
+    "does",
+}
+
+_PUNCTUATION = re.compile(r"[^\w\s\-./%]")
+_MONTH_TOKEN = re.compile(r"^([a-z]+)(-\d{2,4})?$")
+
+
+def normalize_query(text):
+    """Canonical form of a question used as a cache key."""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = _PUNCTUATION.sub(" ", text.replace("'", ""))
+
+    tokens = []
+    for token in text.split():
+        token = token.strip(".")
+        if not token or token in STOPWORDS:
+            continue
+        match = _MONTH_TOKEN.match(token)
+        if match and match.group(1) in MONTHS:
+            token = MONTHS[match.group(1)] + (match.group(2) or "")
+        tokens.append(token)
+    return " ".join(tokens)
+
+
+class TTLCache:
+    """Thread-safe LRU cache with a size bound and per-entry time to live."""
+
+    def __init__(self, maxsize=1024, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def add(self, key, value, ttl=None):
+        """Set ``key`` only if it holds no live value; True when it was set."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] >= time.monotonic():
+                return False
+        self.set(key, value, ttl)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    """``TTLCache`` interface backed by Redis, shared by every worker process.
+
+    Values are pickled, so the server must be trusted (e.g. a local Redis on
+    the same VM). Size is bounded by the server's ``maxmemory`` policy rather
+    than per cache. Redis errors count as misses and pause Redis use for
+    ``retry_after`` seconds, so an outage slows turns down but never fails them.
+    """
+
+    def __init__(self, url, prefix, ttl=3600.0, timeout=0.25, retry_after=5.0):
+        import redis
+
+        self._errors = (redis.RedisError, OSError)
+        self._redis = redis.Redis.from_url(
+            url, socket_timeout=timeout, socket_connect_timeout=timeout
+        )
+        self.prefix = prefix
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self._down_until = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return self.prefix + hashlib.sha1(str(key).encode("utf-8")).hexdigest()
+
+    def _call(self, method, *args, **kwargs):
+        if time.monotonic() < self._down_until:
+            return None
+        try:
+            return getattr(self._redis, method)(*args, **kwargs)
+        except self._errors as error:
+            print(f"Redis cache unavailable, using none for {self.retry_after}s: {error}", file=sys.stderr)
+            self._down_until = time.monotonic() + self.retry_after
+            return None
+
+    def get(self, key, default=None):
+        data = self._call("get", self._key(key))
+        if data is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._call("set", self._key(key), data, px=max(1, int(ttl * 1000)))
+
+    def add(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return bool(self._call("set", self._key(key), data, px=max(1, int(ttl * 1000)), nx=True))
+
+    def delete(self, key):
+        self._call("delete", self._key(key))
+
+    def clear(self):
+        keys = self._call("keys", self.prefix + "*")
+        if keys:
+            self._call("delete", *keys)
+
+    def __len__(self):
+        keys = self._call("keys", self.prefix + "*")
+        return len(keys) if keys else 0
+
+
+def make_cache(name, maxsize, ttl):
+    """Cache for ``name`` on the configured backend (``CACHE_BACKEND``)."""
+    if CONFIG.CACHE_BACKEND == "redis":
+        return RedisCache(CONFIG.REDIS_URL, prefix=f"{CONFIG.CACHE_PREFIX}:{name}:", ttl=ttl)
+    return TTLCache(maxsize=maxsize, ttl=ttl)
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one in-flight task.
+
+    Callers arriving while a task for their key is still running await that
+    task instead of starting their own. The task is shielded, so one caller
+    being cancelled does not cancel the work the others are waiting on.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, factory):
+        """Return ``(result, shared)``; ``shared`` is true for callers that joined."""
+        task = self._inflight.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def __len__(self):
+        return len(self._inflight)
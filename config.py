@@ -8,7 +8,15 @@ import os
 class DefaultConfig:
     """Bot Configuration"""
 
-    PORT = 3978
+    PORT = int(os.environ.get("PORT", "3978"))
+    HOST = os.environ.get("HOST", "localhost")
+    # Worker processes when served by gunicorn (0 = one per CPU core)
+    WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "0"))
+    # Seconds a stopping worker waits for in-flight turns to finish
+    SHUTDOWN_DRAIN_TIMEOUT = float(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+    # Seconds between retries of failed warm-up steps; /ready stays 503 meanwhile
+    WARM_UP_RETRY_INTERVAL = float(os.environ.get("WARM_UP_RETRY_INTERVAL", "15"))
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
     APP_ID = os.environ.get("MicrosoftAppId", "")
     APP_PASSWORD = os.environ.get("MicrosoftAppPassword", "")
 
@@ -22,8 +30,142 @@ class DefaultConfig:
         "",
     )
 
+    # Shared LLM HTTP session
+    LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "120"))
+    LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "100"))
+    LLM_KEEPALIVE_TIMEOUT = float(os.environ.get("LLM_KEEPALIVE_TIMEOUT", "60"))
+    LLM_JSON_MODE = os.environ.get("LLM_JSON_MODE", "true").lower() == "true"
+
+    # Per-attempt timeouts by stage, retries and pacing for the LLM endpoint
+    LLM_TIMEOUT_TABLE_SELECTION = float(os.environ.get("LLM_TIMEOUT_TABLE_SELECTION", "10"))
+    LLM_TIMEOUT_SQL_GENERATION = float(os.environ.get("LLM_TIMEOUT_SQL_GENERATION", "30"))
+    LLM_TIMEOUT_SUMMARY = float(os.environ.get("LLM_TIMEOUT_SUMMARY", "30"))
+    LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+    LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", "0.5"))
+    LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", "8"))
+    # Deployment quota in tokens per minute; 0 leaves pacing to the server's 429s
+    LLM_TOKENS_PER_MINUTE = int(os.environ.get("LLM_TOKENS_PER_MINUTE", "0"))
+    LLM_BREAKER_THRESHOLD = int(os.environ.get("LLM_BREAKER_THRESHOLD", "5"))
+    LLM_BREAKER_RESET = float(os.environ.get("LLM_BREAKER_RESET", "30"))
+
+    # "combined" picks the table and writes the SQL in one LLM call,
+    # "two_step" keeps the separate table selection call
+    SQL_GENERATION_MODE = os.environ.get("SQL_GENERATION_MODE", "combined")
+
     # SQL Server Configuration
     SQL_SERVER = os.environ.get("SQL_SERVER", "")
     SQL_DB = os.environ.get("SQL_DB", "")
     SQL_USERNAME = os.environ.get("SQL_USERNAME", "")
     SQL_PWD = os.environ.get("SQL_PWD", "")
+    SCHEMA_TABLES = tuple(
+        name.strip()
+        for name in os.environ.get("SCHEMA_TABLES", "primary_sales,secondary_sales").split(",")
+        if name.strip()
+    )
+    SCHEMA_CACHE_TTL = float(os.environ.get("SCHEMA_CACHE_TTL", "3600"))
+    # "module:function" returning a DB-API connection, e.g. a local stand-in
+    # database for benchmarks; empty means ODBC Driver 18 for SQL Server
+    SQL_CONNECTION_FACTORY = os.environ.get("SQL_CONNECTION_FACTORY", "")
+    SQL_CONNECT_TIMEOUT = int(os.environ.get("SQL_CONNECT_TIMEOUT", "30"))
+    SQL_CONNECT_RETRIES = int(os.environ.get("SQL_CONNECT_RETRIES", "3"))
+    SQL_CONNECT_BACKOFF = float(os.environ.get("SQL_CONNECT_BACKOFF", "0.5"))
+
+    # SQL Connection Pool Configuration
+    SQL_POOL_MIN_SIZE = int(os.environ.get("SQL_POOL_MIN_SIZE", "1"))
+    SQL_POOL_MAX_SIZE = int(os.environ.get("SQL_POOL_MAX_SIZE", "10"))
+    SQL_POOL_IDLE_TIMEOUT = float(os.environ.get("SQL_POOL_IDLE_TIMEOUT", "300"))
+    SQL_POOL_ACQUIRE_TIMEOUT = float(os.environ.get("SQL_POOL_ACQUIRE_TIMEOUT", "30"))
+
+    # Threads running blocking SQL work off the event loop
+    SQL_MAX_WORKERS = int(os.environ.get("SQL_MAX_WORKERS", str(SQL_POOL_MAX_SIZE)))
+
+    # NL->SQL and SQL result caches
+    SQL_CACHE_SIZE = int(os.environ.get("SQL_CACHE_SIZE", "2048"))
+    SQL_CACHE_TTL = float(os.environ.get("SQL_CACHE_TTL", "86400"))
+    RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "256"))
+    RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "300"))
+    # "memory" keeps caches per process; "redis" shares them across workers
+    CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory").lower()
+    REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+    CACHE_PREFIX = os.environ.get("CACHE_PREFIX", "bot")
+    # Concurrent turns asking the same normalized question share one pipeline run
+    COALESCE_QUESTIONS = os.environ.get("COALESCE_QUESTIONS", "true").lower() == "true"
+
+    # Per-conversation memory of the last query, for follow-up questions
+    FOLLOW_UPS_ENABLED = os.environ.get("FOLLOW_UPS_ENABLED", "true").lower() == "true"
+    CONVERSATION_STATE_SIZE = int(os.environ.get("CONVERSATION_STATE_SIZE", "1000"))
+    CONVERSATION_STATE_TTL = float(os.environ.get("CONVERSATION_STATE_TTL", "1800"))
+    CONVERSATION_MAX_ROWS = int(os.environ.get("CONVERSATION_MAX_ROWS", "500"))
+
+    # Template questions answered from a dimension-value index without the LLM
+    FAST_PATH_ENABLED = os.environ.get("FAST_PATH_ENABLED", "true").lower() == "true"
+    DIMENSION_REFRESH_INTERVAL = float(os.environ.get("DIMENSION_REFRESH_INTERVAL", "3600"))
+    DIMENSION_MAX_VALUES = int(os.environ.get("DIMENSION_MAX_VALUES", "5000"))
+
+    # Names in questions resolved to exact values before SQL generation
+    VALUE_GROUNDING_ENABLED = os.environ.get("VALUE_GROUNDING_ENABLED", "true").lower() == "true"
+    DIMENSION_FUZZY_MAX_VALUES = int(os.environ.get("DIMENSION_FUZZY_MAX_VALUES", "200000"))
+    DIMENSION_FUZZY_THRESHOLD = float(os.environ.get("DIMENSION_FUZZY_THRESHOLD", "0.6"))
+    DIMENSION_FULL_REFRESH_EVERY = int(os.environ.get("DIMENSION_FULL_REFRESH_EVERY", "24"))
+
+    # Local table router; below these thresholds the LLM picks the table
+    ROUTER_MIN_SCORE = float(os.environ.get("ROUTER_MIN_SCORE", "1"))
+    ROUTER_MIN_CONFIDENCE = float(os.environ.get("ROUTER_MIN_CONFIDENCE", "0.6"))
+
+    # Send the result table as soon as it is ready and the summary as a follow-up
+    STREAM_RESPONSES = os.environ.get("STREAM_RESPONSES", "true").lower() == "true"
+    STREAM_CHUNK_ROWS = int(os.environ.get("STREAM_CHUNK_ROWS", "50"))
+
+    # Chat payload limits for rendered result tables
+    RESPONSE_MAX_CHARS = int(os.environ.get("RESPONSE_MAX_CHARS", "20000"))
+    RESPONSE_MAX_PAGES = int(os.environ.get("RESPONSE_MAX_PAGES", "5"))
+    RESPONSE_MAX_CELL_CHARS = int(os.environ.get("RESPONSE_MAX_CELL_CHARS", "60"))
+    RESPONSE_CSV_ATTACHMENT = os.environ.get("RESPONSE_CSV_ATTACHMENT", "true").lower() == "true"
+    RESPONSE_CSV_MAX_BYTES = int(os.environ.get("RESPONSE_CSV_MAX_BYTES", "180000"))
+    RESPONSE_MAX_ACTIVITY_BYTES = int(os.environ.get("RESPONSE_MAX_ACTIVITY_BYTES", "240000"))
+
+    # Bounded row fetching and summarization input
+    SQL_MAX_ROWS = int(os.environ.get("SQL_MAX_ROWS", "5000"))
+    SQL_FETCH_BATCH_SIZE = int(os.environ.get("SQL_FETCH_BATCH_SIZE", "500"))
+    SUMMARY_SAMPLE_ROWS = int(os.environ.get("SUMMARY_SAMPLE_ROWS", "50"))
+
+    # Results up to these sizes are phrased locally / with the short summary prompt
+    SUMMARY_LOCAL_MAX_ROWS = int(os.environ.get("SUMMARY_LOCAL_MAX_ROWS", "3"))
+    SUMMARY_SHORT_MAX_ROWS = int(os.environ.get("SUMMARY_SHORT_MAX_ROWS", "20"))
+    # Seconds to wait for a summary before the table is sent without one
+    SUMMARY_TIMEOUT = float(os.environ.get("SUMMARY_TIMEOUT", "15"))
+
+    # SQL pre-flight checks; a plan cost of 0 skips the SHOWPLAN_XML estimate
+    SQL_CHECK_COLUMNS = os.environ.get("SQL_CHECK_COLUMNS", "true").lower() == "true"
+    SQL_QUERY_TIMEOUT = int(os.environ.get("SQL_QUERY_TIMEOUT", "30"))
+    SQL_MAX_PLAN_COST = float(os.environ.get("SQL_MAX_PLAN_COST", "0"))
+
+    # Failed or empty queries are sent back to the model with the error, as
+    # long as the turn is still inside its deadline
+    SQL_REPAIR_ATTEMPTS = int(os.environ.get("SQL_REPAIR_ATTEMPTS", "2"))
+    SQL_REPAIR_EMPTY_RESULTS = os.environ.get("SQL_REPAIR_EMPTY_RESULTS", "true").lower() == "true"
+    TURN_DEADLINE = float(os.environ.get("TURN_DEADLINE", "60"))
+
+    # Pre-aggregated rollup tables; creating them needs DDL rights, so opt-in
+    ROLLUPS_ENABLED = os.environ.get("ROLLUPS_ENABLED", "false").lower() == "true"
+    ROLLUP_REFRESH_INTERVAL = float(os.environ.get("ROLLUP_REFRESH_INTERVAL", "3600"))
+    ROLLUP_REFRESH_PERIODS = int(os.environ.get("ROLLUP_REFRESH_PERIODS", "1"))
+
+    # Batch runner (batch.py) for scheduled reports, kept well below the
+    # interactive limits; 0 tokens per minute keeps LLM_TOKENS_PER_MINUTE
+    BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+    BATCH_DB_CONNECTIONS = int(os.environ.get("BATCH_DB_CONNECTIONS", "2"))
+    BATCH_TOKENS_PER_MINUTE = int(os.environ.get("BATCH_TOKENS_PER_MINUTE", "0"))
+    BATCH_OUTPUT_ROWS = int(os.environ.get("BATCH_OUTPUT_ROWS", "100"))
+
+    # Prompt budgets
+    MAX_TOKENS_TABLE_SELECTION = int(os.environ.get("MAX_TOKENS_TABLE_SELECTION", "20"))
+    MAX_TOKENS_SQL_GENERATION = int(os.environ.get("MAX_TOKENS_SQL_GENERATION", "800"))
+    MAX_TOKENS_SUMMARY = int(os.environ.get("MAX_TOKENS_SUMMARY", "800"))
+    MAX_TOKENS_SUMMARY_SHORT = int(os.environ.get("MAX_TOKENS_SUMMARY_SHORT", "150"))
+    PROMPT_SCHEMA_TOKEN_BUDGET = int(os.environ.get("PROMPT_SCHEMA_TOKEN_BUDGET", "1500"))
+    PROMPT_RELEVANT_COLUMNS_ONLY = (
+        os.environ.get("PROMPT_RELEVANT_COLUMNS_ONLY", "true").lower() == "true"
+    )
+    PROMPT_MIN_COLUMNS = int(os.environ.get("PROMPT_MIN_COLUMNS", "8"))
+    PROMPT_MAX_COLUMNS = int(os.environ.get("PROMPT_MAX_COLUMNS", "16"))
@@ -0,0 +1,249 @@
+import re
+from collections import OrderedDict
+from decimal import Decimal
+
+from cache import make_cache
+from config import DefaultConfig
+from results import QueryResult
+from router import ROUTER, split_identifier, tokenize
+
+CONFIG = DefaultConfig()
+
+# "now only for Maharashtra", "what about Gujarat?", "break that down by zone"
+_FOLLOW_UP_LEAD = re.compile(
+    r"^(now|what about|how about|same|instead|only|just|but|then|"
+    r"break|split|group|filter|exclude|excluding|except|without|sort)\b",
+    re.IGNORECASE,
+)
+# "for Maharashtra", "by month" - fragments that only make sense after a question
+_FRAGMENT_LEAD = re.compile(r"^(for|by|in|per|across|from|with)\b", re.IGNORECASE)
+_BACK_REFERENCE = re.compile(
+    r"\b(those|these|them|same|above|previous|earlier)\b", re.IGNORECASE
+)
+# A question naming what to measure, or which table, usually stands on its own
+_MEASURE_WORDS = {
+    "sale", "value", "unit", "volume", "revenue", "quantity", "amount", "uvg", "growth",
+}
+_TABLE_WORDS = {"primary", "secondary", "dealer", "customer", "product", "salesman", "invoice"}
+
+_NEGATION = re.compile(r"\b(except|excluding|without|not|other than|apart from)\s+$", re.IGNORECASE)
+_REGROUP = re.compile(
+    r"^(?:now |and |just |only )?(?:(?:break|split|group|sum|total)\w*\s+"
+    r"(?:it |that |this |them |those )?(?:down |up )?)?(?:only )?by\s+(\w+)(?:\s+only)?$",
+    re.IGNORECASE,
+)
+_TOP_N = re.compile(
+    r"^(?:now |and |just |only )?(?:show )?(?:me )?(?:the |only )?(top|bottom|first|last)\s+(\d+)"
+    r"(?:\s+(?:only|rows|results|of them|of those))?$",
+    re.IGNORECASE,
+)
+# Words a pure filter follow-up is made of besides the values themselves
+_FILTER_WORDS = {
+    "now", "only", "just", "for", "in", "the", "and", "also", "what", "about",
+    "how", "show", "me", "it", "that", "this", "those", "them", "same", "but",
+    "of", "please", "with", "to", "is", "are", "rows", "where", "filter",
+    "keep", "except", "excluding", "without", "not", "other", "than", "apart",
+    "from", "then", "instead", "one", "ones", "too", "as", "well",
+}
+# ``TOP 10`` / ``FETCH NEXT 10 ROWS``: the rows are a cut, not the whole answer
+_ROW_LIMIT = re.compile(r"\b(TOP|FETCH)\b", re.IGNORECASE)
+_STRING_LITERAL = re.compile(r"N?'(?:[^']|'')*'")
+# Measures that cannot be added up when rows are regrouped
+_NON_ADDITIVE = re.compile(r"(uvg|avg|average|percent|pct|growth|rate|ratio|share)", re.IGNORECASE)
+
+
+def is_follow_up(text, table_name=None):
+    """Heuristic: does ``text`` refine the previous question rather than ask a new one?
+
+    Besides reading like a refinement, the text must either name no measure
+    or table of its own or be routed to ``table_name``, the table the
+    previous question was answered from.
+    """
+    text = (text or "").strip()
+    words = len(text.split())
+    if not (
+        _FOLLOW_UP_LEAD.search(text)
+        or _TOP_N.match(text.strip(" ?.!"))
+        or (words <= 6 and _FRAGMENT_LEAD.search(text))
+        or (words <= 8 and _BACK_REFERENCE.search(text))
+    ):
+        return False
+    if not set(tokenize(text)) & (_MEASURE_WORDS | _TABLE_WORDS):
+        return True
+    return table_name is not None and ROUTER.route(text).table_name == table_name
+
+
+class ConversationState:
+    """What a conversation last asked, kept so follow-ups can build on it.
+
+    Rows are kept only for small, complete results of SQL without its own
+    row limit, since local filtering of a cut-off result would silently
+    drop rows. ``refinements`` are follow-ups answered from the rows that
+    ``sql_query`` does not include yet.
+    """
+
+    def __init__(self, nlp_query, table_name, sql_query, results=None, refinements=()):
+        self.nlp_query = nlp_query
+        self.table_name = table_name
+        self.sql_query = sql_query
+        self.refinements = tuple(refinements)
+        if results is not None and (
+            results.truncated
+            or len(results) > CONFIG.CONVERSATION_MAX_ROWS
+            or _ROW_LIMIT.search(_STRING_LITERAL.sub("''", sql_query or ""))
+        ):
+            results = None
+        self.results = results
+
+    def question_with(self, follow_up):
+        """The follow-up read together with what it refines, for prompts."""
+        return f"{self.nlp_query} / {follow_up}"
+
+    def refined(self, follow_up):
+        """The state after ``follow_up`` was answered from the rows.
+
+        The refined rows are not kept, so the next follow-up is answered
+        with SQL that is told about every refinement so far.
+        """
+        return ConversationState(
+            self.question_with(follow_up),
+            self.table_name,
+            self.sql_query,
+            refinements=self.refinements + (follow_up,),
+        )
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def _text_columns(result):
+    return [
+        index
+        for index in range(len(result.columns))
+        if any(isinstance(row[index], str) for row in result.rows)
+        and all(row[index] is None or isinstance(row[index], str) for row in result.rows)
+    ]
+
+
+def _numeric_columns(result):
+    return [
+        index
+        for index in range(len(result.columns))
+        if any(_is_number(row[index]) for row in result.rows)
+        and all(row[index] is None or _is_number(row[index]) for row in result.rows)
+    ]
+
+
+def _column_words(result):
+    return {token for column in result.columns for token in split_identifier(column)}
+
+
+def filter_rows(result, text):
+    """Keep (or, after "except"/"without", drop) rows whose cell values the text names."""
+    lowered = text.lower().strip(" ?.!")
+    conditions = []
+    remaining = lowered
+    for index in _text_columns(result):
+        values = {row[index] for row in result.rows if row[index]}
+        matched = set()
+        negate = False
+        for value in sorted(values, key=len, reverse=True):
+            if len(value) < 3:
+                continue
+            match = re.search(r"(?<!\w)" + re.escape(value.lower()) + r"(?!\w)", lowered)
+            if match:
+                matched.add(value)
+                negate = negate or bool(_NEGATION.search(lowered[: match.start()]))
+                remaining = remaining.replace(value.lower(), " ")
+        if matched:
+            conditions.append((index, matched, negate))
+    if not conditions:
+        return None
+
+    # Anything else in the question ("by month", "last year") needs new SQL
+    allowed = _FILTER_WORDS | _column_words(result)
+    if any(word not in allowed for word in re.findall(r"\w+", remaining)):
+        return None
+
+    rows = [
+        row
+        for row in result.rows
+        if all((row[index] in matched) != negate for index, matched, negate in conditions)
+    ]
+    return QueryResult(result.columns, rows)
+
+
+def regroup(result, text):
+    """Re-aggregate the rows by one of their own columns ("now by zone")."""
+    match = _REGROUP.match(text.strip(" ?.!"))
+    if match is None:
+        return None
+    word = match.group(1).lower().rstrip("s")
+    text_columns = _text_columns(result)
+    numeric_columns = _numeric_columns(result)
+    if len(text_columns) < 2 or not numeric_columns:
+        return None
+    if any(_NON_ADDITIVE.search(result.columns[index]) for index in numeric_columns):
+        return None
+
+    key_index = next(
+        (
+            index
+            for index in text_columns
+            if word in split_identifier(result.columns[index])
+        ),
+        None,
+    )
+    if key_index is None:
+        return None
+
+    totals = OrderedDict()
+    for row in result.rows:
+        sums = totals.setdefault(row[key_index], [0] * len(numeric_columns))
+        for position, index in enumerate(numeric_columns):
+            if row[index] is not None:
+                sums[position] += row[index]
+    columns = [result.columns[key_index]] + [result.columns[index] for index in numeric_columns]
+    rows = sorted(
+        ((key,) + tuple(sums) for key, sums in totals.items()),
+        key=lambda row: row[-1],
+        reverse=True,
+    )
+    return QueryResult(columns, rows)
+
+
+def top_n(result, text):
+    """"Top 5" / "bottom 3" / "first 10" of the rows already fetched."""
+    match = _TOP_N.match(text.strip(" ?.!"))
+    if match is None:
+        return None
+    which, count = match.group(1).lower(), int(match.group(2))
+    rows = result.rows
+    numeric_columns = _numeric_columns(result)
+    if which in ("top", "bottom") and numeric_columns:
+        sort_index = numeric_columns[-1]
+        rows = sorted(
+            rows,
+            key=lambda row: row[sort_index] if row[sort_index] is not None else 0,
+            reverse=which == "top",
+        )
+    elif which == "last":
+        rows = rows[-count:]
+    return QueryResult(result.columns, rows[:count])
+
+
+def refine_locally(result, text):
+    """Answer a follow-up from the previous rows, or None when new SQL is needed."""
+    if not result:
+        return None
+    for refine in (top_n, regroup, filter_rows):
+        refined = refine(result, text)
+        if refined is not None:
+            return refined
+    return None
+
+
+CONVERSATIONS = make_cache(
+    "conversation", CONFIG.CONVERSATION_STATE_SIZE, CONFIG.CONVERSATION_STATE_TTL
+)
@@ -0,0 +1,350 @@
+import asyncio
+import contextvars
+import importlib
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from types import SimpleNamespace
+
+from config import DefaultConfig
+from metrics import record_stage
+
+CONFIG = DefaultConfig()
+
+# SQLSTATEs and Azure SQL error numbers that are worth retrying.
+# See https://learn.microsoft.com/azure/azure-sql/database/troubleshoot-common-errors-issues
+TRANSIENT_SQLSTATES = {"08S01", "08001", "08004", "HYT00", "HYT01", "40001"}
+TRANSIENT_ERROR_CODES = {
+    "4060",
+    "4221",
+    "10053",
+    "10054",
+    "10060",
+    "10928",
+    "10929",
+    "40197",
+    "40501",
+    "40613",
+    "49918",
+    "49919",
+    "49920",
+}
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection could be checked out in time."""
+
+
+def connection_string():
+    return (
+        f"Driver={{ODBC Driver 18 for SQL Server}};Server=tcp:{CONFIG.SQL_SERVER},1433;"
+        f"Database={CONFIG.SQL_DB};Uid={CONFIG.SQL_USERNAME};Pwd={CONFIG.SQL_PWD};"
+        f"Encrypt=yes;TrustServerCertificate=no;Connection Timeout={CONFIG.SQL_CONNECT_TIMEOUT};"
+    )
+
+
+def establish_connection():
+    # Imported on first connect: loading the ODBC driver manager slows cold starts
+    import pyodbc
+
+    print("Establishing connection...")
+    conn = pyodbc.connect(connection_string())
+    print("Connection established.")
+    return conn
+
+
+def load_connection_factory(path):
+    module_name, _, function_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+class _NeverRaised(Exception):
+    """Stands in for error classes a connection factory's module does not define."""
+
+
+@lru_cache(maxsize=None)
+def error_types():
+    """The DB-API error classes of the driver in use.
+
+    pyodbc's, or those the ``SQL_CONNECTION_FACTORY`` module defines under
+    the PEP 249 names, so pyodbc is only needed when it is the driver.
+    """
+    if CONFIG.SQL_CONNECTION_FACTORY:
+        module = importlib.import_module(CONFIG.SQL_CONNECTION_FACTORY.partition(":")[0])
+    else:
+        import pyodbc as module
+    return SimpleNamespace(
+        **{
+            name: getattr(module, name, _NeverRaised)
+            for name in ("Error", "OperationalError", "ProgrammingError", "DataError")
+        }
+    )
+
+
+def is_transient_error(error):
+    if not isinstance(error, error_types().Error):
+        return False
+
+    sqlstate = str(error.args[0]) if error.args else ""
+    message = str(error)
+    return sqlstate in TRANSIENT_SQLSTATES or any(
+        f"({code})" in message for code in TRANSIENT_ERROR_CODES
+    )
+
+
+class ConnectionPool:
+    """Thread-safe pool of DB-API connections shared across turns.
+
+    ``connect`` is any zero-argument callable returning a DB-API connection,
+    so the pool can be exercised against ``sqlite3`` or a fake driver.
+    """
+
+    def __init__(
+        self,
+        connect,
+        min_size=1,
+        max_size=10,
+        idle_timeout=300.0,
+        acquire_timeout=30.0,
+        health_check_after=5.0,
+        retries=3,
+        backoff=0.5,
+        is_transient=is_transient_error,
+        health_check_query="SELECT 1",
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size, max_size >= 1")
+
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+        self.retries = retries
+        self.backoff = backoff
+        self._is_transient = is_transient
+        self._health_check_query = health_check_query
+
+        self._idle = deque()  # (connection, last_used) pairs, most recent on the right
+        self._size = 0  # idle + checked out
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def warm(self):
+        """Open connections until ``min_size`` are available."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect_with_retry()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            self.release(conn)
+
+    def acquire(self, timeout=None):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            stale = []
+            conn = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeoutError("Connection pool is closed.")
+                    stale.extend(self._evict_idle_locked())
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        last_used = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(
+                            f"Timed out after {timeout}s waiting for a SQL connection."
+                        )
+                    self._cond.wait(remaining)
+
+            for stale_conn in stale:
+                self._close_quietly(stale_conn)
+
+            if conn is None:
+                try:
+                    return self._connect_with_retry()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if time.monotonic() - last_used < self.health_check_after or self._healthy(conn):
+                return conn
+
+            print("Discarding unhealthy pooled connection.")
+            self._discard(conn)
+
+    def release(self, conn, discard=False):
+        if not discard:
+            try:
+                # End any implicit transaction so no locks outlive the turn.
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+
+        if conn is not None:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except Exception as e:
+            self.release(conn, discard=self._is_transient(e))
+            raise
+        else:
+            self.release(conn)
+
+    def evict_idle(self):
+        with self._cond:
+            stale = self._evict_idle_locked()
+        for conn in stale:
+            self._close_quietly(conn)
+        return len(stale)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def _evict_idle_locked(self):
+        stale = []
+        now = time.monotonic()
+        # The oldest connections sit on the left of the deque.
+        while (
+            self._idle
+            and self._size > self.min_size
+            and now - self._idle[0][1] > self.idle_timeout
+        ):
+            stale.append(self._idle.popleft()[0])
+            self._size -= 1
+        return stale
+
+    def _connect_with_retry(self):
+        attempt = 0
+        while True:
+            try:
+                return self._connect()
+            except Exception as e:
+                if attempt >= self.retries or not self._is_transient(e):
+                    raise
+                delay = self.backoff * (2**attempt) * random.uniform(0.5, 1.5)
+                print(f"Transient connection error, retrying in {delay:.2f}s: {e}")
+                time.sleep(delay)
+                attempt += 1
+
+    def _healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self._health_check_query)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+        self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+POOL = ConnectionPool(
+    load_connection_factory(CONFIG.SQL_CONNECTION_FACTORY)
+    if CONFIG.SQL_CONNECTION_FACTORY
+    else establish_connection,
+    min_size=CONFIG.SQL_POOL_MIN_SIZE,
+    max_size=CONFIG.SQL_POOL_MAX_SIZE,
+    idle_timeout=CONFIG.SQL_POOL_IDLE_TIMEOUT,
+    acquire_timeout=CONFIG.SQL_POOL_ACQUIRE_TIMEOUT,
+    retries=CONFIG.SQL_CONNECT_RETRIES,
+    backoff=CONFIG.SQL_CONNECT_BACKOFF,
+)
+
+# Bounded executor for blocking pyodbc calls, sized so that every worker can
+# hold a pooled connection without waiting.
+DB_EXECUTOR = ThreadPoolExecutor(
+    max_workers=CONFIG.SQL_MAX_WORKERS, thread_name_prefix="sql"
+)
+
+
+async def run_in_db_executor(fn, *args):
+    # Carry the turn's context (trace, correlation ID) into the worker thread
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        DB_EXECUTOR, context.run, fn, *args
+    )
+
+
+async def run_with_connection(fn):
+    """Run ``fn(conn)`` on a pooled connection without blocking the event loop."""
+
+    def work():
+        started = time.perf_counter()
+        with POOL.connection() as conn:
+            record_stage("db_connect", time.perf_counter() - started)
+            return fn(conn)
+
+    return await run_in_db_executor(work)
+
+
+async def evict_idle_connections(pool, interval):
+    """Close ``pool``'s idle connections above its minimum every ``interval`` seconds.
+
+    Checkouts only evict on the way through, so a pool that grew during a burst
+    would otherwise keep its connections open until the next request.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        await run_in_db_executor(pool.evict_idle)
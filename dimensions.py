@@ -0,0 +1,426 @@
+import asyncio
+import os
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+
+from cache import make_cache
+from config import DefaultConfig
+from db import run_with_connection
+from metrics import log_event, stage
+
+CONFIG = DefaultConfig()
+
+# Low-cardinality columns whose values users name in questions
+DIMENSION_COLUMNS = {
+    "primary_sales": (
+        "DivisionName",
+        "CustomerZoneName",
+        "CustomerState",
+        "ProductCategory",
+        "ProductSubcategory",
+        "SalesGroupName",
+        "CalendarMonthYear",
+    ),
+    "secondary_sales": (
+        "DealerClass",
+        "DealerCluster",
+        "DealerActiveStatus",
+        "InvoiceMonth",
+    ),
+}
+
+# Name columns too large for exact matching, searched by trigram similarity
+FUZZY_COLUMNS = {
+    "primary_sales": ("CustomerName", "ProductName", "CustomerTown"),
+    "secondary_sales": ("DealerName",),
+}
+
+# Column whose latest value holds the rows added since the last refresh
+PARTITIONS = {"primary_sales": "FiscalYear"}
+
+# Words that never start or end a name
+STOP_WORDS = {
+    "a", "about", "across", "all", "also", "an", "and", "are", "as", "at", "be",
+    "between", "bottom", "break", "buy", "by", "compare", "count", "did", "do",
+    "does", "down", "each", "for", "from", "give", "has", "have", "highest", "how",
+    "in", "is", "last", "list", "lowest", "many", "me", "most", "much", "now", "of",
+    "on", "only", "or", "per", "show", "sold", "sum", "than", "that", "the", "this",
+    "to", "top", "total", "was", "were", "what", "which", "who", "with",
+}
+
+# Words a name may contain ("Customer 12") but that are not a name by themselves
+DOMAIN_WORDS = {
+    "category", "cluster", "customer", "customers", "dealer", "dealers", "division",
+    "group", "month", "monthly", "name", "names", "primary", "product", "products",
+    "quarter", "sales", "secondary", "state", "town", "towns", "unit", "units",
+    "value", "values", "year", "zone",
+}
+
+_WORD = re.compile(r"[\w&.'-]+")
+
+
+def trigrams(text):
+    padded = f"  {text.lower()} "
+    return {padded[index : index + 3] for index in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Values of one column, found by the share of character trigrams they have with a term.
+
+    Similarity is the Dice coefficient of the two trigram sets, so small
+    typos and partial names ("shree ganesh" for "Shree Ganesh Traders")
+    still score well.
+    """
+
+    def __init__(self, values=()):
+        self.values = []
+        self.sizes = []
+        self.ids = {}
+        self.postings = defaultdict(set)
+        self.update(values)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, value):
+        key = value.lower()
+        if key in self.ids:
+            return False
+        grams = trigrams(key)
+        value_id = len(self.values)
+        self.ids[key] = value_id
+        self.values.append(value)
+        self.sizes.append(len(grams))
+        for gram in grams:
+            self.postings[gram].add(value_id)
+        return True
+
+    def update(self, values):
+        """Add the values not indexed yet; returns how many were new."""
+        return sum(1 for value in values if self.add(value))
+
+    def extended(self, values):
+        """A copy with ``values`` added, leaving this index untouched for readers.
+
+        Only the postings the new values touch are copied.
+        """
+        index = TrigramIndex()
+        index.values = list(self.values)
+        index.sizes = list(self.sizes)
+        index.ids = dict(self.ids)
+        index.postings = defaultdict(set, self.postings)
+        copied = set()
+        for value in values:
+            if value.lower() in index.ids:
+                continue
+            grams = trigrams(value.lower())
+            for gram in grams - copied:
+                index.postings[gram] = set(index.postings[gram])
+            copied |= grams
+            index.add(value)
+        return index
+
+    def search(self, term, threshold=0.6, limit=3, max_scan=20000):
+        """``[(score, value)]`` best first, for values at least ``threshold`` similar.
+
+        At most ``max_scan`` posting entries are counted, rarest trigrams first.
+        """
+        grams = trigrams(term)
+        postings = sorted(
+            (self.postings[gram] for gram in grams if self.postings.get(gram)), key=len
+        )
+        # Candidates come from the rarer trigrams; those shared by a large
+        # share of values say little and cost the most to count
+        common = max(1000, len(self.ids) // 20)
+        counts, scanned = Counter(), 0
+        for position, ids in enumerate(postings):
+            if position >= 2 and (len(ids) > common or scanned + len(ids) > max_scan):
+                break
+            counts.update(ids)
+            scanned += len(ids)
+        exact = self.ids.get(term.lower())
+        matches = [] if exact is None else [(1.0, self.values[exact])]
+        for value_id, _ in counts.most_common(limit * 20):
+            if value_id == exact:
+                continue
+            value = self.values[value_id]
+            score = 2 * len(grams & trigrams(value)) / (len(grams) + self.sizes[value_id])
+            if score >= threshold:
+                matches.append((score, value))
+        matches.sort(key=lambda match: -match[0])
+        return matches[:limit]
+
+
+class DimensionIndex:
+    """Distinct values of the dimension columns, for spotting them in questions.
+
+    ``find`` returns every known value named in a question together with the
+    ``(table, column, value)`` places it occurs, so callers can build exact
+    filters without asking the model which column a word belongs to.
+    ``resolve`` adds trigram matches against the large name columns.
+    """
+
+    def __init__(
+        self,
+        columns,
+        max_values=5000,
+        fuzzy_columns=None,
+        fuzzy_max_values=200000,
+        partitions=None,
+        full_refresh_every=24,
+        store=None,
+    ):
+        self.columns = columns
+        self.max_values = max_values
+        self.fuzzy_columns = fuzzy_columns or {}
+        self.fuzzy_max_values = fuzzy_max_values
+        self.partitions = partitions or {}
+        self.full_refresh_every = full_refresh_every
+        self.store = store
+        self.values = {}
+        self.fuzzy = {}
+        self.built_at = None
+        self.refreshed_at = None
+        self.refreshes = 0
+        self._pattern = None
+
+    @property
+    def ready(self):
+        return self.refreshed_at is not None
+
+    def fetch(self, conn, incremental=False):
+        """Blocking read of distinct values per ``(table, column)``; call from the DB executor.
+
+        With ``incremental`` the name columns are read only from the latest
+        partition, where new names appear; name columns of tables without a
+        partition are skipped until the next full read. Columns over their
+        size limit map to None.
+        """
+        fetched = {}
+        cursor = conn.cursor()
+        try:
+            for columns, max_values, fuzzy in (
+                (self.columns, self.max_values, False),
+                (self.fuzzy_columns, self.fuzzy_max_values, True),
+            ):
+                for table_name, column_names in columns.items():
+                    partition = self.partitions.get(table_name) if fuzzy and incremental else None
+                    if fuzzy and incremental and not partition:
+                        # Nothing cheaper than a full scan finds their new names
+                        continue
+                    for column_name in column_names:
+                        where = f" WHERE {column_name} IS NOT NULL"
+                        if partition:
+                            where += f" AND {partition} = (SELECT MAX({partition}) FROM {table_name})"
+                        cursor.execute(
+                            f"SELECT DISTINCT TOP {max_values + 1} {column_name} FROM {table_name}{where}"
+                        )
+                        rows = cursor.fetchall()
+                        values = [str(row[0]).strip() for row in rows if str(row[0]).strip()]
+                        # Too many values to be a dimension worth matching on
+                        fetched[(table_name, column_name)] = (
+                            values if len(rows) <= max_values else None
+                        )
+        finally:
+            cursor.close()
+        return fetched
+
+    def install(self, values):
+        # Longest first, so "West Bengal" is preferred over "West"
+        alternatives = sorted(values, key=len, reverse=True)
+        self._pattern = (
+            re.compile(
+                r"(?<!\w)(" + "|".join(re.escape(value) for value in alternatives) + r")(?!\w)",
+                re.IGNORECASE,
+            )
+            if alternatives
+            else None
+        )
+        self.values = values
+        self.refreshed_at = time.time()
+
+    def find(self, text):
+        """``[(start, end, places)]`` for each known value named in ``text``."""
+        if self._pattern is None:
+            return []
+        return [
+            (match.start(), match.end(), self.values[match.group(1).lower()])
+            for match in self._pattern.finditer(text)
+        ]
+
+    def resolve(self, text, table_names, threshold=0.6, max_words=3):
+        """Exact values the question refers to, as ``{(table, column): [values]}``.
+
+        Values of the small dimensions are matched exactly; remaining runs of
+        up to ``max_words`` words are looked up in the name columns of
+        ``table_names`` and kept when similar enough. Overlapping candidates
+        are settled in favour of the best score.
+        """
+        candidates = []
+        for start, end, places in self.find(text):
+            for table_name, column_name, value in places:
+                if table_name in table_names:
+                    candidates.append((2.0, start, end, table_name, column_name, value))
+
+        words = list(_WORD.finditer(text))
+        indexes = [
+            (key, index) for key, index in self.fuzzy.items() if key[0] in table_names and len(index)
+        ]
+        for size in range(min(max_words, len(words)), 0, -1):
+            for first in range(len(words) - size + 1):
+                window = words[first : first + size]
+                tokens = [word.group().lower() for word in window]
+                if tokens[0] in STOP_WORDS or tokens[-1] in STOP_WORDS:
+                    continue
+                if all(token in DOMAIN_WORDS for token in tokens):
+                    continue
+                start, end = window[0].start(), window[-1].end()
+                term = text[start:end]
+                if len(term) < 4:
+                    continue
+                for (table_name, column_name), index in indexes:
+                    for score, value in index.search(term, threshold, limit=1):
+                        candidates.append((score, start, end, table_name, column_name, value))
+
+        resolved, taken = {}, []
+        for score, start, end, table_name, column_name, value in sorted(
+            candidates, key=lambda candidate: (-candidate[0], candidate[1])
+        ):
+            if any(start < other_end and other_start < end for other_start, other_end in taken):
+                # An exact dimension value may sit in several columns at once
+                if score < 2.0 or (start, end) not in taken:
+                    continue
+            taken.append((start, end))
+            values = resolved.setdefault((table_name, column_name), [])
+            if value not in values:
+                values.append(value)
+        return resolved
+
+    def install_dimensions(self, fetched):
+        values = {}
+        for table_name, column_names in self.columns.items():
+            for column_name in column_names:
+                for value in fetched.get((table_name, column_name)) or ():
+                    if len(value) >= 2:
+                        values.setdefault(value.lower(), []).append((table_name, column_name, value))
+        self.install(values)
+
+    async def install_names(self, names, full):
+        """Rebuild the fuzzy index from ``names``, or add the new ones; returns how many were indexed."""
+        loop = asyncio.get_running_loop()
+        if full:
+            # Built off the event loop, then swapped in whole
+            self.fuzzy = await loop.run_in_executor(
+                None, lambda: {key: TrigramIndex(column_values) for key, column_values in names.items()}
+            )
+            return sum(len(index) for index in self.fuzzy.values())
+
+        def extend():
+            fuzzy, added = dict(self.fuzzy), 0
+            for key, column_values in names.items():
+                current = fuzzy.get(key, TrigramIndex())
+                fuzzy[key] = current.extended(column_values)
+                added += len(fuzzy[key]) - len(current)
+            return fuzzy, added
+
+        # Extended copies, so turns resolving names never see an index mid-update
+        self.fuzzy, added = await loop.run_in_executor(None, extend)
+        return added
+
+    async def refresh(self):
+        """Reload the small dimensions, and add new names to the fuzzy index.
+
+        Every ``full_refresh_every``-th refresh rebuilds the fuzzy index from
+        all rows, which also drops names that no longer occur.
+        """
+        full = self.refreshes % self.full_refresh_every == 0
+        started = time.perf_counter()
+        with stage("dimension_refresh"):
+            fetched = await run_with_connection(
+                lambda conn: self.fetch(conn, incremental=not full)
+            )
+        self.install_dimensions(fetched)
+
+        names = {
+            key: fetched.get(key) or ()
+            for key in ((table, column) for table, columns in self.fuzzy_columns.items() for column in columns)
+        }
+        added = await self.install_names(names, full)
+        if full:
+            self.built_at = time.time()
+        self.refreshes += 1
+        log_event(
+            "dimensions_refreshed",
+            mode="full" if full else "incremental",
+            values=len(self.values),
+            names_added=added,
+            ms=round((time.perf_counter() - started) * 1000, 1),
+        )
+
+    def snapshot(self):
+        """Everything another worker needs to install the same index without reading the tables."""
+        dimensions = {}
+        for places in self.values.values():
+            for table_name, column_name, value in places:
+                dimensions.setdefault((table_name, column_name), []).append(value)
+        return {
+            "built_at": self.built_at,
+            "dimensions": dimensions,
+            "names": {key: index.values for key, index in self.fuzzy.items()},
+        }
+
+    async def load(self, snapshot):
+        """Install an index published by the worker that refreshed it."""
+        started = time.perf_counter()
+        self.install_dimensions(snapshot["dimensions"])
+        # New names are added to the index in place; a rebuilt one is rebuilt here too
+        full = snapshot["built_at"] != self.built_at
+        added = await self.install_names(snapshot["names"], full)
+        self.built_at = snapshot["built_at"]
+        self.refreshes += 1
+        log_event(
+            "dimensions_loaded",
+            mode="full" if full else "incremental",
+            values=len(self.values),
+            names_added=added,
+            ms=round((time.perf_counter() - started) * 1000, 1),
+        )
+
+    async def run_scheduled(self, interval):
+        """Load the index now and refresh it every ``interval`` seconds.
+
+        With a shared store only the worker that claims the round reads the
+        tables; the others install the snapshot it publishes.
+        """
+        while True:
+            delay = interval
+            try:
+                if self.store is None or self.store.add("refresh", os.getpid(), ttl=interval * 0.9):
+                    await self.refresh()
+                    if self.store is not None:
+                        self.store.set("snapshot", self.snapshot(), ttl=interval * 2)
+                else:
+                    snapshot = self.store.get("snapshot")
+                    if snapshot is None:
+                        # The claiming worker has not finished its first refresh yet
+                        delay = min(interval, 60)
+                    else:
+                        await self.load(snapshot)
+            except Exception as error:
+                print(f"Dimension index refresh failed: {error}", file=sys.stderr)
+            await asyncio.sleep(delay)
+
+
+DIMENSIONS = DimensionIndex(
+    DIMENSION_COLUMNS,
+    max_values=CONFIG.DIMENSION_MAX_VALUES,
+    fuzzy_columns=FUZZY_COLUMNS if CONFIG.VALUE_GROUNDING_ENABLED else None,
+    fuzzy_max_values=CONFIG.DIMENSION_FUZZY_MAX_VALUES,
+    partitions=PARTITIONS,
+    full_refresh_every=CONFIG.DIMENSION_FULL_REFRESH_EVERY,
+    store=make_cache("dimensions", 2, CONFIG.DIMENSION_REFRESH_INTERVAL * 2)
+    if CONFIG.CACHE_BACKEND != "memory"
+    else None,
+)
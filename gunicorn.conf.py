@@ -0,0 +1,17 @@
+# Multi-worker serving: gunicorn -c gunicorn.conf.py app:APP
+import multiprocessing
+
+from config import DefaultConfig
+
+CONFIG = DefaultConfig()
+
+bind = f"{CONFIG.HOST}:{CONFIG.PORT}"
+workers = CONFIG.WEB_WORKERS or multiprocessing.cpu_count()
+worker_class = "aiohttp.GunicornWebWorker"
+
+# Workers stop accepting turns on SIGTERM and get this long to finish them
+graceful_timeout = int(CONFIG.SHUTDOWN_DRAIN_TIMEOUT)
+
+# Import the app once in the master; forked workers start without re-importing
+# botbuilder and aiohttp. Pools, sessions and threads are only created per worker.
+preload_app = True
@@ -0,0 +1,305 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+from config import DefaultConfig
+from metrics import LLM_REQUESTS, annotate, record_llm_usage
+from prompts import count_message_tokens
+
+CONFIG = DefaultConfig()
+
+# Seconds allowed per request attempt, by the ``stage`` passed to ``chat``
+STAGE_TIMEOUTS = {
+    "table_selection": CONFIG.LLM_TIMEOUT_TABLE_SELECTION,
+    "sql_generation": CONFIG.LLM_TIMEOUT_SQL_GENERATION,
+    "sql_repair": CONFIG.LLM_TIMEOUT_SQL_GENERATION,
+    "follow_up": CONFIG.LLM_TIMEOUT_SQL_GENERATION,
+    "summarization": CONFIG.LLM_TIMEOUT_SUMMARY,
+}
+
+# Throttling and server-side failures that a later attempt may not hit
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMUnavailableError(Exception):
+    """Raised without a request while the circuit breaker is open."""
+
+
+class TokenBucket:
+    """Spreads requests over a tokens-per-minute quota.
+
+    Each request takes its prompt tokens plus ``max_tokens`` up front, the
+    way Azure OpenAI counts them against the deployment's TPM limit, and
+    waits while the bucket is empty.
+    """
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self, tokens):
+        """Take ``tokens``, waiting for them if needed; returns seconds waited."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        tokens = min(tokens, self.capacity)
+        waited = 0.0
+        # Held while waiting, so requests are served in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                delay = (tokens - self.tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+
+class CircuitBreaker:
+    """Fails fast after ``failure_threshold`` consecutive failures.
+
+    After ``reset_timeout`` seconds one trial request is let through; its
+    success closes the circuit again, its failure keeps it open.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """``"closed"`` or ``"trial"`` when a request may go out, else None.
+
+        Only the caller given the trial may ``release`` it.
+        """
+        state = self.state
+        if state == "closed":
+            return "closed"
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return "trial"
+        return None
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def release(self):
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial = False
+
+
+def retry_after_seconds(headers):
+    """Delay asked for by ``retry-after-ms`` / ``Retry-After``, or None."""
+    milliseconds = headers.get("retry-after-ms")
+    if milliseconds:
+        try:
+            return float(milliseconds) / 1000
+        except ValueError:
+            pass
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMClient:
+    """Azure OpenAI chat-completions client sharing one keep-alive session.
+
+    Requests are bounded by a per-stage timeout, paced by an optional
+    tokens-per-minute bucket, retried with jittered backoff on throttling and
+    transient errors, and refused outright while the circuit breaker is open.
+    """
+
+    def __init__(
+        self,
+        timeout=120.0,
+        max_connections=100,
+        keepalive_timeout=60.0,
+        json_mode=True,
+        max_retries=3,
+        backoff_base=0.5,
+        backoff_max=8.0,
+        tokens_per_minute=0,
+        breaker=None,
+    ):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        # Older deployments reject response_format; prompts still ask for JSON
+        self.json_mode = json_mode
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.breaker = breaker or CircuitBreaker()
+        self._session = None
+
+    @property
+    def session(self):
+        # Created lazily so the session binds to the running event loop.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def warm(self, endpoints, timeout=10.0):
+        """Open keep-alive connections to ``endpoints`` before the first request needs them.
+
+        An unauthenticated GET is enough for DNS, TCP and TLS to be done; its
+        (error) response is read and discarded so the connection is pooled.
+        Returns the number of endpoints connected to.
+        """
+        endpoints = list(dict.fromkeys(endpoint for endpoint in endpoints if endpoint))
+        for endpoint in endpoints:
+            async with self.session.get(
+                endpoint, timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                await response.read()
+        return len(endpoints)
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            # The server knows when capacity frees up; jitter avoids a stampede
+            return retry_after + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def chat(
+        self,
+        endpoint,
+        key,
+        messages,
+        max_tokens=4096,
+        temperature=0.7,
+        top_p=0.95,
+        json_mode=False,
+        stage="llm",
+    ):
+        headers = {
+            "Content-Type": "application/json",
+            "api-key": key,
+        }
+
+        payload = {
+            "messages": messages,
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_tokens": max_tokens,
+        }
+        if json_mode and self.json_mode:
+            payload["response_format"] = {"type": "json_object"}
+
+        request_timeout = aiohttp.ClientTimeout(total=STAGE_TIMEOUTS.get(stage) or self.timeout)
+        attempt = 0
+        while True:
+            # Checked first, so requests that are refused spend no quota
+            admitted = self.breaker.allow()
+            if not admitted:
+                LLM_REQUESTS.inc(stage=stage, outcome="rejected")
+                raise LLMUnavailableError("The language model endpoint is failing; not calling it for now.")
+
+            retry_after = None
+            try:
+                if self.bucket is not None:
+                    waited = await self.bucket.acquire(count_message_tokens(messages) + max_tokens)
+                    if waited:
+                        annotate(llm_throttled_ms=round(waited * 1000, 1))
+                async with self.session.post(
+                    endpoint, headers=headers, json=payload, timeout=request_timeout
+                ) as response:
+                    if response.status in RETRY_STATUSES:
+                        retry_after = retry_after_seconds(response.headers)
+                    if response.status < 500:
+                        # Answered, even if with a 4xx: the endpoint itself is up
+                        self.breaker.record_success()
+                    response.raise_for_status()  # Raises ClientResponseError on an unsuccessful status code
+                    body = await response.json()
+            except asyncio.TimeoutError:
+                # Not retried: the stage timeout is the latency budget. Counted
+                # once, so an endpoint that accepts requests and hangs opens
+                # the circuit instead of holding every turn for the timeout
+                self.breaker.record_failure()
+                LLM_REQUESTS.inc(stage=stage, outcome="timeout")
+                raise
+            except (aiohttp.ClientResponseError, aiohttp.ClientConnectionError) as error:
+                status = getattr(error, "status", None)
+                if status is None or status >= 500:
+                    self.breaker.record_failure()
+                delay = self.backoff(attempt, retry_after)
+                retryable = status is None or status in RETRY_STATUSES
+                if retryable and attempt < self.max_retries and delay <= self.backoff_max:
+                    LLM_REQUESTS.inc(stage=stage, outcome="retry")
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                LLM_REQUESTS.inc(stage=stage, outcome="error")
+                raise
+            except Exception:
+                LLM_REQUESTS.inc(stage=stage, outcome="error")
+                raise
+            finally:
+                if admitted == "trial":
+                    # A cancelled or otherwise unresolved trial must not block the circuit
+                    self.breaker.release()
+
+            LLM_REQUESTS.inc(stage=stage, outcome="ok")
+            record_llm_usage(stage, body.get("usage"))
+            return body["choices"][0]["message"]["content"].strip()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+LLM = LLMClient(
+    timeout=CONFIG.LLM_TIMEOUT,
+    max_connections=CONFIG.LLM_MAX_CONNECTIONS,
+    keepalive_timeout=CONFIG.LLM_KEEPALIVE_TIMEOUT,
+    json_mode=CONFIG.LLM_JSON_MODE,
+    max_retries=CONFIG.LLM_MAX_RETRIES,
+    backoff_base=CONFIG.LLM_BACKOFF_BASE,
+    backoff_max=CONFIG.LLM_BACKOFF_MAX,
+    tokens_per_minute=CONFIG.LLM_TOKENS_PER_MINUTE,
+    breaker=CircuitBreaker(
+        failure_threshold=CONFIG.LLM_BREAKER_THRESHOLD,
+        reset_timeout=CONFIG.LLM_BREAKER_RESET,
+    ),
+)
@@ -0,0 +1,216 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger("bot.turn")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+# Per-turn trace shared by everything awaited (or run on the DB executor)
+# on behalf of the turn.
+_CURRENT_TURN = contextvars.ContextVar("current_turn", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames + ("le",), key + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames + ("le",), key + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {state[-2]}")
+                lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+TURN_SECONDS = REGISTRY.register(
+    Histogram("bot_turn_seconds", "End-to-end message turn latency.", ["outcome"])
+)
+STAGE_SECONDS = REGISTRY.register(
+    Histogram("bot_stage_seconds", "Latency of each pipeline stage.", ["stage"])
+)
+RESULT_ROWS = REGISTRY.register(
+    Histogram("bot_result_rows", "Rows returned per SQL query.", buckets=ROW_BUCKETS)
+)
+LLM_TOKENS = REGISTRY.register(
+    Counter("bot_llm_tokens_total", "LLM tokens used.", ["stage", "kind"])
+)
+LLM_REQUESTS = REGISTRY.register(
+    Counter("bot_llm_requests_total", "LLM requests made.", ["stage", "outcome"])
+)
+EVENTS = REGISTRY.register(
+    Counter("bot_events_total", "Pipeline decisions such as routing path and cache hits.", ["event", "value"])
+)
+
+
+class TurnTrace:
+    def __init__(self, turn_id, conversation_id=None):
+        self.turn_id = turn_id
+        self.conversation_id = conversation_id
+        self.stages = {}
+        self.fields = {}
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    trace = _CURRENT_TURN.get()
+    if trace is not None:
+        trace.add_stage(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage; works around sync code and ``await`` alike."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def annotate(**fields):
+    """Attach fields to the current turn's log line."""
+    trace = _CURRENT_TURN.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+def record_event(event, value, **fields):
+    """Count a categorical decision (e.g. route=rules) and log it with the turn."""
+    EVENTS.inc(event=event, value=value)
+    annotate(**{event: value}, **fields)
+
+
+def record_llm_usage(stage_name, usage):
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        tokens = usage.get(kind) or 0
+        LLM_TOKENS.inc(tokens, stage=stage_name, kind=kind.split("_")[0])
+        trace = _CURRENT_TURN.get()
+        if trace is not None:
+            trace.fields[kind] = trace.fields.get(kind, 0) + tokens
+
+
+def log_event(event, **fields):
+    trace = _CURRENT_TURN.get()
+    record = {"event": event, "turn_id": trace.turn_id if trace else None}
+    record.update(fields)
+    LOGGER.info(json.dumps(record, default=str))
+
+
+@contextmanager
+def turn(activity):
+    """Trace one message turn and emit a structured summary line at the end."""
+    conversation_id = activity.conversation.id if activity.conversation else None
+    trace = TurnTrace(activity.id or uuid.uuid4().hex, conversation_id)
+    token = _CURRENT_TURN.set(trace)
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield trace
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        TURN_SECONDS.observe(elapsed, outcome=outcome)
+        log_event(
+            "turn",
+            conversation_id=trace.conversation_id,
+            outcome=outcome,
+            total_ms=round(elapsed * 1000, 1),
+            stages_ms={name: round(seconds * 1000, 1) for name, seconds in trace.stages.items()},
+            **trace.fields,
+        )
+        _CURRENT_TURN.reset(token)
@@ -0,0 +1,330 @@
+import re
+from contextlib import contextmanager
+
+from config import DefaultConfig
+from schema import SCHEMA
+
+CONFIG = DefaultConfig()
+
+
+class PreflightError(Exception):
+    """Raised when generated SQL must not be sent to the database."""
+
+
+class QueryTimeoutError(Exception):
+    """Raised when a query runs longer than ``SQL_QUERY_TIMEOUT``."""
+
+
+class SqlExecutionError(Exception):
+    """Raised when the database rejects a query; carries the server's message."""
+
+
+# Statements and clauses a read-only analytics query never needs
+FORBIDDEN_KEYWORDS = {
+    "insert",
+    "update",
+    "delete",
+    "merge",
+    "drop",
+    "alter",
+    "create",
+    "truncate",
+    "exec",
+    "execute",
+    "grant",
+    "revoke",
+    "deny",
+    "into",
+    "openrowset",
+    "openquery",
+    "opendatasource",
+    "bulk",
+    "waitfor",
+    "shutdown",
+    "dbcc",
+    "backup",
+    "restore",
+    "kill",
+    "declare",
+}
+
+# T-SQL words that may appear where a column name could, including the
+# type names used in CAST and the date parts used by DATEPART/DATEADD
+SQL_KEYWORDS = {
+    "select",
+    "top",
+    "distinct",
+    "percent",
+    "with",
+    "ties",
+    "from",
+    "where",
+    "group",
+    "by",
+    "order",
+    "asc",
+    "desc",
+    "and",
+    "or",
+    "not",
+    "in",
+    "like",
+    "is",
+    "null",
+    "as",
+    "between",
+    "having",
+    "on",
+    "join",
+    "inner",
+    "left",
+    "right",
+    "full",
+    "outer",
+    "cross",
+    "union",
+    "all",
+    "except",
+    "intersect",
+    "exists",
+    "any",
+    "some",
+    "case",
+    "when",
+    "then",
+    "else",
+    "end",
+    "over",
+    "partition",
+    "rows",
+    "range",
+    "preceding",
+    "following",
+    "unbounded",
+    "current",
+    "row",
+    "offset",
+    "fetch",
+    "first",
+    "next",
+    "only",
+    "escape",
+    "collate",
+    "nolock",
+    "dbo",
+    "int",
+    "bigint",
+    "smallint",
+    "tinyint",
+    "decimal",
+    "numeric",
+    "float",
+    "real",
+    "money",
+    "date",
+    "datetime",
+    "datetime2",
+    "time",
+    "varchar",
+    "nvarchar",
+    "char",
+    "nchar",
+    "bit",
+    "max",
+    "year",
+    "yy",
+    "yyyy",
+    "quarter",
+    "qq",
+    "q",
+    "month",
+    "mm",
+    "m",
+    "dayofyear",
+    "dy",
+    "y",
+    "day",
+    "dd",
+    "d",
+    "week",
+    "wk",
+    "ww",
+    "weekday",
+    "dw",
+    "hour",
+    "hh",
+    "minute",
+    "mi",
+    "n",
+    "second",
+    "ss",
+    "s",
+    # Built-ins called without parentheses
+    "current_timestamp",
+    "current_user",
+    "session_user",
+    "system_user",
+    "user",
+    "current_date",
+}
+
+_COMMENT_OR_LITERAL = re.compile(r"('(?:[^']|'')*')|--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRING_LITERAL = re.compile(r"N?'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?(?:[eE][+-]?\d+)?\b")
+# ``"DivisionName"`` - a double-quoted identifier, read like ``[DivisionName]``
+_QUOTED_IDENTIFIER = re.compile(r'"([^"]+)"')
+_WORD = re.compile(r"\[([^\]]+)\]|([A-Za-z_@#][\w@#$]*)")
+_FUNCTION = re.compile(r"([A-Za-z_]\w*)\s*\(")
+_TABLE = re.compile(
+    r"\b(?:FROM|JOIN)\s+(?:\[?\w+\]?\.)?\[?(\w+)\]?"
+    r"(?:\s+(?:AS\s+)?(?!(?:WHERE|GROUP|ORDER|HAVING|ON|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|UNION|OUTER|WITH)\b)\[?(\w+)\]?)?",
+    re.IGNORECASE,
+)
+# ``WITH totals (Zone, Total) AS (`` - the CTE's name and optional column list
+_CTE_NAME = re.compile(r"(?:\bWITH|,)\s*\[?(\w+)\]?(?:\s*\(([^()]*)\))?\s+AS\s*\(", re.IGNORECASE)
+_ALIAS = re.compile(r"\bAS\s+(?:\[([^\]]+)\]|(\w+))", re.IGNORECASE)
+# ``FROM (SELECT ...) t`` - a derived table, with or without AS
+_DERIVED_ALIAS = re.compile(
+    r"\)\s*(?:AS\s+)?(?!(?:WHERE|GROUP|ORDER|HAVING|ON|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|UNION|OUTER|AS|WITH)\b)\[?([A-Za-z_]\w*)\]?",
+    re.IGNORECASE,
+)
+# ``SUM(x) TotalValue,`` - an alias given without AS
+_IMPLICIT_ALIAS = re.compile(r"([\w\)\]']+)\s+\[?([A-Za-z_]\w*)\]?\s*(?=,|\bFROM\b)", re.IGNORECASE)
+_LEADING_SELECT = re.compile(r"^\s*SELECT\s+(?:(?:DISTINCT|ALL)\s+)?", re.IGNORECASE)
+_HAS_TOP = re.compile(r"^\s*SELECT\s+(?:(?:DISTINCT|ALL)\s+)?TOP\b", re.IGNORECASE)
+_OFFSET_FETCH = re.compile(r"\bOFFSET\b.+\bROWS?\b", re.IGNORECASE | re.DOTALL)
+_PLAN_COST = re.compile(r'StatementSubTreeCost="([0-9.Ee+-]+)"')
+_DRIVER_PREFIX = re.compile(r"\[[^\]]*\]")
+_DRIVER_SUFFIX = re.compile(r"\s*(\(\d+\)\s*)?\(SQL\w+\)\s*$")
+
+
+def strip_comments(sql_query):
+    return _COMMENT_OR_LITERAL.sub(lambda match: match.group(1) or " ", sql_query).strip()
+
+
+def _code_only(sql_query):
+    """The query with literals blanked, so keywords inside strings are ignored."""
+    return _STRING_LITERAL.sub("''", sql_query)
+
+
+def check_statement(sql_query):
+    """Reject anything but a single read-only SELECT (optionally with CTEs)."""
+    code = _code_only(sql_query).rstrip().rstrip(";")
+    if not re.match(r"^\s*(SELECT|WITH)\b", code, re.IGNORECASE):
+        raise PreflightError("Only SELECT queries can be run.")
+    if ";" in code:
+        raise PreflightError("Only a single statement can be run.")
+    words = {word.lower() for word in re.findall(r"[A-Za-z_]\w*", code)}
+    forbidden = sorted(words & FORBIDDEN_KEYWORDS)
+    if forbidden:
+        raise PreflightError(f"The query uses {', '.join(forbidden).upper()}, which is not allowed.")
+
+
+async def check_columns(sql_query):
+    """Every referenced table and column must exist in the cached schema."""
+    code = _NUMBER.sub(" ", _QUOTED_IDENTIFIER.sub(r"[\1]", _code_only(sql_query)))
+    ctes, names = set(), set()
+    for name, column_list in _CTE_NAME.findall(code):
+        ctes.add(name.lower())
+        names |= {column.strip(" []").lower() for column in column_list.split(",") if column.strip()}
+    names |= {(bracketed or bare).lower() for bracketed, bare in _ALIAS.findall(code)}
+    names |= {name.lower() for name in _DERIVED_ALIAS.findall(code)}
+    names |= {
+        name.lower()
+        for before, name in _IMPLICIT_ALIAS.findall(code)
+        if before.lower() not in SQL_KEYWORDS
+    }
+    names |= {name.lower() for name in _FUNCTION.findall(code)}
+
+    columns = set()
+    for table_name, alias in _TABLE.findall(code):
+        names.add(table_name.lower())
+        if alias:
+            names.add(alias.lower())
+        if table_name.lower() in ctes:
+            continue
+        schema = await SCHEMA.get(table_name)
+        if not schema.columns:
+            raise PreflightError(f"Unknown table {table_name}.")
+        columns |= {column_name.lower() for column_name in schema.column_names}
+
+    words = {(bracketed or bare) for bracketed, bare in _WORD.findall(code)}
+    unknown = sorted(
+        word
+        for word in words
+        if word.lower() not in columns
+        and word.lower() not in names
+        and word.lower() not in SQL_KEYWORDS
+        and word.lower() not in ctes
+    )
+    if unknown:
+        raise PreflightError(f"Unknown column(s): {', '.join(unknown)}.")
+
+
+def ensure_row_limit(sql_query, max_rows):
+    """Add ``TOP max_rows`` to a plain SELECT that has no TOP of its own.
+
+    Queries paged with ``OFFSET ... FETCH`` are left alone, since SQL Server
+    does not allow TOP next to them.
+    """
+    if _HAS_TOP.match(sql_query) or _OFFSET_FETCH.search(_code_only(sql_query)):
+        return sql_query
+    match = _LEADING_SELECT.match(sql_query)
+    if match is None:
+        # CTEs are left alone; fetch_result still stops at max_rows
+        return sql_query
+    return f"{match.group(0)}TOP {max_rows} {sql_query[match.end():]}"
+
+
+async def preflight(sql_query):
+    """Validate generated SQL and return the text that should be executed."""
+    sql_query = strip_comments(sql_query).rstrip(";").strip()
+    check_statement(sql_query)
+    sql_query = sql_query.replace("CURRENT_DATE", "CAST(GETDATE() AS DATE)")
+    if CONFIG.SQL_CHECK_COLUMNS:
+        await check_columns(sql_query)
+    # One row more than is kept, so a cut-off result is still reported
+    return ensure_row_limit(sql_query, CONFIG.SQL_MAX_ROWS + 1)
+
+
+def estimated_cost(conn, sql_query):
+    """Optimizer cost of ``sql_query`` from its estimated plan; nothing is run."""
+    cursor = conn.cursor()
+    cursor.execute("SET SHOWPLAN_XML ON")
+    try:
+        cursor.execute(sql_query)
+        plan = "".join(str(row[0]) for row in cursor.fetchall())
+    finally:
+        cursor.execute("SET SHOWPLAN_XML OFF")
+        cursor.close()
+    costs = [float(cost) for cost in _PLAN_COST.findall(plan)]
+    return max(costs) if costs else 0.0
+
+
+def database_error_text(error):
+    """The server's message from a pyodbc error, without ODBC driver prefixes."""
+    message = str(error.args[1]) if len(error.args) > 1 else str(error)
+    return _DRIVER_SUFFIX.sub("", _DRIVER_PREFIX.sub("", message)).strip()
+
+
+def check_cost(conn, sql_query, max_cost):
+    cost = estimated_cost(conn, sql_query)
+    if cost > max_cost:
+        raise PreflightError(
+            f"The query is too expensive to run (estimated cost {cost:.0f}, limit {max_cost:.0f})."
+        )
+    return cost
+
+
+@contextmanager
+def query_timeout(conn, seconds):
+    """Apply pyodbc's per-statement timeout on a pooled connection, then restore it."""
+    if not seconds or not hasattr(conn, "timeout"):
+        yield
+        return
+    previous = conn.timeout
+    conn.timeout = seconds
+    try:
+        yield
+    finally:
+        conn.timeout = previous
@@ -0,0 +1,276 @@
+import json
+import re
+from collections import Counter
+
+from config import DefaultConfig
+from router import split_identifier, tokenize
+from tables import TABLE_DESCRIPTIONS, parse_column_descriptions
+
+CONFIG = DefaultConfig()
+
+SQL_GENERATION_RULES = (
+    "Convert the following natural language query into an SQL query considering partial matches and relevant columns. "
+    "Make sure the query should be compatible with Azure SQL Database. Ensure correct data type usage when comparing columns to values. "
+    "Make sure the query should be very precise and accurate, it should not throw any error while executing to the database. "
+    "It should only return the information asked in the NLP query. Do not return any additional information. "
+    "Consider datatypes and column names accurately. Use CalendarDate (available in primary sales) in DD-MM-YYYY format while formatting SQL query. "
+    "Consider CalendarMonthYear is in Month(In words)-YY (e.g., 'Nov-24', 'Aug-21')."
+    "If the NLP query includes 'Jan, Feb, Mar' the SQL query should consider the full month name as 'January, February, and March'."
+    "When the question lists values found in the data, filter on them with = or IN exactly as written; "
+    "use LIKE only for names that are not listed. Use TOP based on the NLP query. "
+    "Focus on columns that are likely targets based on the query's context."
+)
+
+SUMMARY_INSTRUCTIONS = (
+    "Given the following SQL query results, generate a natural language response summarizing the data in a human-readable format. "
+    "Consider the context of the original user's query. Do not include any currency signs in the response."
+)
+SHORT_SUMMARY_INSTRUCTIONS = (
+    "Answer the user's question from these SQL query results in one or two sentences, "
+    "mentioning only the most important figures. Do not include any currency signs."
+)
+
+# max_tokens per pipeline stage; a table name needs a handful of tokens, not 4096
+STAGE_MAX_TOKENS = {
+    "table_selection": CONFIG.MAX_TOKENS_TABLE_SELECTION,
+    "sql_generation": CONFIG.MAX_TOKENS_SQL_GENERATION,
+    "summary": CONFIG.MAX_TOKENS_SUMMARY,
+    "summary_short": CONFIG.MAX_TOKENS_SUMMARY_SHORT,
+}
+
+# Measures, periods and the main name dimensions are needed by most
+# questions, so they are always rendered even when not mentioned.
+_PINNED_COLUMN = re.compile(r"(Value|Unit|Month|Year|Quarter|Date|Name|State)$")
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Token count of ``text``; exact with tiktoken installed, else estimated."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    # Roughly four characters per token for English prose and identifiers
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(messages):
+    # Each chat message carries a few tokens of role/formatting overhead
+    return sum(count_tokens(message["content"]) + 4 for message in messages)
+
+
+def with_values(nlp_query, values, qualified=False):
+    """The question followed by the data values it was resolved to.
+
+    ``values`` maps ``(table, column)`` to exact values; ``qualified`` names
+    the table too, for prompts that still have to choose one. The values go
+    in the user message so the system prompt stays the same across questions.
+    """
+    if not values:
+        return nlp_query
+    lines = []
+    for (table_name, column_name), column_values in values.items():
+        column = f"{table_name}.{column_name}" if qualified else column_name
+        literals = ", ".join("'" + value.replace("'", "''") + "'" for value in column_values)
+        lines.append(f"- {column}: {literals}")
+    return f"{nlp_query}\nValues in this question that exist in the data:\n" + "\n".join(lines)
+
+
+class TablePrompt:
+    """Compact, pre-rendered schema of one table for the prompts."""
+
+    def __init__(self, table_name, description, columns):
+        self.table_name = table_name
+        self.summary = description.split("\n", 1)[0].replace(" It includes:", "")
+        descriptions = parse_column_descriptions(description)
+        # Without loaded metadata fall back to the documented columns
+        columns = columns or [(column_name, "") for column_name in descriptions]
+
+        self.columns = []
+        for column_name, data_type in columns:
+            text = descriptions.get(column_name, "")
+            line = f"{column_name} {data_type}".rstrip() + (f": {text}" if text else "")
+            pinned = bool(_PINNED_COLUMN.search(column_name))
+            self.columns.append((column_name, line, set(tokenize(text)), pinned))
+
+        # Description words found on many columns ("sales", "the", "of") say
+        # nothing about which column a question needs
+        frequency = Counter(word for column in self.columns for word in column[2])
+        common = {
+            word
+            for word, count in frequency.items()
+            if count > max(2, len(self.columns) * 0.2)
+        }
+        self.columns = [
+            (column_name, line, set(split_identifier(column_name)) | (words - common), pinned)
+            for column_name, line, words, pinned in self.columns
+        ]
+        # Rarer keywords weigh more: "cluster" singles out one column,
+        # "customer" matches a dozen
+        self._keyword_weight = Counter(
+            keyword for column in self.columns for keyword in column[2]
+        )
+
+        self.column_names = [column[0] for column in self.columns]
+
+    def relevant_columns(self, nlp_query, min_columns, max_columns):
+        query_tokens = set(tokenize(nlp_query))
+        scored = []
+        for position, (_, line, keywords, pinned) in enumerate(self.columns):
+            score = sum(1 / self._keyword_weight[token] for token in query_tokens & keywords)
+            scored.append((score + (1 if pinned else 0), position, line))
+
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        limit = max(min_columns, sum(1 for item in scored if item[0] > 0))
+        selected = scored[: min(limit, max(max_columns, min_columns))]
+        return [line for _, _, line in sorted(selected, key=lambda item: item[1])]
+
+    def render(self, nlp_query=None, min_columns=None, token_budget=None):
+        if nlp_query and CONFIG.PROMPT_RELEVANT_COLUMNS_ONLY:
+            lines = self.relevant_columns(
+                nlp_query,
+                min_columns or CONFIG.PROMPT_MIN_COLUMNS,
+                CONFIG.PROMPT_MAX_COLUMNS,
+            )
+        else:
+            lines = [column[1] for column in self.columns]
+
+        rendered = self._render(lines)
+        if token_budget and count_tokens(rendered) > token_budget:
+            # Over budget: keep names and types, drop the descriptions
+            rendered = self._render([line.split(":", 1)[0] for line in lines])
+        return rendered
+
+    def _render(self, lines):
+        return (
+            f"Table '{self.table_name}': {self.summary}\n"
+            "Columns (name type: description):\n" + "\n".join(lines)
+        )
+
+
+class PromptBuilder:
+    def __init__(self, descriptions=TABLE_DESCRIPTIONS):
+        self.descriptions = descriptions
+        self._tables = {}
+
+    def table(self, schema):
+        """Rendered table for a ``schema.TableSchema``, rebuilt when it reloads."""
+        cached = self._tables.get(schema.name)
+        if cached is None or cached[0] is not schema:
+            description = self.descriptions.get(
+                schema.name, "No description available for this table."
+            )
+            cached = (schema, TablePrompt(schema.name, description, schema.columns))
+            self._tables[schema.name] = cached
+        return cached[1]
+
+    def table_selection_messages(self, nlp_query, schemas):
+        tables = "\n".join(
+            f"{prompt.table_name}: {prompt.summary} Columns: {', '.join(prompt.column_names)}"
+            for prompt in (self.table(schema) for schema in schemas)
+        )
+        return [
+            {
+                "role": "system",
+                "content": "Given the following table descriptions, select the most appropriate table for the given natural language query. Provide me the table name only in the response.",
+            },
+            {"role": "user", "content": f"Tables:\n{tables}\nNLP Query: {nlp_query}"},
+        ]
+
+    def sql_messages(self, nlp_query, schema, values=None):
+        table = self.table(schema).render(
+            nlp_query, token_budget=CONFIG.PROMPT_SCHEMA_TOKEN_BUDGET
+        )
+        return [
+            {
+                "role": "system",
+                "content": (
+                    f"{table}\n\n{SQL_GENERATION_RULES}\n"
+                    'Respond only with a JSON object of the form {"sql": "<SQL query>"}.'
+                ),
+            },
+            {"role": "user", "content": with_values(nlp_query, values)},
+        ]
+
+    def repair_messages(self, nlp_query, schema, sql_query, error, values=None):
+        """The SQL prompt followed by the failed attempt and what went wrong."""
+        return self.sql_messages(nlp_query, schema, values) + [
+            {"role": "assistant", "content": json.dumps({"sql": sql_query})},
+            {
+                "role": "user",
+                "content": f"That query did not work: {error}\nReturn a corrected query in the same JSON format.",
+            },
+        ]
+
+    def follow_up_messages(self, previous_question, previous_sql, follow_up, schema, refinements=()):
+        """A short prompt that edits the previous SQL instead of writing it afresh.
+
+        ``refinements`` are earlier follow-ups the user saw answered from the
+        rows of ``previous_sql``; the rewrite has to apply them too.
+        """
+        table = self.table(schema).render(
+            f"{previous_question} {follow_up}",
+            token_budget=CONFIG.PROMPT_SCHEMA_TOKEN_BUDGET // 2,
+        )
+        return [
+            {
+                "role": "system",
+                "content": (
+                    f"{table}\n\n"
+                    "Rewrite the previous SQL query so that it answers the follow-up question, "
+                    "keeping everything the follow-up does not change. "
+                    "The query must be valid for Azure SQL Database.\n"
+                    'Respond only with a JSON object of the form {"sql": "<SQL query>"}.'
+                ),
+            },
+            {
+                "role": "user",
+                "content": (
+                    f"Previous question: {previous_question}\nPrevious SQL: {previous_sql}\n"
+                    + (
+                        f"Applied to its results but not yet in the SQL: {'; '.join(refinements)}\n"
+                        if refinements
+                        else ""
+                    )
+                    + f"Follow-up: {follow_up}"
+                ),
+            },
+        ]
+
+    def summary_messages(self, results_json, short=False):
+        return [
+            {
+                "role": "system",
+                "content": SHORT_SUMMARY_INSTRUCTIONS if short else SUMMARY_INSTRUCTIONS,
+            },
+            {"role": "user", "content": results_json},
+        ]
+
+    def combined_messages(self, nlp_query, schemas, values=None):
+        budget = CONFIG.PROMPT_SCHEMA_TOKEN_BUDGET // max(len(schemas), 1)
+        tables = "\n\n".join(
+            self.table(schema).render(nlp_query, token_budget=budget)
+            for schema in schemas
+        )
+        return [
+            {
+                "role": "system",
+                "content": (
+                    f"Given the following tables:\n\n{tables}\n\n"
+                    "Select the single most appropriate table for the natural language query. "
+                    f"{SQL_GENERATION_RULES}\n"
+                    'Respond only with a JSON object of the form {"table": "<table name>", "sql": "<SQL query>"}.'
+                ),
+            },
+            {"role": "user", "content": with_values(nlp_query, values, qualified=True)},
+        ]
+
+
+PROMPTS = PromptBuilder()
@@ -0,0 +1,175 @@
+import csv
+import io
+import json
+from decimal import Decimal
+
+from config import DefaultConfig
+
+CONFIG = DefaultConfig()
+
+# Room for the activity's own fields (ids, addresses, attachment metadata)
+ACTIVITY_OVERHEAD_BYTES = 2048
+
+
+class RenderedResult:
+    """A result laid out for chat: Markdown pages plus what did not fit.
+
+    ``note`` explains any rows left out, and ``csv`` holds the full result
+    when it was small enough to attach.
+    """
+
+    __slots__ = ("pages", "shown_rows", "note", "csv")
+
+    def __init__(self, pages, shown_rows, note=None, csv=None):
+        self.pages = pages
+        self.shown_rows = shown_rows
+        self.note = note
+        self.csv = csv
+
+
+def format_cell(value, max_chars):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, int):
+        return f"{value:,}"
+    if isinstance(value, (float, Decimal)):
+        return f"{value:,.2f}"
+    text = str(value).replace("|", "\\|").replace("\r", " ").replace("\n", " ")
+    if len(text) > max_chars:
+        text = text[: max_chars - 1] + "…"
+    return text
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def format_rows(results, max_rows, max_cell_chars):
+    """Format the first ``max_rows`` rows.
+
+    Returns ``(header, rows, numeric)`` with every cell already a string;
+    numeric columns are those whose non-empty cells are all numbers.
+    """
+    header = [format_cell(column, max_cell_chars) for column in results.columns]
+    numeric = [True] * len(header)
+    rows = []
+    for row in results.rows[:max_rows]:
+        cells = []
+        for index, value in enumerate(row):
+            if value is not None and not _is_number(value):
+                numeric[index] = False
+            cells.append(format_cell(value, max_cell_chars))
+        rows.append(cells)
+    return header, rows, numeric
+
+
+def _line(cells):
+    # Unpadded: chat clients lay the table out, and padding only adds bytes
+    return "| " + " | ".join(cells) + " |"
+
+
+def serialized_size(text):
+    """Bytes ``text`` takes as a JSON string in an activity."""
+    return len(json.dumps(text, ensure_ascii=False).encode("utf-8"))
+
+
+def iter_csv_chunks(results, batch_size=500):
+    """The full result as CSV, encoded in batches rather than one big string."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(results.columns)
+    for start in range(0, len(results.rows), batch_size):
+        writer.writerows(
+            ["" if value is None else value for value in row]
+            for row in results.rows[start : start + batch_size]
+        )
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def build_csv(results, max_bytes):
+    """CSV bytes of the full result, or None once it grows past ``max_bytes``."""
+    chunks, size = [], 0
+    for chunk in iter_csv_chunks(results):
+        size += len(chunk)
+        if size > max_bytes:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def render_results(
+    results,
+    page_rows=None,
+    max_chars=None,
+    max_pages=None,
+    max_cell_chars=None,
+    csv_max_bytes=None,
+    max_activity_bytes=None,
+    trailing_text="",
+):
+    """Lay out ``results`` as Markdown tables that fit in chat activities.
+
+    Rows are split into pages of at most ``page_rows`` rows and
+    ``max_chars`` characters. Only ``max_pages`` pages are rendered; rows
+    beyond them are offered as a CSV attachment when it fits in
+    ``csv_max_bytes`` (``0`` disables the attachment) and, base64-encoded
+    next to the last page and the note, in ``max_activity_bytes``.
+    ``trailing_text`` is anything else sent in that activity, such as the
+    summary.
+    """
+    page_rows = page_rows or CONFIG.STREAM_CHUNK_ROWS
+    max_chars = max_chars or CONFIG.RESPONSE_MAX_CHARS
+    max_pages = max_pages or CONFIG.RESPONSE_MAX_PAGES
+    max_cell_chars = max_cell_chars or CONFIG.RESPONSE_MAX_CELL_CHARS
+    max_activity_bytes = max_activity_bytes or CONFIG.RESPONSE_MAX_ACTIVITY_BYTES
+    if csv_max_bytes is None:
+        csv_max_bytes = CONFIG.RESPONSE_CSV_MAX_BYTES if CONFIG.RESPONSE_CSV_ATTACHMENT else 0
+
+    if not results:
+        return RenderedResult(["No results found."], 0)
+
+    header, rows, numeric = format_rows(results, page_rows * max_pages, max_cell_chars)
+    header_lines = "\n".join(
+        [
+            _line(header),
+            _line(["---:" if is_numeric else "---" for is_numeric in numeric]),
+        ]
+    )
+
+    pages, body, size = [], [], len(header_lines)
+    shown_rows = 0
+    for cells in rows:
+        line = _line(cells)
+        if body and (len(body) >= page_rows or size + 1 + len(line) > max_chars):
+            pages.append("\n".join([header_lines] + body))
+            body, size = [], len(header_lines)
+            if len(pages) >= max_pages:
+                break
+        body.append(line)
+        size += 1 + len(line)
+        shown_rows += 1
+    else:
+        pages.append("\n".join([header_lines] + body))
+
+    note, attachment = None, None
+    if shown_rows < len(results) or results.truncated:
+        total = f"{len(results)}+" if results.truncated else str(len(results))
+        note = f"_Showing the first {shown_rows} of {total} rows._"
+        if csv_max_bytes:
+            # The CSV goes base64-encoded (4 bytes per 3) into the activity
+            # that also carries the last page, the note and the trailing text
+            note_suffix = f" _The attached CSV has the first {len(results)} rows._"
+            text_bytes = serialized_size(f"{pages[-1]}\n\n{note}{note_suffix}{trailing_text}")
+            room = max_activity_bytes - ACTIVITY_OVERHEAD_BYTES - text_bytes - len("data:text/csv;base64,")
+            limit = min(csv_max_bytes, max(0, room) // 4 * 3)
+            attachment = build_csv(results, limit) if limit else None
+        if attachment is not None:
+            kept = "the first " if results.truncated else "all "
+            note += f" _The attached CSV has {kept}{len(results)} rows._"
+    return RenderedResult(pages, shown_rows, note, attachment)
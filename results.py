@@ -0,0 +1,75 @@
+from decimal import Decimal
+
+
+class QueryResult:
+    """Rows of a query kept as tuples, with the column names stored once."""
+
+    __slots__ = ("columns", "rows", "truncated")
+
+    def __init__(self, columns, rows, truncated=False):
+        self.columns = list(columns)
+        self.rows = rows
+        self.truncated = truncated
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __bool__(self):
+        return bool(self.rows)
+
+    def as_dicts(self, limit=None):
+        rows = self.rows if limit is None else self.rows[:limit]
+        return [dict(zip(self.columns, row)) for row in rows]
+
+
+def fetch_result(cursor, max_rows=5000, batch_size=500):
+    """Read at most ``max_rows`` rows from an executed cursor in batches."""
+    columns = [column[0] for column in cursor.description]
+    rows = []
+    while len(rows) < max_rows:
+        batch = cursor.fetchmany(min(batch_size, max_rows - len(rows)))
+        if not batch:
+            break
+        rows.extend(tuple(row) for row in batch)
+
+    truncated = len(rows) >= max_rows and cursor.fetchone() is not None
+    # Closing the cursor discards whatever the server has not sent yet
+    cursor.close()
+    return QueryResult(columns, rows, truncated)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def compute_aggregates(result):
+    """Count, sum, min and max of every numeric column."""
+    aggregates = {}
+    for index, column in enumerate(result.columns):
+        values = [row[index] for row in result.rows if row[index] is not None]
+        if not values or not all(_is_number(value) for value in values):
+            continue
+        aggregates[column] = {
+            "count": len(values),
+            "sum": sum(values),
+            "min": min(values),
+            "max": max(values),
+        }
+    return aggregates
+
+
+def summarize_for_prompt(result, sample_rows=50):
+    """What the summarization prompt gets to see of a result.
+
+    Small results are passed through as rows; larger ones are reduced to a
+    sample plus per-column aggregates so the prompt size stays bounded.
+    """
+    if len(result) <= sample_rows and not result.truncated:
+        return result.as_dicts()
+
+    return {
+        "row_count": len(result),
+        "truncated": result.truncated,
+        "sample": result.as_dicts(sample_rows),
+        "aggregates": compute_aggregates(result),
+    }
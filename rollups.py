@@ -0,0 +1,449 @@
+import asyncio
+import os
+import re
+import sys
+import time
+
+from cache import make_cache
+from config import DefaultConfig
+from db import run_with_connection
+from metrics import log_event, stage
+from schema import SCHEMA
+
+CONFIG = DefaultConfig()
+
+# Additive measures per fact table; each becomes a ``<measure>_sum`` column.
+# UVG columns are percentages and cannot be re-aggregated from sums.
+MEASURES = {
+    "primary_sales": ("PrimarySalesReportingValue", "PrimarySalesReportingUnit"),
+    "secondary_sales": ("SecondarySalesReportingValue", "SecondarySalesReportingUnit"),
+}
+
+SUM_SUFFIX = "_sum"
+ROW_COUNT = "row_count"
+# Row counts and refresh times published by the refreshing worker
+STATE_TABLE = "rollup_state"
+# sp_getapplock resource held while a worker refreshes
+REFRESH_LOCK = "rollup_refresh"
+
+_NUMERIC_TYPES = {"int", "bigint", "smallint", "tinyint"}
+_DECIMAL_TYPES = {"decimal", "numeric", "float", "real", "money"}
+
+
+class Rollup:
+    """A materialized ``GROUP BY dimensions`` of one fact table.
+
+    ``partition`` names a column whose latest values are recomputed on each
+    refresh; rollups without one are rebuilt in full.
+    """
+
+    def __init__(self, name, source, dimensions, partition=None):
+        self.name = name
+        self.source = source
+        self.dimensions = tuple(dimensions)
+        self.measures = MEASURES[source]
+        self.partition = partition
+        self.row_count = None
+        self.refreshed_at = None
+        self.columns = {
+            column.lower()
+            for column in self.dimensions
+            + tuple(measure + SUM_SUFFIX for measure in self.measures)
+            + (ROW_COUNT,)
+        }
+
+    @property
+    def ready(self):
+        return self.refreshed_at is not None
+
+    def create_sql(self, column_types):
+        definitions = [
+            f"{dimension} {_column_type(column_types.get(dimension))}"
+            for dimension in self.dimensions
+        ]
+        definitions += [f"{measure}{SUM_SUFFIX} DECIMAL(38, 4)" for measure in self.measures]
+        definitions.append(f"{ROW_COUNT} BIGINT")
+        return f"CREATE TABLE {self.name} ({', '.join(definitions)})"
+
+    def insert_sql(self, where=""):
+        dimensions = ", ".join(self.dimensions)
+        target_columns = ", ".join(
+            self.dimensions
+            + tuple(measure + SUM_SUFFIX for measure in self.measures)
+            + (ROW_COUNT,)
+        )
+        sums = ", ".join(f"SUM({measure})" for measure in self.measures)
+        return (
+            f"INSERT INTO {self.name} ({target_columns}) "
+            f"SELECT {dimensions}, {sums}, COUNT(*) FROM {self.source}{where} "
+            f"GROUP BY {dimensions}"
+        )
+
+
+def _column_type(data_type):
+    data_type = (data_type or "").lower()
+    if data_type in _NUMERIC_TYPES:
+        return data_type.upper()
+    if data_type in _DECIMAL_TYPES:
+        return "DECIMAL(38, 4)"
+    if data_type == "date":
+        return "DATE"
+    return "NVARCHAR(400)"
+
+
+ROLLUP_DEFINITIONS = (
+    Rollup(
+        "rollup_primary_division_month",
+        "primary_sales",
+        ("DivisionName", "CalendarMonthYear", "PostingMonth", "FiscalYearQuarter", "FiscalYear"),
+        partition="FiscalYear",
+    ),
+    Rollup(
+        "rollup_primary_zone_quarter",
+        "primary_sales",
+        ("CustomerZoneName", "CustomerState", "FiscalYearQuarter", "FiscalYear"),
+        partition="FiscalYear",
+    ),
+    Rollup(
+        "rollup_secondary_cluster_month",
+        "secondary_sales",
+        ("DealerCluster", "InvoiceMonth"),
+    ),
+)
+
+# Words that may appear in a rewritable query besides rollup columns and aliases
+_SQL_WORDS = {
+    "select",
+    "top",
+    "distinct",
+    "percent",
+    "from",
+    "where",
+    "group",
+    "by",
+    "order",
+    "asc",
+    "desc",
+    "and",
+    "or",
+    "not",
+    "in",
+    "like",
+    "is",
+    "null",
+    "as",
+    "between",
+    "having",
+    "sum",
+    "min",
+    "max",
+    "cast",
+    "convert",
+    "round",
+    "abs",
+    "upper",
+    "lower",
+    "ltrim",
+    "rtrim",
+    "trim",
+    "case",
+    "when",
+    "then",
+    "else",
+    "end",
+    "coalesce",
+    "isnull",
+    "nullif",
+    "decimal",
+    "numeric",
+    "float",
+    "int",
+    "bigint",
+    "nvarchar",
+    "varchar",
+    "dbo",
+}
+
+_STRING_LITERAL = re.compile(r"N?'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IDENTIFIER = re.compile(r"\[([^\]]+)\]|([A-Za-z_]\w*)")
+_SELECT = re.compile(r"\bSELECT\b", re.IGNORECASE)
+_FROM = re.compile(
+    r"\bFROM\s+(?:\[?dbo\]?\.)?\[?(\w+)\]?"
+    r"(?:\s+(?:AS\s+)?(?!(?:WHERE|GROUP|ORDER|HAVING)\b)(\w+))?",
+    re.IGNORECASE,
+)
+_ALIAS = re.compile(r"\bAS\s+\[?(\w+)\]?", re.IGNORECASE)
+_SUM = re.compile(r"\bSUM\s*\(\s*(?:\w+\.)?\[?(\w+)\]?\s*\)", re.IGNORECASE)
+_COUNT_ALL = re.compile(r"\bCOUNT\s*\(\s*(?:\*|1)\s*\)", re.IGNORECASE)
+_UNSUPPORTED = re.compile(r"\b(JOIN|UNION|INTERSECT|EXCEPT|OVER|INTO|APPLY)\b", re.IGNORECASE)
+# Rollups hold one row per group, so plain row listings cannot use them
+_AGGREGATING = re.compile(r"\b(GROUP\s+BY|DISTINCT|SUM|COUNT|MIN|MAX)\b", re.IGNORECASE)
+
+
+class RollupRegistry:
+    """Keeps rollup tables fresh and points eligible queries at them."""
+
+    def __init__(self, rollups, refresh_periods=1, store=None):
+        self.rollups = tuple(rollups)
+        self.refresh_periods = refresh_periods
+        self.store = store
+        self._lock = None
+
+    def rewrite(self, sql_query):
+        """Return ``(sql, rollup name or None)``.
+
+        A query qualifies when it reads a single fact table, aggregates
+        measures only with SUM or COUNT(*), and every other column it names
+        is a dimension of a refreshed rollup. The smallest such rollup wins.
+        """
+        text = _STRING_LITERAL.sub("''", sql_query)
+        if len(_SELECT.findall(text)) != 1 or _UNSUPPORTED.search(text):
+            return sql_query, None
+        if not _AGGREGATING.search(text):
+            return sql_query, None
+        froms = list(_FROM.finditer(text))
+        if len(froms) != 1:
+            return sql_query, None
+        source = froms[0].group(1).lower()
+        candidates = [
+            rollup for rollup in self.rollups if rollup.source == source and rollup.ready
+        ]
+        if not candidates:
+            return sql_query, None
+
+        measures = {measure.lower() for measure in candidates[0].measures}
+        rewritten = _SUM.sub(
+            lambda match: f"SUM({match.group(1)}{SUM_SUFFIX})"
+            if match.group(1).lower() in measures
+            else match.group(0),
+            sql_query,
+        )
+        rewritten = _COUNT_ALL.sub(f"SUM({ROW_COUNT})", rewritten)
+
+        text = _NUMBER.sub(" ", _STRING_LITERAL.sub("''", rewritten))
+        from_match = _FROM.search(text)
+        allowed = _SQL_WORDS | {source} | {alias.lower() for alias in _ALIAS.findall(text)}
+        if from_match.group(2):
+            allowed.add(from_match.group(2).lower())
+        identifiers = {
+            (bracketed or bare).lower() for bracketed, bare in _IDENTIFIER.findall(text)
+        }
+
+        for rollup in sorted(candidates, key=lambda rollup: rollup.row_count or 0):
+            if identifiers <= allowed | rollup.columns:
+                from_match = _FROM.search(rewritten)
+                rewritten = (
+                    rewritten[: from_match.start(1)] + rollup.name + rewritten[from_match.end(1) :]
+                )
+                return rewritten, rollup.name
+        return sql_query, None
+
+    def refresh_rollup(self, conn, rollup, column_types):
+        """Blocking refresh of one rollup; call from the DB executor."""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT COUNT(*) FROM {rollup.name} WHERE 1 = 0")
+            cursor.fetchall()
+            exists = True
+        except Exception:
+            # The rollup table has not been created yet
+            conn.rollback()
+            exists = False
+        if not exists:
+            cursor.execute(rollup.create_sql(column_types))
+
+        where, params = "", []
+        if exists and rollup.partition:
+            # Only the latest periods still receive new rows
+            cursor.execute(
+                f"SELECT DISTINCT TOP {self.refresh_periods} {rollup.partition} "
+                f"FROM {rollup.source} ORDER BY {rollup.partition} DESC"
+            )
+            params = [row[0] for row in cursor.fetchall()]
+            if params:
+                where = f" WHERE {rollup.partition} IN ({', '.join('?' for _ in params)})"
+
+        try:
+            cursor.execute(f"DELETE FROM {rollup.name}{where}", *params)
+            cursor.execute(rollup.insert_sql(where), *params)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        cursor.execute(f"SELECT COUNT(*) FROM {rollup.name}")
+        rollup.row_count = cursor.fetchone()[0]
+        rollup.refreshed_at = time.time()
+        cursor.close()
+        return "incremental" if where else "full"
+
+    def claim(self, conn):
+        """Take the database-wide refresh lock for this session; False if another worker has it."""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SET NOCOUNT ON; DECLARE @result INT; "
+                "EXEC @result = sp_getapplock @Resource = ?, @LockMode = 'Exclusive', "
+                "@LockOwner = 'Session', @LockTimeout = 0; SELECT @result",
+                REFRESH_LOCK,
+            )
+            return cursor.fetchone()[0] >= 0
+        finally:
+            cursor.close()
+
+    def unclaim(self, conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("EXEC sp_releaseapplock @Resource = ?, @LockOwner = 'Session'", REFRESH_LOCK)
+        finally:
+            cursor.close()
+
+    def read_state(self, conn):
+        """``{rollup name: (row_count, refreshed_at)}`` as last published to the database."""
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT name, row_count, refreshed_at FROM {STATE_TABLE}")
+            return {name: (row_count, refreshed_at) for name, row_count, refreshed_at in cursor.fetchall()}
+        except Exception:
+            # No worker has refreshed yet
+            conn.rollback()
+            return {}
+        finally:
+            cursor.close()
+
+    def write_state(self, conn, rollup):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"DELETE FROM {STATE_TABLE} WHERE name = ?", rollup.name)
+            cursor.execute(
+                f"INSERT INTO {STATE_TABLE} (name, row_count, refreshed_at) VALUES (?, ?, ?)",
+                rollup.name,
+                rollup.row_count,
+                rollup.refreshed_at,
+            )
+            conn.commit()
+        finally:
+            cursor.close()
+
+    def refresh_elected(self, conn, column_types, max_age):
+        """Blocking refresh by the one worker holding the refresh lock; call from the DB executor.
+
+        Returns ``[(rollup, mode, ms)]``, empty when another worker refreshed
+        within ``max_age`` seconds, or None when another worker is refreshing.
+        """
+        if not self.claim(conn):
+            return None
+        try:
+            state = self.read_state(conn)
+            if not state:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(
+                        f"IF OBJECT_ID('{STATE_TABLE}') IS NULL CREATE TABLE {STATE_TABLE} "
+                        "(name NVARCHAR(128) PRIMARY KEY, row_count BIGINT, refreshed_at FLOAT)"
+                    )
+                    conn.commit()
+                finally:
+                    cursor.close()
+            if all(
+                rollup.name in state and time.time() - state[rollup.name][1] < max_age
+                for rollup in self.rollups
+            ):
+                self.load_state(state)
+                return []
+            refreshed = []
+            for rollup in self.rollups:
+                started = time.perf_counter()
+                mode = self.refresh_rollup(conn, rollup, column_types[rollup.name])
+                self.write_state(conn, rollup)
+                refreshed.append((rollup, mode, round((time.perf_counter() - started) * 1000, 1)))
+            return refreshed
+        finally:
+            self.unclaim(conn)
+
+    async def refresh(self, max_age=None):
+        """Refresh every rollup; returns False when another worker holds the refresh.
+
+        With ``max_age`` the workers elect a refresher through a database
+        lock, and rollups another worker refreshed more recently are only
+        re-read.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if max_age is not None:
+                column_types = {
+                    rollup.name: dict((await SCHEMA.get(rollup.source)).columns) for rollup in self.rollups
+                }
+                with stage("rollup_refresh"):
+                    refreshed = await run_with_connection(
+                        lambda conn: self.refresh_elected(conn, column_types, max_age)
+                    )
+                if refreshed is None:
+                    return False
+                for rollup, mode, ms in refreshed:
+                    log_event("rollup_refreshed", rollup=rollup.name, mode=mode, rows=rollup.row_count, ms=ms)
+                return True
+            for rollup in self.rollups:
+                source_schema = await SCHEMA.get(rollup.source)
+                column_types = dict(source_schema.columns)
+                started = time.perf_counter()
+                with stage("rollup_refresh"):
+                    mode = await run_with_connection(
+                        lambda conn: self.refresh_rollup(conn, rollup, column_types)
+                    )
+                log_event(
+                    "rollup_refreshed",
+                    rollup=rollup.name,
+                    mode=mode,
+                    rows=rollup.row_count,
+                    ms=round((time.perf_counter() - started) * 1000, 1),
+                )
+            return True
+
+    def state(self):
+        return {rollup.name: (rollup.row_count, rollup.refreshed_at) for rollup in self.rollups}
+
+    def load_state(self, state):
+        for rollup in self.rollups:
+            if rollup.name in state:
+                rollup.row_count, rollup.refreshed_at = state[rollup.name]
+
+    async def run_scheduled(self, interval):
+        """Refresh every rollup now and then every ``interval`` seconds.
+
+        Only one worker refreshes each round: the one that claims it in the
+        shared store or, without one, the one holding the database lock. The
+        others pick up the row counts it publishes.
+        """
+        while True:
+            delay = interval
+            try:
+                if self.store is not None:
+                    if self.store.add("refresh", os.getpid(), ttl=interval * 0.9):
+                        await self.refresh()
+                        self.store.set("state", self.state(), ttl=interval * 2)
+                        state = None
+                    else:
+                        state = self.store.get("state", {})
+                elif await self.refresh(max_age=interval * 0.9):
+                    state = None
+                else:
+                    state = await run_with_connection(self.read_state)
+                if state is not None:
+                    if state:
+                        self.load_state(state)
+                    else:
+                        # The refreshing worker has not finished its first refresh yet
+                        delay = min(interval, 60)
+            except Exception as error:
+                print(f"Rollup refresh failed: {error}", file=sys.stderr)
+            await asyncio.sleep(delay)
+
+
+ROLLUPS = RollupRegistry(
+    ROLLUP_DEFINITIONS,
+    refresh_periods=CONFIG.ROLLUP_REFRESH_PERIODS,
+    store=make_cache("rollups", 2, CONFIG.ROLLUP_REFRESH_INTERVAL) if CONFIG.CACHE_BACKEND != "memory" else None,
+)
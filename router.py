@@ -0,0 +1,148 @@
+import re
+from collections import defaultdict
+
+from config import DefaultConfig
+from tables import TABLE_DESCRIPTIONS, parse_column_descriptions
+
+CONFIG = DefaultConfig()
+
+# Domain words users say that the column names alone don't carry.
+KEYWORD_HINTS = {
+    "primary_sales": {
+        "primary": 3.0,
+        "division": 1.0,
+        "posting": 1.0,
+        "fiscal": 1.0,
+        "fy": 1.0,
+        "quarter": 1.0,
+        "q1": 1.0,
+        "q2": 1.0,
+        "q3": 1.0,
+        "q4": 1.0,
+        "zone": 1.0,
+        "nsm": 1.0,
+        "town": 1.0,
+        "state": 1.0,
+        "product": 1.0,
+        "category": 1.0,
+        "fsn": 1.0,
+    },
+    "secondary_sales": {
+        "secondary": 3.0,
+        "dealer": 1.0,
+        "tsi": 1.0,
+        "invoice": 1.0,
+        "salesman": 1.0,
+        "cluster": 1.0,
+        "territory": 1.0,
+        "adopted": 1.0,
+        "disconnected": 1.0,
+    },
+}
+
+# Column-name parts too generic to say anything about the table.
+GENERIC_TOKENS = {"code", "key", "count", "type", "flag", "description", "value", "unit"}
+
+_IDENTIFIER_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z]|\d|$)|[A-Z]?[a-z]+|\d+")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _stem(token):
+    if len(token) > 3 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def split_identifier(name):
+    """``DealerTSITerritoryCode`` -> ``["dealer", "tsi", "territory", "code"]``"""
+    return [_stem(part.lower()) for part in _IDENTIFIER_PART.findall(name)]
+
+
+def tokenize(text):
+    return [_stem(token) for token in _WORD.findall(text.lower())]
+
+
+class RouteDecision:
+    def __init__(self, table_name, confidence, scores, path="rules"):
+        self.table_name = table_name
+        self.confidence = confidence
+        self.scores = scores
+        self.path = path
+
+    def __repr__(self):
+        return (
+            f"RouteDecision(table_name={self.table_name!r}, path={self.path!r}, "
+            f"confidence={self.confidence:.2f}, scores={self.scores})"
+        )
+
+
+class TableRouter:
+    """Scores a question against an inverted index of table keywords.
+
+    Tokens from column names that appear in only one table point at that
+    table; tokens shared by every table (``customer``, ``sales``...) carry no
+    signal and are left out of the index.
+    """
+
+    def __init__(self, table_columns, hints=None, min_score=1.0, min_confidence=0.6):
+        self.tables = tuple(table_columns)
+        self.min_score = min_score
+        self.min_confidence = min_confidence
+        self.index = defaultdict(dict)
+
+        tables_by_token = defaultdict(set)
+        for table_name, columns in table_columns.items():
+            for column in columns:
+                for token in split_identifier(column):
+                    tables_by_token[token].add(table_name)
+
+        for token, table_names in tables_by_token.items():
+            if token in GENERIC_TOKENS or token.isdigit():
+                continue
+            if len(table_names) == 1:
+                self.index[token][next(iter(table_names))] = 1.0
+
+        for table_name, keywords in (hints or {}).items():
+            for keyword, weight in keywords.items():
+                self.index[_stem(keyword)][table_name] = weight
+
+    def score(self, text):
+        scores = dict.fromkeys(self.tables, 0.0)
+        # Each distinct token counts once so repeated words don't dominate
+        for token in set(tokenize(text)):
+            for table_name, weight in self.index.get(token, {}).items():
+                scores[table_name] += weight
+        return scores
+
+    def route(self, text):
+        scores = self.score(text)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        best_table, best = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        confidence = (best - runner_up) / best if best > 0 else 0.0
+
+        if best >= self.min_score and confidence >= self.min_confidence:
+            return RouteDecision(best_table, confidence, scores)
+        return RouteDecision(None, confidence, scores, path="llm")
+
+
+def match_table_name(content, table_names=TABLE_DESCRIPTIONS):
+    """Find a known table name in a free-text LLM reply."""
+    lowered = content.lower()
+    for table_name in table_names:
+        if table_name in lowered or table_name.replace("_", "") in lowered:
+            return table_name
+    return None
+
+
+ROUTER = TableRouter(
+    {
+        table_name: parse_column_descriptions(description)
+        for table_name, description in TABLE_DESCRIPTIONS.items()
+    },
+    hints=KEYWORD_HINTS,
+    min_score=CONFIG.ROUTER_MIN_SCORE,
+    min_confidence=CONFIG.ROUTER_MIN_CONFIDENCE,
+)
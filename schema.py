@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+from cache import make_cache
+from config import DefaultConfig
+from db import run_with_connection
+
+CONFIG = DefaultConfig()
+
+
+def fetch_column_info(conn, table_names):
+    placeholders = ", ".join("?" for _ in table_names)
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS "
+        f"WHERE TABLE_NAME IN ({placeholders}) ORDER BY TABLE_NAME, ORDINAL_POSITION",
+        list(table_names),
+    )
+    columns = {table_name: [] for table_name in table_names}
+    for table_name, column_name, data_type in cursor.fetchall():
+        columns.setdefault(table_name, []).append((column_name, data_type))
+    cursor.close()
+    return columns
+
+
+class TableSchema:
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = tuple(columns)
+
+    @property
+    def column_names(self):
+        return [column_name for column_name, _ in self.columns]
+
+
+class SchemaRegistry:
+    """In-memory column/type metadata for the tables the bot can query.
+
+    All known tables are loaded with a single INFORMATION_SCHEMA query and
+    served from memory until the TTL expires or ``invalidate`` is called.
+    With a shared ``store`` the loaded metadata is reused by other workers.
+    """
+
+    def __init__(self, tables, ttl=3600.0, store=None):
+        self.tables = tuple(tables)
+        self.ttl = ttl
+        self.store = store
+        self._schemas = {}
+        self._loaded_at = None
+        self._lock = None
+
+    def is_stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def invalidate(self):
+        self._loaded_at = None
+        if self.store is not None:
+            self.store.delete("columns")
+
+    def install(self, columns):
+        self._schemas = {
+            table_name: TableSchema(table_name, table_columns)
+            for table_name, table_columns in columns.items()
+        }
+        self._loaded_at = time.monotonic()
+        return self._schemas
+
+    def load(self, conn):
+        """Blocking load of every known table; call from the DB executor."""
+        columns = fetch_column_info(conn, self.tables)
+        if self.store is not None:
+            self.store.set("columns", columns)
+        return self.install(columns)
+
+    async def refresh(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Another turn may have refreshed while we waited for the lock
+            if self.is_stale():
+                columns = self.store.get("columns") if self.store is not None else None
+                if columns is not None:
+                    self.install(columns)
+                else:
+                    await run_with_connection(self.load)
+        return self._schemas
+
+    async def get(self, table_name):
+        if self.is_stale():
+            await self.refresh()
+
+        schema = self._schemas.get(table_name)
+        if schema is None:
+            # Tables outside the known set are looked up once and cached
+            columns = await run_with_connection(
+                lambda conn: fetch_column_info(conn, [table_name])
+            )
+            schema = TableSchema(table_name, columns.get(table_name, []))
+            self._schemas[table_name] = schema
+        return schema
+
+    def cached(self):
+        return dict(self._schemas)
+
+
+SCHEMA = SchemaRegistry(
+    CONFIG.SCHEMA_TABLES,
+    ttl=CONFIG.SCHEMA_CACHE_TTL,
+    store=make_cache("schema", 1, CONFIG.SCHEMA_CACHE_TTL) if CONFIG.CACHE_BACKEND != "memory" else None,
+)
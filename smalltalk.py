@@ -0,0 +1,84 @@
+import re
+
+# Whole-message phrases per intent; matched on normalized tokens
+PHRASES = {
+    "greeting": (
+        "hi", "hii", "hello", "hey", "hee", "hola", "howdy", "greetings", "hi there",
+        "good morning", "good afternoon", "good evening", "sup", "yo", "what's up",
+        "morning", "afternoon", "evening", "salutations", "bonjour", "namaste",
+        "what's good", "how's it going", "hiya", "ahoy", "aloha", "shalom", "ciao",
+        "hey there", "hello there", "peace", "wassup", "how are you",
+        "how are you doing", "how do you do", "hey ya", "hey you", "hi everyone", "hi all",
+    ),
+    "thanks": (
+        "thanks", "thank you", "thank u", "thanks a lot", "thank you so much",
+        "thanks so much", "many thanks", "thx", "ty", "cheers", "much appreciated",
+        "appreciate it", "great thanks", "ok thanks", "okay thanks", "perfect thanks",
+    ),
+    "help": (
+        "help", "help me", "what can you do", "what can i ask", "what can i ask you",
+        "how does this work", "how do i use this", "how do i use you", "what do you do",
+        "who are you", "what are you", "commands", "menu", "options",
+    ),
+    "goodbye": (
+        "bye", "goodbye", "good bye", "bye bye", "see you", "see ya", "see you later",
+        "cya", "later", "good night", "take care", "that's all", "that is all",
+        "i'm done", "im done",
+    ),
+}
+
+REPLIES = {
+    "greeting": "Hello, how can I assist you!",
+    "thanks": "You're welcome! Ask me anything else about primary or secondary sales.",
+    "help": (
+        "Ask me questions about primary or secondary sales in plain English, for example:\n"
+        "- total primary sales for Adhesives in Nov-24\n"
+        "- top 5 customers by primary sales in Maharashtra\n"
+        "- top 10 dealers by secondary sales\n\n"
+        "You can then refine an answer, e.g. \"now only for Gujarat\" or \"break that down by month\"."
+    ),
+    "goodbye": "Goodbye! Come back any time you need sales figures.",
+}
+
+# Words that may trail any phrase without changing its intent ("hi bot", "thanks again")
+_TRAILING = {"bot", "there", "again", "everyone", "all", "buddy", "friend", "team", "please", "guys"}
+
+_TOKEN = re.compile(r"[a-z]+")
+_REPEATS = re.compile(r"([a-z])\1{2,}")
+_END = object()
+
+
+def normalize(text):
+    """Lowercased word tokens with apostrophes dropped and stretched letters squeezed."""
+    text = _REPEATS.sub(r"\1", text.lower().replace("'", "").replace("’", ""))
+    return _TOKEN.findall(text)
+
+
+def _build_trie(phrases):
+    root = {}
+    for intent, texts in phrases.items():
+        for text in texts:
+            node = root
+            for token in normalize(text):
+                node = node.setdefault(token, {})
+            node[_END] = intent
+    return root
+
+
+_TRIE = _build_trie(PHRASES)
+
+
+def classify(text):
+    """The small-talk intent of a whole message, or None for anything else."""
+    tokens = normalize(text or "")
+    if not tokens or len(tokens) > 8:
+        return None
+    node = _TRIE
+    intent = None
+    for position, token in enumerate(tokens):
+        node = node.get(token)
+        if node is None:
+            break
+        if _END in node and all(rest in _TRAILING for rest in tokens[position + 1 :]):
+            intent = node[_END]
+    return intent
@@ -0,0 +1,73 @@
+import re
+from decimal import Decimal
+
+from config import DefaultConfig
+
+CONFIG = DefaultConfig()
+
+# Fixed replies that never needed the model to rephrase them
+NO_RESULTS_TEXT = "I couldn't find any data matching that question. Try a wider period or fewer filters."
+NOT_UNDERSTOOD_TEXT = "I'm not sure I understand. Can you give more details or rephrase?"
+LLM_UNAVAILABLE_TEXT = "I can't reach the language service right now. Please try again in a minute."
+
+_IDENTIFIER_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z]|\d|$)|[A-Z]?[a-z]+|\d+")
+
+
+def format_number(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return f"{value:,}"
+    if isinstance(value, (float, Decimal)):
+        return f"{value:,.2f}"
+    return str(value)
+
+
+def readable_column(name):
+    """``PrimarySalesReportingValue`` -> ``Primary sales reporting value``"""
+    words = _IDENTIFIER_PART.findall(name or "")
+    if not words:
+        return "Result"
+    return " ".join(word if word.isupper() and len(word) > 1 else word.lower() for word in words).capitalize()
+
+
+def _is_text(value):
+    return isinstance(value, str)
+
+
+def summary_mode(results):
+    """How much summarizing a result needs.
+
+    ``local``: a scalar or a few narrow rows, phrased without the model.
+    ``short``: a medium result, summarized with a small prompt and output cap.
+    ``full``: everything else.
+    """
+    if len(results) <= CONFIG.SUMMARY_LOCAL_MAX_ROWS and len(results.columns) <= 4:
+        return "local"
+    if len(results) <= CONFIG.SUMMARY_SHORT_MAX_ROWS and not results.truncated:
+        return "short"
+    return "full"
+
+
+def is_scalar(results):
+    return len(results) == 1 and len(results.columns) == 1
+
+
+def phrase_results(results):
+    """Deterministic sentence(s) for a scalar or tiny result."""
+    if is_scalar(results):
+        return f"{readable_column(results.columns[0])}: {format_number(results.rows[0][0])}."
+
+    sentences = []
+    for row in results.rows:
+        labels = [value for value in row if _is_text(value)]
+        figures = [
+            f"{readable_column(column).lower()} {format_number(value)}"
+            for column, value in zip(results.columns, row)
+            if not _is_text(value) and value is not None
+        ]
+        if labels and figures:
+            sentences.append(f"{' / '.join(labels)}: {', '.join(figures)}.")
+        elif labels:
+            sentences.append(f"{' / '.join(labels)}.")
+        else:
+            sentences.append(f"{', '.join(figures).capitalize()}.")
+    return " ".join(sentences)
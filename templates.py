@@ -0,0 +1,219 @@
+import re
+
+from config import DefaultConfig
+from dimensions import DIMENSIONS
+from summaries import format_number
+
+CONFIG = DefaultConfig()
+
+MEASURES = {
+    "primary_sales": {
+        "value": "PrimarySalesReportingValue",
+        "units": "PrimarySalesReportingUnit",
+    },
+    "secondary_sales": {
+        "value": "SecondarySalesReportingValue",
+        "units": "SecondarySalesReportingUnit",
+    },
+}
+
+# Things a question can ask to list or rank -> the column naming them per table
+ENTITIES = {
+    "customer": {"primary_sales": "CustomerName"},
+    "dealer": {"secondary_sales": "DealerName"},
+    "division": {"primary_sales": "DivisionName"},
+    "state": {"primary_sales": "CustomerState"},
+    "zone": {"primary_sales": "CustomerZoneName"},
+    "product": {"primary_sales": "ProductName"},
+    "category": {"primary_sales": "ProductCategory"},
+    "subcategory": {"primary_sales": "ProductSubcategory"},
+    "town": {"primary_sales": "CustomerTown"},
+    "cluster": {"secondary_sales": "DealerCluster"},
+}
+_PLURALS = {"category": "categories", "subcategory": "subcategories"}
+
+_PLACEHOLDER = "{}"
+_ENTITY = "|".join(
+    sorted(
+        {word for entity in ENTITIES for word in (entity, _PLURALS.get(entity, entity + "s"))},
+        key=len,
+        reverse=True,
+    )
+)
+# Words that may name the column next to a value: "in cluster Cluster 2", "for Adhesives division"
+_NOUN = r"(?:division|zone|state|cluster|category|subcategory|month|class|group|status|sales group)"
+_FILTER = (
+    r"(?:\s*,?\s*(?:for|in|of|from|during|and|with|across)\s+(?:the\s+)?"
+    rf"(?:{_NOUN}\s+)?\{{\}}(?:\s+{_NOUN})?)"
+)
+_MEASURE = r"(?:(?P<table>primary|secondary)\s+)?(?P<measure>sales value|sales units|sales|value|units)"
+
+_TOTAL = re.compile(
+    r"^(?:what(?: is|'s| was| were| are)? |show(?: me)? |give me |get |tell me )?(?:the )?"
+    r"(?:total |overall )?(?P<table>primary|secondary) sales(?: (?P<measure>value|units))?"
+    rf"(?P<filters>{_FILTER}*)$"
+)
+_LIST = re.compile(
+    r"^(?:list|show(?: me)?|which|what are|who are|give me)(?: all)?(?: the)? "
+    rf"(?P<entity>{_ENTITY})(?: are(?: there)?)?(?P<filters>{_FILTER}+)$"
+)
+_TOP = re.compile(
+    r"^(?:show(?: me)? |list |what are |who are |which are |give me )?(?:the )?"
+    rf"top(?: (?P<count>\d+))? (?P<entity>{_ENTITY})(?P<before>{_FILTER}*)"
+    rf" by {_MEASURE}(?P<after>{_FILTER}*)$"
+)
+
+
+class TemplateMatch:
+    """A question recognised as one of the fixed shapes, with its SQL filled in."""
+
+    __slots__ = ("template", "table_name", "sql_query", "entity", "measure", "filters")
+
+    def __init__(self, template, table_name, sql_query, entity=None, measure=None, filters=()):
+        self.template = template
+        self.table_name = table_name
+        self.sql_query = sql_query
+        self.entity = entity
+        self.measure = measure
+        self.filters = filters
+
+    def phrase(self, results):
+        """Local text answer for ``results``: no summarization call needed."""
+        scope = describe_filters(self.filters)
+        if self.template == "total":
+            total = results.rows[0][0] if results else None
+            sales = f"{self.table_name.split('_')[0]} sales {self.measure}"
+            if total is None:
+                return f"No {sales} were recorded{scope}."
+            return f"Total {sales}{scope}: {format_number(total)}."
+
+        noun = _PLURALS.get(self.entity, self.entity + "s")
+        if not results:
+            return f"No {noun} were found{scope}."
+        if self.template == "list":
+            return f"{len(results)} {noun if len(results) != 1 else self.entity}{scope}."
+        leader, value = results.rows[0][0], results.rows[0][1]
+        return (
+            f"Top {len(results)} {noun} by {self.table_name.split('_')[0]} sales {self.measure}{scope}. "
+            f"{leader} leads with {format_number(value)}."
+        )
+
+
+def describe_filters(filters):
+    if not filters:
+        return ""
+    return " for " + ", ".join(" or ".join(values) for _, values in filters)
+
+
+def sql_literal(value):
+    return "N'" + value.replace("'", "''") + "'"
+
+
+def where_clause(filters):
+    conditions = []
+    for column_name, values in filters:
+        if len(values) == 1:
+            conditions.append(f"{column_name} = {sql_literal(values[0])}")
+        else:
+            conditions.append(f"{column_name} IN ({', '.join(sql_literal(value) for value in values)})")
+    return f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+def skeleton(nlp_query):
+    """The question with every known dimension value replaced by ``{}``.
+
+    Returns ``(text, places)`` where ``places[i]`` lists where the i-th
+    value occurs as ``(table, column, value)``.
+    """
+    text = nlp_query.strip().rstrip("?.! ")
+    parts, places, position = [], [], 0
+    for start, end, found in DIMENSIONS.find(text):
+        parts.append(text[position:start])
+        parts.append(_PLACEHOLDER)
+        places.append(found)
+        position = end
+    parts.append(text[position:])
+    return re.sub(r"\s+", " ", "".join(parts)).strip().lower(), places
+
+
+def resolve_filters(places, table_name):
+    """Group the named values by column of ``table_name``; None if any is ambiguous."""
+    filters = {}
+    for found in places:
+        columns = {(column_name, value) for table, column_name, value in found if table == table_name}
+        if len(columns) != 1:
+            return None
+        column_name, value = columns.pop()
+        values = filters.setdefault(column_name, [])
+        if value not in values:
+            values.append(value)
+    return tuple(filters.items())
+
+
+def _entity(word):
+    for entity in ENTITIES:
+        if word in (entity, _PLURALS.get(entity, entity + "s")):
+            return entity
+    return None
+
+
+def _table(word):
+    return f"{word}_sales" if word else None
+
+
+def _measure(word):
+    return "units" if word and "unit" in word else "value"
+
+
+def match_template(nlp_query):
+    """Fill a SQL template for ``nlp_query``, or None to use the LLM pipeline."""
+    text, places = skeleton(nlp_query)
+
+    match = _TOTAL.match(text)
+    if match:
+        table_name = _table(match.group("table"))
+        filters = resolve_filters(places, table_name)
+        if filters is None:
+            return None
+        measure = _measure(match.group("measure"))
+        sql_query = (
+            f"SELECT SUM({MEASURES[table_name][measure]}) AS Total "
+            f"FROM {table_name}{where_clause(filters)}"
+        )
+        return TemplateMatch("total", table_name, sql_query, measure=measure, filters=filters)
+
+    match = _LIST.match(text)
+    if match:
+        entity = _entity(match.group("entity"))
+        for table_name, column_name in ENTITIES[entity].items():
+            filters = resolve_filters(places, table_name)
+            if filters:
+                sql_query = (
+                    f"SELECT DISTINCT {column_name} FROM {table_name}{where_clause(filters)} "
+                    f"ORDER BY {column_name}"
+                )
+                return TemplateMatch("list", table_name, sql_query, entity=entity, filters=filters)
+        return None
+
+    match = _TOP.match(text)
+    if match:
+        entity = _entity(match.group("entity"))
+        count = min(int(match.group("count") or 10), CONFIG.SQL_MAX_ROWS)
+        requested_table = _table(match.group("table"))
+        measure = _measure(match.group("measure"))
+        for table_name, column_name in ENTITIES[entity].items():
+            if requested_table and table_name != requested_table:
+                continue
+            filters = resolve_filters(places, table_name)
+            if filters is None:
+                continue
+            measure_column = MEASURES[table_name][measure]
+            sql_query = (
+                f"SELECT TOP {count} {column_name}, SUM({measure_column}) AS Total "
+                f"FROM {table_name}{where_clause(filters)} GROUP BY {column_name} "
+                "ORDER BY Total DESC"
+            )
+            return TemplateMatch(
+                "top", table_name, sql_query, entity=entity, measure=measure, filters=filters
+            )
+    return None
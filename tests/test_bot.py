@@ -0,0 +1,169 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+
+import bot
+from cache import TTLCache
+from llm import LLMClient
+from preflight import SqlExecutionError
+from schema import TableSchema
+
+
+class ProgrammingError(Exception):
+    pass
+
+
+class PlanCursor:
+    """Compiles a plan for known SQL and rejects anything naming ``Bogus``."""
+
+    def __init__(self, log):
+        self.log = log
+        self.description = [("Total",)]
+        self.rows = []
+
+    def execute(self, sql_query):
+        self.log.append(sql_query)
+        if "Bogus" in sql_query:
+            raise ProgrammingError(
+                "42S22",
+                "[Microsoft][ODBC Driver 18 for SQL Server][SQL Server]"
+                "Invalid column name 'Bogus'. (207) (SQLExecDirectW)",
+            )
+        if sql_query.startswith("SET SHOWPLAN_XML"):
+            self.rows = []
+        elif any(line.startswith("SET SHOWPLAN_XML ON") for line in self.log[-2:-1]):
+            self.rows = [('<StmtSimple StatementSubTreeCost="1.5"/>',)]
+        else:
+            self.rows = [(42,)]
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchone(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class PlanConnection:
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return PlanCursor(self.log)
+
+
+@pytest.fixture
+def plan_check(monkeypatch):
+    errors = SimpleNamespace(
+        Error=Exception, OperationalError=LookupError, ProgrammingError=ProgrammingError, DataError=ValueError
+    )
+    monkeypatch.setattr(bot, "error_types", lambda: errors)
+    monkeypatch.setattr(bot.CONFIG, "SQL_MAX_PLAN_COST", 1000.0)
+    conn = PlanConnection()
+
+    async def run_with_connection(work):
+        return work(conn)
+
+    async def prepare_sql(sql_query):
+        return sql_query
+
+    monkeypatch.setattr(bot, "run_with_connection", run_with_connection)
+    monkeypatch.setattr(bot, "prepare_sql", prepare_sql)
+    monkeypatch.setattr(bot, "RESULT_CACHE", TTLCache(maxsize=10, ttl=60))
+    return conn
+
+
+def test_query_that_fails_to_compile_is_an_execution_error(plan_check):
+    with pytest.raises(SqlExecutionError, match="Invalid column name 'Bogus'"):
+        bot.execute_sql_query("SELECT SUM(Bogus) FROM primary_sales", plan_check)
+    assert plan_check.log[-1] == "SET SHOWPLAN_XML OFF"
+
+
+def test_query_that_fails_to_compile_reaches_repair(plan_check, monkeypatch):
+    repairs = []
+
+    async def repair_sql(nlp_query, table_name, sql_query, error):
+        repairs.append(error)
+        return "SELECT SUM(PrimarySalesReportingValue) AS Total FROM primary_sales"
+
+    monkeypatch.setattr(bot, "repair_sql", repair_sql)
+    monkeypatch.setattr(bot, "SQL_CACHE", TTLCache(maxsize=10, ttl=60))
+    sql_query, results = asyncio.run(
+        bot.run_sql_query_with_repair(
+            "total primary sales",
+            "primary_sales",
+            "SELECT SUM(Bogus) AS Total FROM primary_sales",
+            time.monotonic() + 30,
+        )
+    )
+    assert repairs == ["Invalid column name 'Bogus'."]
+    assert results.rows == [(42,)]
+
+
+def test_throttling_past_the_retry_budget_is_answered_as_unavailable(monkeypatch):
+    calls = []
+
+    async def throttled(request):
+        calls.append(request.path)
+        return web.json_response({"error": "rate limited"}, status=429, headers={"Retry-After": "60"})
+
+    class Schema:
+        async def get(self, table_name):
+            return TableSchema(table_name, [])
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post("/chat", throttled)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        client = LLMClient(backoff_max=8.0)
+        monkeypatch.setattr(bot, "LLM", client)
+        monkeypatch.setattr(bot, "GPT4V_NLP_TO_SQL_ENDPOINT", f"http://127.0.0.1:{port}/chat")
+        try:
+            return await bot.answer_question("which towns did the new salesmen visit")
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    monkeypatch.setattr(bot, "SCHEMA", Schema())
+    monkeypatch.setattr(bot, "SQL_CACHE", TTLCache(maxsize=10, ttl=60))
+    monkeypatch.setattr(bot.CONFIG, "FAST_PATH_ENABLED", False)
+    started = time.monotonic()
+    answer = asyncio.run(scenario())
+    assert answer.text == bot.LLM_UNAVAILABLE_TEXT
+    # Retry-After is over the backoff cap, so it is not waited for
+    assert len(calls) == 1
+    assert time.monotonic() - started < 5
+
+
+@pytest.mark.parametrize("table", [["primary_sales"], {"name": "primary_sales"}, 7, None])
+def test_non_text_table_falls_back_to_the_sql(monkeypatch, table):
+    sql_query = "SELECT SUM(SecondarySalesValue) FROM secondary_sales"
+
+    async def chat(endpoint, key, messages, **kwargs):
+        return json.dumps({"table": table, "sql": sql_query})
+
+    async def known_schemas():
+        return []
+
+    async def ground_values(nlp_query, table_names):
+        return {}
+
+    monkeypatch.setattr(bot, "known_schemas", known_schemas)
+    monkeypatch.setattr(bot, "ground_values", ground_values)
+    monkeypatch.setattr(bot.LLM, "chat", chat)
+    assert bot.parse_sql_reply(json.dumps({"table": table, "sql": sql_query})) == (None, sql_query)
+    assert asyncio.run(bot.nlp_to_table_and_sql("total secondary sales")) == ("secondary_sales", sql_query)
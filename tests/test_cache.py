@@ -0,0 +1,48 @@
+import time
+
+from cache import TTLCache, normalize_query
+
+
+def test_normalize_query_drops_filler_and_case():
+    assert normalize_query("Please show me the Total Sales!") == "total sales"
+    assert normalize_query("what is total sales") == normalize_query("Total   sales?")
+
+
+def test_normalize_query_expands_months():
+    assert normalize_query("sales in Nov-24") == "sales in november-24"
+    assert normalize_query("sales for Sept") == "sales for september"
+
+
+def test_normalize_query_keeps_meaningful_words():
+    assert normalize_query("top 5 not in Gujarat") == "top 5 not in gujarat"
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=10, ttl=0.01)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_ttl_cache_add_only_sets_missing_keys():
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.add("lock", 1)
+    assert not cache.add("lock", 2)
+    assert cache.get("lock") == 1
+    cache.delete("lock")
+    assert cache.add("lock", 3, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.add("lock", 4)
@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import pytest
+
+import bot
+from conversation import ConversationState, is_follow_up
+from results import QueryResult
+from schema import TableSchema
+
+
+@pytest.mark.parametrize(
+    "text, table_name",
+    [
+        ("now only for Maharashtra", "primary_sales"),
+        ("what about Gujarat?", "primary_sales"),
+        ("break that down by zone", "primary_sales"),
+        ("top 5", "secondary_sales"),
+        ("by month", "primary_sales"),
+        ("for Maharashtra", None),
+        ("excluding those in Cluster 2", "secondary_sales"),
+        ("now only dealers in Cluster 2", "secondary_sales"),
+    ],
+)
+def test_refinements_are_follow_ups(text, table_name):
+    assert is_follow_up(text, table_name)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "What is the total primary sales this year?",
+        "Which dealer has the highest sales this month?",
+        "Order value for Adhesives in Nov-24",
+        "Is it possible to see sales by zone?",
+        "For Adhesives total sales in 2024",
+    ],
+)
+@pytest.mark.parametrize("table_name", ["primary_sales", "secondary_sales"])
+def test_standalone_questions_are_not_follow_ups(text, table_name):
+    assert not is_follow_up(text, table_name)
+
+
+def test_follow_up_naming_another_table_is_a_new_question():
+    assert not is_follow_up("now show secondary sales by dealer", "primary_sales")
+    assert is_follow_up("now show secondary sales by dealer", "secondary_sales")
+
+
+def state_sales():
+    return QueryResult(
+        ["CustomerState", "CalendarMonthYear", "PrimarySalesValue"],
+        [("Gujarat", "Nov-24", 100), ("Gujarat", "Dec-24", 150), ("Kerala", "Nov-24", 80)],
+    )
+
+
+def test_rows_of_row_limited_sql_are_not_refined_locally():
+    sql_query = (
+        "SELECT TOP 10 CustomerState, SUM(PrimarySalesValue) FROM primary_sales "
+        "GROUP BY CustomerState"
+    )
+    assert ConversationState("top states", "primary_sales", sql_query, state_sales()).results is None
+    kept = ConversationState("sales by state", "primary_sales", "SELECT * FROM primary_sales", state_sales())
+    assert kept.results is not None
+
+
+def test_two_step_follow_up_keeps_the_local_refinement(monkeypatch):
+    state = ConversationState(
+        "sales by state and month",
+        "primary_sales",
+        "SELECT CustomerState, CalendarMonthYear, SUM(PrimarySalesValue) FROM primary_sales "
+        "GROUP BY CustomerState, CalendarMonthYear",
+        state_sales(),
+    )
+    rewritten = []
+
+    class Schema:
+        async def get(self, table_name):
+            return TableSchema(table_name, [])
+
+    async def chat(endpoint, key, messages, **kwargs):
+        rewritten.append(messages)
+        sql_query = (
+            "SELECT CalendarMonthYear, SUM(PrimarySalesValue) FROM primary_sales "
+            "WHERE CustomerState = 'Gujarat' GROUP BY CalendarMonthYear"
+        )
+        return json.dumps({"sql": sql_query})
+
+    async def run_sql_query_with_repair(question, table_name, sql_query, deadline, cache_repairs=True):
+        rows = [("Nov-24", 100), ("Dec-24", 150)]
+        return sql_query, QueryResult(["CalendarMonthYear", "PrimarySalesValue"], rows)
+
+    monkeypatch.setattr(bot, "SCHEMA", Schema())
+    monkeypatch.setattr(bot.LLM, "chat", chat)
+    monkeypatch.setattr(bot, "run_sql_query_with_repair", run_sql_query_with_repair)
+
+    async def chain():
+        first, state_after_first = await bot.answer_follow_up("only Gujarat", state)
+        second, state_after_second = await bot.answer_follow_up("by month", state_after_first)
+        return first, state_after_first, second, state_after_second
+
+    first, state_after_first, second, state_after_second = asyncio.run(chain())
+    assert [row[0] for row in first.results.rows] == ["Gujarat", "Gujarat"]
+    # The filtered rows are not refined again; the next step goes to SQL
+    assert state_after_first.results is None
+    assert state_after_first.refinements == ("only Gujarat",)
+    assert "Applied to its results but not yet in the SQL: only Gujarat" in rewritten[0][-1]["content"]
+    assert "'Gujarat'" in state_after_second.sql_query
+    assert state_after_second.refinements == ()
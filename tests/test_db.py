@@ -0,0 +1,137 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from db import ConnectionPool, PoolTimeoutError, evict_idle_connections
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+def test_acquire_reuses_released_connection():
+    opened = []
+
+    def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+
+    pool = ConnectionPool(connect, min_size=0, max_size=2)
+
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert len(opened) == 1
+    assert conn.rollbacks == 1
+
+
+def test_connection_context_discards_on_transient_error():
+    pool = ConnectionPool(FakeConnection, min_size=0, max_size=1, is_transient=lambda error: True)
+
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            raise RuntimeError("connection lost")
+    assert conn.closed
+    assert pool.size == 0
+
+
+def test_warm_opens_min_size():
+    pool = ConnectionPool(FakeConnection, min_size=2, max_size=4)
+    pool.warm()
+    assert pool.size == 2
+    assert pool.idle == 2
+
+
+def test_acquire_times_out_when_exhausted():
+    pool = ConnectionPool(FakeConnection, min_size=0, max_size=1)
+    pool.acquire()
+    started = time.monotonic()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire(timeout=0.1)
+    assert time.monotonic() - started >= 0.1
+
+
+def test_waiter_gets_released_connection():
+    pool = ConnectionPool(FakeConnection, min_size=0, max_size=1)
+    conn = pool.acquire()
+    threading.Timer(0.05, pool.release, args=(conn,)).start()
+    assert pool.acquire(timeout=2) is conn
+
+
+def test_idle_connections_above_min_size_are_evicted():
+    pool = ConnectionPool(FakeConnection, min_size=1, max_size=3, idle_timeout=0.01)
+    connections = [pool.acquire() for _ in range(3)]
+    for conn in connections:
+        pool.release(conn)
+    time.sleep(0.02)
+
+    assert pool.evict_idle() == 2
+    assert pool.size == 1
+    assert sum(conn.closed for conn in connections) == 2
+
+
+def test_idle_connections_are_evicted_without_further_checkouts():
+    pool = ConnectionPool(FakeConnection, min_size=1, max_size=3, idle_timeout=0.01)
+    connections = [pool.acquire() for _ in range(3)]
+    for conn in connections:
+        pool.release(conn)
+
+    async def idle_period():
+        task = asyncio.create_task(evict_idle_connections(pool, 0.02))
+        await asyncio.sleep(0.2)
+        task.cancel()
+
+    asyncio.run(idle_period())
+    assert pool.size == 1
+    assert sum(conn.closed for conn in connections) == 2
+
+
+def test_unhealthy_connection_is_replaced():
+    pool = ConnectionPool(
+        lambda: sqlite3.connect(":memory:", check_same_thread=False),
+        min_size=0,
+        max_size=1,
+        health_check_after=0,
+    )
+    pool.release(pool.acquire())
+    stale = pool._idle[-1][0]
+    stale.close()
+
+    fresh = pool.acquire()
+    assert fresh is not stale
+    fresh.execute("SELECT 1")
+
+
+def test_transient_connect_errors_are_retried():
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("login timeout")
+        return FakeConnection()
+
+    pool = ConnectionPool(
+        connect, min_size=0, max_size=1, retries=3, backoff=0, is_transient=lambda error: True
+    )
+    assert isinstance(pool.acquire(), FakeConnection)
+    assert len(attempts) == 3
+
+
+def test_closed_pool_refuses_connections():
+    pool = ConnectionPool(FakeConnection, min_size=1, max_size=1)
+    pool.warm()
+    pool.close()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire(timeout=0.1)
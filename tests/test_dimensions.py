@@ -0,0 +1,75 @@
+import asyncio
+
+from dimensions import DimensionIndex, TrigramIndex
+
+
+class RecordingCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def execute(self, sql_query):
+        self.queries.append(sql_query)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    def __init__(self, rows=()):
+        self.cursor_ = RecordingCursor(list(rows))
+
+    def cursor(self):
+        return self.cursor_
+
+
+def make_index():
+    return DimensionIndex(
+        {"secondary_sales": ("DealerCluster",)},
+        fuzzy_columns={"primary_sales": ("CustomerName",), "secondary_sales": ("DealerName",)},
+        partitions={"primary_sales": "FiscalYear"},
+    )
+
+
+def test_incremental_fetch_skips_name_columns_without_a_partition():
+    conn = RecordingConnection()
+    fetched = make_index().fetch(conn, incremental=True)
+    assert ("secondary_sales", "DealerName") not in fetched
+    assert any("CustomerName" in query and "FiscalYear" in query for query in conn.cursor_.queries)
+
+
+def test_trigram_search_finds_close_names():
+    index = TrigramIndex(["Shree Ganesh Traders", "Laxmi Paints", "Sai Hardware"])
+    assert index.search("shree ganesh", threshold=0.5)[0][1] == "Shree Ganesh Traders"
+    assert index.search("Laxmi Paints")[0] == (1.0, "Laxmi Paints")
+
+
+def test_incremental_names_are_swapped_in_without_touching_the_live_index():
+    dimensions = make_index()
+    key = ("secondary_sales", "DealerName")
+    live = TrigramIndex(["Shree Ganesh Traders", "Laxmi Paints"])
+    dimensions.fuzzy = {key: live}
+
+    added = asyncio.run(dimensions.install_names({key: ["Shree Ganesh Hardware", "Laxmi Paints"]}, full=False))
+    assert added == 1
+    assert dimensions.fuzzy[key] is not live
+    assert len(live) == 2
+    assert [value for _, value in live.search("shree ganesh hardware", threshold=0.3)] == ["Shree Ganesh Traders"]
+    assert dimensions.fuzzy[key].search("shree ganesh hardware")[0] == (1.0, "Shree Ganesh Hardware")
+
+
+def test_snapshot_installs_the_same_index():
+    source = make_index()
+    source.install_dimensions({("secondary_sales", "DealerCluster"): ["Cluster 2"]})
+    source.fuzzy = {("secondary_sales", "DealerName"): TrigramIndex(["Shree Ganesh Traders"])}
+    source.built_at = 1.0
+
+    copy = make_index()
+    asyncio.run(copy.load(source.snapshot()))
+    assert copy.find("sales in cluster 2")[0][2] == [("secondary_sales", "DealerCluster", "Cluster 2")]
+    assert copy.resolve("sales of shree ganesh traders", ["secondary_sales"]) == {
+        ("secondary_sales", "DealerName"): ["Shree Ganesh Traders"]
+    }
@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+from llm import CircuitBreaker, LLMClient, LLMUnavailableError
+
+
+def test_only_one_trial_after_the_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    assert breaker.allow() == "closed"
+    breaker.record_failure()
+    assert breaker.allow() == "trial"
+    assert breaker.allow() is None
+
+
+def test_released_trial_lets_the_next_request_try():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.allow() == "trial"
+    breaker.release()
+    assert breaker.allow() == "trial"
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_post("/chat", handler)
+    runner = web.AppRunner(app, shutdown_timeout=0.1)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/chat"
+
+
+def test_hanging_endpoint_opens_the_circuit():
+    async def hang(request):
+        await asyncio.sleep(5)
+        return web.json_response({})
+
+    async def scenario():
+        runner, url = await serve(hang)
+        client = LLMClient(timeout=0.1, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        try:
+            for _ in range(2):
+                with pytest.raises(asyncio.TimeoutError):
+                    await client.chat(url, "key", [{"role": "user", "content": "hi"}], stage="test")
+            started = time.monotonic()
+            with pytest.raises(LLMUnavailableError):
+                await client.chat(url, "key", [{"role": "user", "content": "hi"}], stage="test")
+            return time.monotonic() - started, client.breaker.state
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    waited, state = asyncio.run(scenario())
+    assert state == "open"
+    assert waited < 0.05
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+import preflight
+from preflight import PreflightError, check_columns, check_statement, ensure_row_limit
+from schema import TableSchema
+
+COLUMNS = {
+    "primary_sales": ["CustomerName", "CustomerZoneName", "PrimarySalesValue", "FiscalYear"],
+    "secondary_sales": ["DealerName", "DealerCluster", "SecondarySalesValue"],
+}
+
+
+class FakeSchema:
+    async def get(self, table_name):
+        return TableSchema(table_name, [(name, "nvarchar") for name in COLUMNS.get(table_name, [])])
+
+
+@pytest.fixture(autouse=True)
+def schema(monkeypatch):
+    monkeypatch.setattr(preflight, "SCHEMA", FakeSchema())
+
+
+def check(sql_query):
+    asyncio.run(check_columns(sql_query))
+
+
+def test_only_single_select_statements_pass():
+    check_statement("SELECT TOP 5 CustomerName FROM primary_sales")
+    check_statement("WITH t AS (SELECT 1 AS x) SELECT x FROM t")
+    for sql_query in (
+        "DELETE FROM primary_sales",
+        "SELECT 1; DROP TABLE primary_sales",
+        "SELECT CustomerName INTO copy FROM primary_sales",
+    ):
+        with pytest.raises(PreflightError):
+            check_statement(sql_query)
+
+
+def test_keywords_inside_literals_are_ignored():
+    check_statement("SELECT CustomerName FROM primary_sales WHERE CustomerName = 'Drop; Delete'")
+
+
+def test_unknown_columns_and_tables_are_reported():
+    with pytest.raises(PreflightError, match="DealerName"):
+        check("SELECT DealerName FROM primary_sales")
+    with pytest.raises(PreflightError, match="Unknown table"):
+        check("SELECT x FROM tertiary_sales")
+
+
+def test_bracketed_aliases_may_contain_spaces():
+    check(
+        "SELECT CustomerZoneName, SUM(PrimarySalesValue) AS [Total Sales] "
+        "FROM primary_sales GROUP BY CustomerZoneName ORDER BY [Total Sales] DESC"
+    )
+
+
+def test_niladic_builtins_are_not_columns():
+    check("SELECT CustomerName, CURRENT_TIMESTAMP AS AsOf FROM primary_sales")
+    check("SELECT DealerName, SYSTEM_USER FROM secondary_sales")
+
+
+def test_derived_table_and_cte_aliases_are_known():
+    check(
+        "SELECT t.DealerCluster, t.Total FROM (SELECT DealerCluster, SUM(SecondarySalesValue) AS Total "
+        "FROM secondary_sales GROUP BY DealerCluster) t ORDER BY t.Total DESC"
+    )
+    check(
+        "WITH totals (Zone, Total) AS (SELECT CustomerZoneName, SUM(PrimarySalesValue) "
+        "FROM primary_sales GROUP BY CustomerZoneName) SELECT Zone, Total FROM totals"
+    )
+
+
+def test_row_limit_is_added_once():
+    assert ensure_row_limit("SELECT CustomerName FROM primary_sales", 10) == (
+        "SELECT TOP 10 CustomerName FROM primary_sales"
+    )
+    assert ensure_row_limit("SELECT DISTINCT TOP 3 DealerName FROM secondary_sales", 10).count("TOP") == 1
+
+
+def test_row_limit_skips_offset_fetch_paging():
+    sql_query = (
+        "SELECT DealerName FROM secondary_sales ORDER BY DealerName "
+        "OFFSET 20 ROWS FETCH NEXT 10 ROWS ONLY"
+    )
+    assert ensure_row_limit(sql_query, 10) == sql_query
+
+
+def test_double_quoted_identifiers_are_columns_and_tables():
+    check(
+        'SELECT "CustomerZoneName", SUM("PrimarySalesValue") AS "Total Sales" '
+        'FROM "primary_sales" GROUP BY "CustomerZoneName"'
+    )
+    with pytest.raises(PreflightError, match="DealerName"):
+        check('SELECT "DealerName" FROM "primary_sales"')
+
+
+def test_offset_fetch_first_is_not_a_column():
+    check(
+        "SELECT DealerName FROM secondary_sales ORDER BY DealerName "
+        "OFFSET 0 ROWS FETCH FIRST 10 ROWS ONLY"
+    )
+
+
+def test_table_hints_are_not_aliases():
+    check("SELECT DealerName FROM secondary_sales WITH (NOLOCK) WHERE DealerCluster = 'Cluster 2'")
+    check("SELECT s.DealerName FROM secondary_sales s WITH (NOLOCK)")
+    with pytest.raises(PreflightError, match="Bogus"):
+        check("SELECT Bogus FROM secondary_sales WITH (NOLOCK)")
@@ -0,0 +1,39 @@
+import base64
+
+from rendering import render_results, serialized_size
+from results import QueryResult
+
+
+def dealer_rows(count):
+    return QueryResult(
+        ["DealerName", "SalesValue"], [(f"Dealer {index}", index * 1000) for index in range(count)]
+    )
+
+
+def test_pages_fit_the_character_limit():
+    rendered = render_results(dealer_rows(500), page_rows=200, max_chars=2000, max_pages=3, csv_max_bytes=0)
+    assert len(rendered.pages) == 3
+    assert all(len(page) <= 2000 for page in rendered.pages)
+    assert rendered.shown_rows == sum(page.count("\n") - 1 for page in rendered.pages)
+    assert rendered.pages[0].splitlines()[2] == "| Dealer 0 | 0 |"
+
+
+def test_csv_attachment_counts_against_the_activity_size():
+    kwargs = dict(page_rows=50, max_chars=5000, max_pages=1, csv_max_bytes=100000)
+    rendered = render_results(dealer_rows(1000), max_activity_bytes=100000, **kwargs)
+    encoded = len(base64.b64encode(rendered.csv))
+    assert serialized_size(f"{rendered.pages[-1]}\n\n{rendered.note}") + encoded <= 100000
+
+    assert render_results(dealer_rows(1000), max_activity_bytes=20000, **kwargs).csv is None
+
+
+def test_trailing_summary_counts_against_the_activity_size():
+    kwargs = dict(page_rows=50, max_chars=5000, max_pages=1, csv_max_bytes=100000, max_activity_bytes=100000)
+    summary_text = "\n\n\n\n**Summary**:\n" + "Sales rose in every zone. " * 1500
+    without_summary = render_results(dealer_rows(3000), **kwargs)
+    encoded = len(base64.b64encode(without_summary.csv))
+    assert serialized_size(f"{without_summary.pages[-1]}\n\n{without_summary.note}") + encoded <= 100000
+
+    rendered = render_results(dealer_rows(3000), trailing_text=summary_text, **kwargs)
+    assert rendered.csv is None
+    assert "CSV" not in rendered.note
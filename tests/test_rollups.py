@@ -0,0 +1,92 @@
+import pytest
+
+from rollups import Rollup, RollupRegistry
+
+
+@pytest.fixture
+def registry():
+    rollups = [
+        Rollup(
+            "rollup_primary_division_month",
+            "primary_sales",
+            ("DivisionName", "CalendarMonthYear", "PostingMonth", "FiscalYearQuarter", "FiscalYear"),
+        ),
+        Rollup(
+            "rollup_primary_zone_quarter",
+            "primary_sales",
+            ("CustomerZoneName", "CustomerState", "FiscalYearQuarter", "FiscalYear"),
+        ),
+        Rollup("rollup_secondary_cluster_month", "secondary_sales", ("DealerCluster", "InvoiceMonth")),
+    ]
+    for rollup, row_count in zip(rollups, (500, 40, 60)):
+        rollup.row_count, rollup.refreshed_at = row_count, 1.0
+    return RollupRegistry(rollups)
+
+
+def test_sums_read_the_summed_measure(registry):
+    sql_query, name = registry.rewrite(
+        "SELECT DivisionName, SUM(PrimarySalesReportingValue) AS Total FROM primary_sales "
+        "WHERE FiscalYear = 2024 GROUP BY DivisionName"
+    )
+    assert name == "rollup_primary_division_month"
+    assert sql_query == (
+        "SELECT DivisionName, SUM(PrimarySalesReportingValue_sum) AS Total "
+        "FROM rollup_primary_division_month WHERE FiscalYear = 2024 GROUP BY DivisionName"
+    )
+
+
+def test_row_counts_add_up_the_stored_counts(registry):
+    sql_query, name = registry.rewrite(
+        "SELECT DealerCluster, COUNT(*) AS Invoices FROM secondary_sales GROUP BY DealerCluster"
+    )
+    assert name == "rollup_secondary_cluster_month"
+    assert "SUM(row_count) AS Invoices" in sql_query
+    assert "COUNT" not in sql_query
+
+
+def test_smallest_covering_rollup_is_chosen(registry):
+    sql_query, name = registry.rewrite(
+        "SELECT FiscalYearQuarter, SUM(PrimarySalesReportingUnit) FROM primary_sales "
+        "GROUP BY FiscalYearQuarter"
+    )
+    assert name == "rollup_primary_zone_quarter"
+    assert "FROM rollup_primary_zone_quarter" in sql_query
+    # Only the larger rollup has DivisionName
+    _, name = registry.rewrite(
+        "SELECT DivisionName, SUM(PrimarySalesReportingUnit) FROM primary_sales GROUP BY DivisionName"
+    )
+    assert name == "rollup_primary_division_month"
+
+
+def test_unrefreshed_rollups_are_not_used(registry):
+    registry.rollups[1].refreshed_at = None
+    _, name = registry.rewrite(
+        "SELECT FiscalYear, SUM(PrimarySalesReportingValue) FROM primary_sales GROUP BY FiscalYear"
+    )
+    assert name == "rollup_primary_division_month"
+
+
+@pytest.mark.parametrize(
+    "sql_query",
+    [
+        "SELECT DivisionName, AVG(PrimarySalesReportingValue) FROM primary_sales GROUP BY DivisionName",
+        "SELECT COUNT(DISTINCT DivisionName) FROM primary_sales",
+        "SELECT DealerCluster, COUNT(DISTINCT InvoiceMonth) FROM secondary_sales GROUP BY DealerCluster",
+    ],
+)
+def test_non_additive_aggregates_are_not_rewritten(registry, sql_query):
+    assert registry.rewrite(sql_query) == (sql_query, None)
+
+
+@pytest.mark.parametrize(
+    "sql_query",
+    [
+        "SELECT DivisionName, SUM(PrimarySalesReportingValue) FROM primary_sales "
+        "WHERE CustomerName = 'Acme' GROUP BY DivisionName",
+        "SELECT CustomerZoneName, SUM(PrimarySalesReportingValue) FROM primary_sales "
+        "WHERE DivisionName = 'Adhesives' GROUP BY CustomerZoneName",
+        "SELECT DivisionName, CustomerName FROM primary_sales GROUP BY DivisionName, CustomerName",
+    ],
+)
+def test_columns_missing_from_every_rollup_are_not_rewritten(registry, sql_query):
+    assert registry.rewrite(sql_query) == (sql_query, None)
@@ -0,0 +1,31 @@
+from router import ROUTER, TableRouter, match_table_name
+
+
+def test_routes_dealer_questions_to_secondary_sales():
+    decision = ROUTER.route("top 10 dealers by secondary sales in Cluster 2")
+    assert decision.table_name == "secondary_sales"
+    assert decision.path == "rules"
+
+
+def test_routes_division_questions_to_primary_sales():
+    decision = ROUTER.route("total primary sales for each division in Nov-24")
+    assert decision.table_name == "primary_sales"
+
+
+def test_inconclusive_question_goes_to_the_llm():
+    decision = ROUTER.route("how are we doing")
+    assert decision.table_name is None
+    assert decision.path == "llm"
+
+
+def test_shared_column_tokens_carry_no_signal():
+    router = TableRouter({"a": ["CustomerName", "DealerName"], "b": ["CustomerName", "PostingMonth"]})
+    assert router.score("customer") == {"a": 0.0, "b": 0.0}
+    assert router.route("dealer").table_name == "a"
+    assert router.route("posting").table_name == "b"
+
+
+def test_match_table_name_in_free_text():
+    assert match_table_name("Table: secondary_sales") == "secondary_sales"
+    assert match_table_name("PrimarySales") == "primary_sales"
+    assert match_table_name("no idea") is None